@@ -1,13 +1,26 @@
 # __author__ = 'dimitrios'
 from __future__ import division
+import argparse
+import glob
+import itertools
+import os
 import random
-from bs4 import BeautifulSoup
+import threading
+import time
+import numpy as np
+from multiprocessing.pool import ThreadPool
 from read import CanvasReader
+from async_read import apply_async
 from utils.file_utilities import *
 from utils.plotting import *
+from utils.html_text import HTMLTextCleaner
+from utils.dates import DateConverter
+from utils.grading import GradingEngine
+from utils.anonymize import KeyedAnonymizer
+from stages import Stage, StageRunner, stage
+from activity_store import ActivityStore
 import utils.config as config
-from datetime import datetime
-from dateutil import tz
+from datetime import datetime, timedelta
 
 
 class CourseCrawler(object):
@@ -15,32 +28,299 @@ class CourseCrawler(object):
     A Class that downloads some data from a Course in Canvas, by using the Canvas API.
     It downloads what was considered necessary for an analysis and comparison for the purposes of an Educational
     Data Mining Project.
-    The data are saved in .csv files under a data directory. (With the exception of discussions which is .json)
+    The data are saved in .col files (typed columnar files, that can be memory mapped, see save_columns) and .csv files
+    under a data directory. (With the exception of discussions which is .json)
     Each function checks if the resulting file already exists, and if so, it does not download it
     The code initially saves a file with student info, and a fake ID for each one. From then onwards, the anonymized
     id is used to represent students
     In order to set it up, one has to change the config file which is in the root directory.
     """
 
-    def __init__(self, print_urls=True):
+    # the keys that are kept of each canvas object (see CanvasReader), the rest (eg the html description of every
+    # assignment) are dropped while the pages are decoded
+    USER_FIELDS = ['id', 'name', 'sortable_name']
+    ASSIGNMENT_FIELDS = ['id', 'name', 'points_possible', 'assignment_group_id']
+    GROUP_FIELDS = ['id', 'name', 'group_weight', 'rules']
+    SUBMISSION_FIELDS = ['id', 'user_id', 'assignment_id', 'grade', 'workflow_state']
+    TOPIC_FIELDS = ['id', 'title', 'message', 'posted_at', 'author', 'last_reply_at']
+    SUMMARY_FIELDS = ['id', 'page_views', 'participations', 'tardiness_breakdown', 'max_page_views',
+                      'max_participations']
+
+    POST_TITLES = ['thread_id', 'post_id', 'parent_id', 'depth', 'user', 'posted_at']
+    THREAD_TITLES = ['thread_id', 'user', 'posted_at', 'replies', 'max_depth', 'participants']
+
+    def __init__(self, print_urls=True, transport=None, workers=1, bulk_gradebook=False, students_per_request=100,
+                 parallel_pages=1, cache=None, incremental=False, discussions_format='json', export_csv=True,
+                 course_id=None, scheduler=None, canvas=None, metrics=None, journal=None,
+                 activity_format='sqlite', anonymization='sequential', anonymization_key=None):
+        """
+        :param print_urls: boolean print every url that is requested
+        :param transport: HTTPTransport to use for all the API calls. If None, one is created for this crawler
+        :param workers: int number of threads used to download independent entities (eg the submissions of each
+        assignment) at the same time. 1 downloads them one by one. Use the max_in_flight of the transport to cap the
+        number of requests sent to canvas at once
+        :param bulk_gradebook: boolean download the gradebook with the students/submissions endpoint (a few requests
+        for a group of students each) instead of one series of requests per assignment. Much faster for large courses
+        :param students_per_request: int how many student ids are put in each bulk request, keeps the url short
+        :param parallel_pages: int threads used to download the pages of one entity in parallel, when canvas gives the
+        number of the last page
+        :param cache: ResponseCache, keeps the downloaded pages between runs so that unchanged pages are not downloaded
+        again. None means no cache
+        :param incremental: boolean instead of skipping the gradebook and discussions when their files exist, update
+        them with the submissions and topics that changed since the last run
+        :param discussions_format: string 'json' saves all the discussions as one json list, 'ndjson' writes each
+        thread on its own line as soon as it is downloaded (for very large forums, can resume a partial file)
+        :param export_csv: boolean the gradebook and analytics tables are saved as columnar .col files (see
+        save_columns), this also saves them as .csv files
+        :param course_id: string the course to download. None means the course_id of the config file
+        :param scheduler: RateLimitScheduler to share the rate limit of the token with other crawlers (see
+        MultiCourseCrawler). If None, one is created for this crawler
+        :param canvas: CanvasReader to download with, instead of one for the token and url of the config file (eg one
+        for a local mock server). transport, parallel_pages, scheduler, cache, metrics and journal are then ignored
+        :param metrics: Metrics that records the requests of each endpoint and the time and output size of each stage
+        (shared with other crawlers, eg by MultiCourseCrawler). If None, one is created. run saves it in
+        ./data/<course name>/tmp/metrics.json and metrics.prom
+        :param journal: PageJournal that saves the progress of long paginated calls, so that if the crawl is
+        interrupted the next run continues them from their last complete page. None means no journal
+        :param activity_format: string 'sqlite' saves the activity of all the students in one indexed file
+        (user_activity_data/activity.sqlite, see ActivityStore), 'csv' saves two csv files for each student
+        :param anonymization: string 'sequential' numbers the students 1, 2, .. in a random order (the numbers are
+        kept in tmp/user_projector.pkl), 'keyed' derives the id of each student from a secret key and the canvas id
+        (see KeyedAnonymizer), so that crawls with the same key give the same ids without sharing any file
+        :param anonymization_key: string secret key of the keyed anonymization. None means the anonymization_key of
+        the config file
+        """
         # read the parameters from config file
         info = config.get_config('info')
-        oauth_token = info['token']
-        base_url = info['canvas_instance_url']
-        api_prefix = info['api_prefix']
-        self.canvas = CanvasReader(oauth_token, base_url, api_prefix, verbose=print_urls)
-        self.course_id = info['course_id']
+        if canvas is None:
+            oauth_token = info['token']
+            base_url = info['canvas_instance_url']
+            api_prefix = info['api_prefix']
+            canvas = CanvasReader(oauth_token, base_url, api_prefix, verbose=print_urls, transport=transport,
+                                  parallel_pages=parallel_pages, scheduler=scheduler, cache=cache, metrics=metrics,
+                                  journal=journal)
+        self.canvas = canvas
+        self.metrics = canvas.api.metrics
+        self.course_id = course_id if course_id is not None else info['course_id']
+        self.workers = workers
+        self.bulk_gradebook = bulk_gradebook
+        self.students_per_request = students_per_request
+        self.incremental = incremental
+        self.discussions_format = discussions_format
+        self.export_csv = export_csv
+        self.activity_format = activity_format
+        self.anonymizer = None
+        if anonymization == 'keyed':
+            self.anonymizer = KeyedAnonymizer(anonymization_key or info.get('anonymization_key'))
+        elif anonymization != 'sequential':
+            raise ValueError('unknown anonymization %s' % anonymization)
+        self.cleaner = HTMLTextCleaner()
+        self.dates = DateConverter(info.get('timezone', 'America/Los_Angeles'))
+        self.timings = []
+        self.stage_listeners = []  # functions called with (stage, seconds) when a stage of run ends
+        self.extra_stages = []  # stages added with add_stage
         course_info = self.canvas.get_course_info(self.course_id)
         self.course_name = course_info['name']
+        self.apply_group_weights = course_info.get('apply_assignment_group_weights', False)
+
+    def _map(self, function, items):
+        """
+        Applies function to every item, using self.workers threads. The results keep the order of items
+        :param function: function of one argument, usually a call to the API
+        :param items: list
+        :return: list of results
+        """
+        if self.workers <= 1 or len(items) <= 1:
+            return map(function, items)
+
+        pool = ThreadPool(min(self.workers, len(items)))
+        try:
+            return pool.map(function, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _imap_unordered(self, function, items):
+        """
+        Same as _map, but yields each result as soon as it is ready (in any order), so the results do not have to be
+        kept in memory
+        :param function: function of one argument
+        :param items: list
+        :return: generator of results
+        """
+        if self.workers <= 1 or len(items) <= 1:
+            for item in items:
+                yield function(item)
+            return
+
+        pool = ThreadPool(min(self.workers, len(items)))
+        try:
+            for result in pool.imap_unordered(function, items):
+                yield result
+        finally:
+            pool.terminate()
+
+    def stages(self):
+        """
+        The stages of run: every method marked with the @stage decorator (in subclasses too), and the stages added
+        with add_stage. To add a stage, decorate a method, eg
+            @stage('quizzes', requires=['users'], outputs=['quizzes.csv'])
+            def _create_quizzes(self, user_projector):
+        :return: list of Stage
+        """
+        return [Stage(info['name'], getattr(self, attribute), info['requires'], info['outputs'])
+                for info, attribute in self.stage_methods()] + self.extra_stages
+
+    @classmethod
+    def stage_methods(cls):
+        """
+        :return: list of (stage info, method name) of the methods marked with @stage, in the order they are defined
+        """
+        methods = []
+        for attribute in dir(cls):
+            info = getattr(getattr(cls, attribute), 'stage_info', None)
+            if info is not None:
+                methods.append((info, attribute))
+        return sorted(methods, key=lambda m: m[0]['order'])
+
+    def add_stage(self, name, function, requires=(), outputs=()):
+        """
+        Adds a stage to run, without subclassing
+        :param name: string
+        :param function: called with the results of the stages it requires
+        :param requires: list of stage names eg ['users'] to get the user projector
+        :param outputs: list of the files it saves (glob patterns under the course directory)
+        """
+        self.extra_stages.append(Stage(name, function, requires, outputs))
+
+    def _output_size(self, stage):
+        """
+        :param stage: Stage
+        :return: int total bytes of the files that the stage saves
+        """
+        size = 0
+        for pattern in stage.outputs:
+            for path in glob.glob('./data/%s/%s' % (self.course_name, pattern)):
+                if os.path.isfile(path):
+                    size += os.path.getsize(path)
+                for root, _, files in os.walk(path):
+                    size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+        return size
+
+    def run(self, report=True, stages=None, parallel=True):
+        """
+        Downloads everything (or some stages). Stages that do not depend on each other run at the same time.
+        self.timings has the seconds that each stage took
+        :param report: boolean print the critical path and the request statistics of the scheduler at the end
+        :param stages: list of stage names eg ['discussions']. The stages they require are run too. None means all
+        :param parallel: boolean False runs the stages one by one
+        """
+        self.timings = []
+        runner = StageRunner(self.stages())
+        outputs = dict((s.name, s) for s in runner.stages.values())
+
+        def done(name, seconds):
+            self.timings.append((name, seconds))
+            self.metrics.record_stage(name, seconds, self._output_size(outputs[name]))
+            for listener in self.stage_listeners:
+                listener(name, seconds)
+
+        t = time.time()
+        add_file_listener(self._record_file)
+        try:
+            _, durations = runner.run(stages, max_parallel=None if parallel else 1, on_done=done)
+        finally:
+            remove_file_listener(self._record_file)
+            self.save_metrics()  # also when a stage failed, the metrics show how far the crawl got
+        if report:
+            seconds, path = runner.critical_path(durations)
+            print '--> %d stages in %.1f seconds (they add up to %.1f), critical path %.1f seconds: %s' % (
+                len(durations), time.time() - t, sum(durations.values()), seconds, ' -> '.join(path))
+            self.canvas.api.scheduler.report()
+
+
+    def _record_file(self, operation, kind, filename, seconds, size):
+        """
+        Listener of the file helpers (see add_file_listener), records the saves and loads of this course in the metrics.
+        Files of other courses (crawled at the same time by MultiCourseCrawler) are left to their crawlers
+        """
+        if os.path.normpath(filename).startswith(os.path.normpath('./data/%s' % self.course_name) + os.sep):
+            self.metrics.record_file(operation, kind, filename, seconds, size)
+
+
+    def save_metrics(self):
+        """
+        Saves the metrics in ./data/<course name>/tmp/metrics.json and, in the prometheus text format, metrics.prom
+        """
+        filename = './data/%s/tmp/metrics.json' % self.course_name
+        make_dir(filename)
+        self.metrics.save_json(filename)
+        self.metrics.save_prometheus(filename[:-len('json')] + 'prom')
+
+
+    def run_async(self, callback=None, error_callback=None):
+        """
+        Non blocking version of run. Starts the crawl in the background and returns at once, so that a service can
+        crawl many courses at the same time (give them one transport, to share the connections)
+        :param callback: function called with None when the crawl is done, from the result handler thread of the pool
+        :param error_callback: function called with the exception if the crawl fails, from the thread of the crawl
+        :return: AsyncResult, .get() waits for the crawl (and raises its exception, if any)
+        """
+        pool = ThreadPool(1)
+        result = apply_async(pool, self.run, callback=callback, error_callback=error_callback)
+        pool.close()  # the thread exits when the crawl is done
+        return result
+
+
+    def _save_table(self, name, titles, rows, extra_rows=None):
+        """
+        Saves a table as ./data/<course name>/<name>.col, a typed columnar file that can be memory mapped (see
+        save_columns), and also as <name>.csv if export_csv is on
+        :param name: string eg 'gradebook'
+        :param titles: list with the title of each column
+        :param rows: list of lists
+        :param extra_rows: list of lists, written in the csv between the titles and the rows (eg max scores). They are
+        kept in the metadata of the columnar file
+        :return:
+        """
+        extra_rows = extra_rows or []
+        width = len(rows[0]) if rows else len(titles)
+        columns = [(titles[i], [row[i] for row in rows]) for i in range(width)]
+        metadata = {'course': self.course_name, 'titles': titles, 'extra_rows': extra_rows}
+        save_columns('./data/%s/%s.col' % (self.course_name, name), columns, metadata)
+        if self.export_csv:
+            save_csv('./data/%s/%s.csv' % (self.course_name, name), [titles] + extra_rows + rows)
 
-    def run(self):
-        user_id_dict = self._create_user_file()
-        self._create_gradebook(user_id_dict)
-        self._create_discussions_file(user_id_dict)
-        self._create_course_analytics()
-        self._create_user_analytics(user_id_dict)
+
+    def _save_table_chunks(self, name, titles, chunks):
+        """
+        Same as _save_table, for a table that is made a part at a time, so that it is never in memory whole (see
+        save_column_chunks)
+        :param name: string eg 'discussion_posts'
+        :param titles: list with the title of each column
+        :param chunks: function that returns an iterable of lists of rows. It is called once for each pass over the
+        table
+        :return:
+        """
+        metadata = {'course': self.course_name, 'titles': titles, 'extra_rows': []}
+        save_column_chunks('./data/%s/%s.col' % (self.course_name, name), titles, chunks, metadata)
+        if self.export_csv:
+            rows = itertools.chain.from_iterable(chunks())
+            save_csv('./data/%s/%s.csv' % (self.course_name, name), itertools.chain([titles], rows))
+
+
+    def _load_table(self, name):
+        """
+        Reads a table saved by _save_table
+        :param name: string eg 'gradebook'
+        :return: titles, extra rows and rows (list of lists)
+        """
+        columns, metadata = load_columns('./data/%s/%s.col' % (self.course_name, name))
+        rows = [list(row) for row in zip(*[array.tolist() for _, array in columns])]
+        return metadata['titles'], metadata['extra_rows'], rows
 
 
+    @stage('users', outputs=['user_info.csv'])
     def _create_user_file(self):
         """
         Creates a file, with user information, which also contains a mapping from actual user id, to a fake anonymous ID
@@ -52,6 +332,8 @@ class CourseCrawler(object):
         filename = './data/%s/user_info.csv' % self.course_name
         projector_filename = './data/%s/tmp/user_projector.pkl' % self.course_name
 
+        if self.anonymizer is not None:
+            return self._create_keyed_user_file(filename, projector_filename)
         if file_exists(filename) and file_exists(projector_filename):
             return load_pickle(projector_filename)
 
@@ -59,7 +341,7 @@ class CourseCrawler(object):
         projector = {}  # project dict for anonymous id's
         user_list = []
 
-        users = self.canvas.get_users(self.course_id)
+        users = self.canvas.get_users(self.course_id, self.USER_FIELDS)
         random.shuffle(users)  # de-identify users
 
         for u in users:
@@ -73,80 +355,167 @@ class CourseCrawler(object):
         return projector
 
 
+    def _create_keyed_user_file(self, filename, projector_filename):
+        """
+        Same as _create_user_file, with keyed ids. Nothing but user_info.csv is saved: the projector is computed again
+        from the canvas ids and the key whenever it is needed.
+        The users are downloaded in every run, so students that joined the course since the last run get their ids
+        (and are added to user_info.csv). Students that left keep their rows
+        :param filename: string user_info.csv
+        :param projector_filename: string the pickle of the sequential ids
+        :return: a dictionary from actual student id to anonymized id
+        """
+        if file_exists(projector_filename):
+            raise ValueError('%s has sequential ids, move the course to keyed ids with: python -m utils.anonymize '
+                             '"./data/%s"' % (filename, self.course_name))
+        user_list = load_csv(filename)[1:] if file_exists(filename) else []
+        known = set(int(row[2]) for row in user_list)
+
+        users = self.canvas.get_users(self.course_id, self.USER_FIELDS)
+        new_users = [u for u in users if u['id'] not in known]
+        projector = self.anonymizer.projector(list(known) + [u['id'] for u in new_users])
+        if new_users or not user_list:
+            user_list.extend([u['name'], u['sortable_name'], u['id'], projector[u['id']]] for u in new_users)
+            user_list.sort(key=lambda row: int(row[3]))  # the order of the rows does not give away anything
+            user_list.insert(0, ['Name', 'Sortable Name', 'Canvas ID', 'Anonymised ID'])
+            save_csv(filename, user_list)
+            if known:
+                print '--> %d new students' % len(new_users)
+        return projector
+
+
+    def _get_submissions_by_student(self, assignments, students):
+        """
+        Downloads the submissions of all the students for all the assignments, with grouped calls to the
+        students/submissions endpoint. Students are split in chunks of self.students_per_request so that the urls stay
+        short. The number of request series is O(students / chunk) rather than O(assignments)
+        :param assignments: list of assignment dictionaries
+        :param students: list of canvas user ids
+        :return: list of lists of submissions, one for each assignment (in the order of assignments)
+        """
+        students = list(students)
+        step = self.students_per_request
+        chunks = [students[i:i + step] for i in range(0, len(students), step)]
+        fields = ['user_id', 'submissions']
+        results = self._map(lambda chunk: self.canvas.get_student_assignment_submissions(self.course_id, chunk,
+                                                                                           fields=fields),
+                            chunks)
+
+        by_assignment = dict((a['id'], []) for a in assignments)
+        for student_groups in results:
+            for student in student_groups:
+                for s in student['submissions']:
+                    if s['workflow_state'] == 'unsubmitted' or s['assignment_id'] not in by_assignment:
+                        continue
+                    by_assignment[s['assignment_id']].append(s)
+
+        return [by_assignment[a['id']] for a in assignments]
+
+    def _gradebook(self, user_ids, grades, assignments, groups):
+        """
+        Builds the gradebook table with the GradingEngine: the grade of each student for each assignment, followed by
+        the percentage of each group and the total (both after the drop rules of the groups, and the total weighted by
+        group if the course applies group weights)
+        :param user_ids: sorted list of anonymized ids, one for each row
+        :param grades: dictionary from anonymized id to a dictionary from assignment id to grade (None if submitted but
+        not graded), for the assignments that the student submitted
+        :param assignments: list of assignment dictionaries
+        :param groups: list of assignment group dictionaries
+        :return: the two title rows (names and max scores), and the rows (list of lists)
+        """
+        engine = GradingEngine(assignments, groups, apply_weights=self.apply_group_weights)
+        scores, graded = engine.score_matrix(grades, user_ids)
+        percentages, totals = engine.percentages_and_totals(scores, graded)
+        table = np.column_stack([np.array(user_ids, dtype=np.float64), scores, percentages, totals])
+
+        names = ['Student ID'] + [a['name'] for a in assignments] + [g['name'] for g in groups] + ['Total']
+        max_scores = ['(Out of possible points)'] + [a['points_possible'] for a in assignments] + \
+            engine.group_max_points().tolist() + [100.0]
+        return [names, max_scores], table.tolist()
+
+
+    @stage('gradebook', requires=['users'], outputs=['gradebook.col', 'gradebook.csv'])
     def _create_gradebook(self, user_ids):
         """
         downloads all the student info
-        creates a csv file that is Students x Grades
+        creates a table that is Students x Grades
+        With incremental sync, and a gradebook from a previous run, only the submissions that were submitted or graded
+        since then are downloaded, and only the rows of their students are updated
         :param course_id: string
         :param user_ids: dictionary from actual user id to anonymized id for this run
         :return:
         """
-        filename = './data/%s/gradebook.csv' % self.course_name
+        filename = './data/%s/gradebook.col' % self.course_name
+        state_filename = './data/%s/tmp/gradebook_state.pkl' % self.course_name
         if file_exists(filename):
-            return
-
-        assignments = self.canvas.get_assignments(self.course_id)
-        groups = self.canvas.get_assignment_groups(self.course_id)
-
-        names = map(lambda x: x['name'], assignments)  # get all the names
-        max_scores = map(lambda x: x['points_possible'], assignments)
+            if not self.incremental:
+                return
+            if file_exists(state_filename) and self._update_gradebook(user_ids, state_filename):
+                return
+
+        since = self._sync_time()
+        assignments = self.canvas.get_assignments(self.course_id, self.ASSIGNMENT_FIELDS)
+        groups = self.canvas.get_assignment_groups(self.course_id, self.GROUP_FIELDS)
+
+        if self.bulk_gradebook:
+            all_submissions = self._get_submissions_by_student(assignments, user_ids.keys())
+        else:
+            # download the submissions for all the assignments (concurrently if self.workers > 1)
+            all_submissions = self._map(lambda a: self.canvas.get_assignment_submissions(self.course_id, a['id'],
+                                                                                        fields=self.SUBMISSION_FIELDS),
+                                        assignments)
+
+        grades = dict((u, {}) for u in user_ids.values())  # for each user, for each assignment
+        for assignment, submissions in zip(assignments, all_submissions):
+            for s in submissions:
+                grades[user_ids[s['user_id']]][assignment['id']] = s['grade']
 
-        names.insert(0, 'Student ID')
-        max_scores.insert(0, '(Out of possible points)')
+        (names, max_scores), gradebook = self._gradebook(sorted(user_ids.values()), grades, assignments, groups)
+        self._save_table('gradebook', names, gradebook, extra_rows=[max_scores])
+        save_pickle(state_filename, {'since': since, 'assignments': assignments, 'groups': groups, 'grades': grades})
 
-        gradebook = np.zeros((len(user_ids), len(assignments) + 1))  # first column is student ID
 
-        gradebook[:, 0] = np.array(range(1, len(user_ids.keys()) + 1))  # student id column
+    def _update_gradebook(self, user_ids, state_filename):
+        """
+        Incremental sync of the gradebook. Downloads only the submissions that changed since the last sync, and updates
+        the grades of their students. The rest of the grades are kept from the last sync.
+        :param user_ids: dictionary from actual user id to anonymized id
+        :param state_filename: string grades and high water mark of the last sync
+        :return: boolean False if the gradebook has to be built from scratch (assignments or students changed)
+        """
+        state = load_pickle(state_filename)
+        since = self._sync_time()
+        assignments = self.canvas.get_assignments(self.course_id, self.ASSIGNMENT_FIELDS)
+        groups = self.canvas.get_assignment_groups(self.course_id, self.GROUP_FIELDS)
+        same_columns = [a['id'] for a in assignments] == [a['id'] for a in state['assignments']] and \
+            [g['id'] for g in groups] == [g['id'] for g in state['groups']]
+        if not same_columns or set(state['grades'].keys()) != set(user_ids.values()):
+            return False
+
+        grades = state['grades']
+        changed = set()
+        for s in self.canvas.get_changed_submissions(self.course_id, state['since'], self.SUBMISSION_FIELDS):
+            if s['user_id'] not in user_ids:
+                continue
+            user_id = user_ids[s['user_id']]
+            grades[user_id][s['assignment_id']] = s['grade']
+            changed.add(user_id)
 
-        user_group_scores = {}  # a dictionary of dictionaries (for each user, for each assigment group)
-        for u in user_ids.values():  # used to compute total grade (weighted)
-            user_group_scores[u] = {}
+        # the table is recomputed from the kept grades, which takes a fraction of a second even for large courses
+        (names, max_scores), gradebook = self._gradebook(sorted(user_ids.values()), grades, assignments, groups)
+        self._save_table('gradebook', names, gradebook, extra_rows=[max_scores])
+        save_pickle(state_filename, {'since': since, 'assignments': assignments, 'groups': groups, 'grades': grades})
+        print '--> %d students with new or graded submissions' % len(changed)
+        return True
 
-        column = 1  # fill in the columns (assignments one by one)
-        for assignment in assignments:
-            id = assignment['id']
-            submissions = self.canvas.get_assignment_submissions(self.course_id, id)
-            group_id = assignment['assignment_group_id']
 
-            for s in submissions:
-                user_id = user_ids[s['user_id']]
-                row = user_id - 1  # -1 because user_id is 1 based
-                gradebook[row, column] = s['grade']
-
-                if s['grade'] is not None:
-                    (received, total) = user_group_scores[user_id].get(group_id, (0, 0))
-                    received += float(s['grade'])
-                    total += float(max_scores[column])
-                    user_group_scores[user_id][group_id] = (received, total)
-
-            column += 1
-
-        group_scores = np.zeros((len(user_ids), len(groups)))
-        i = 0
-        total_score = 0
-        # calculate the total for each user
-        for group in groups:
-            _, total = user_group_scores[1][group['id']]
-            names.append(group['name'])
-            max_scores.append(total)
-            total_score += float(total)
-
-            for user_id in user_ids.values():
-                received, total = user_group_scores[user_id].get(group['id'], (0, 0))
-                if total != 0:
-                    group_scores[user_id - 1, i] = received / total * 100
-                else:
-                    group_scores[user_id - 1, i] = -1
-            i += 1
-        names.append('Total')
-
-        gradebook = np.concatenate((gradebook, group_scores), axis=1)
-        gradebook = gradebook.tolist()
-        gradebook.insert(0, max_scores)  # add max scores
-        gradebook.insert(0, names)  # add titles
-        save_pickle('./data/%s/gradebook.pkl' % self.course_name, gradebook)
-
-        save_csv(filename, gradebook)
+    def _sync_time(self):
+        """
+        High water mark for incremental sync, taken before downloading. It goes a few minutes back, so that changes
+        made while the previous sync was running, or small clock differences with the server, are not missed
+        :return: string ISO 8601 UTC time
+        """
+        return (datetime.utcnow() - timedelta(minutes=5)).strftime('%Y-%m-%dT%H:%M:%SZ')
 
 
     def _clean_text(self, text):
@@ -155,44 +524,119 @@ class CourseCrawler(object):
         :param text: string
         :return: string, all cleaned up
         """
-        return BeautifulSoup(text, 'html.parser').get_text()
+        return self.cleaner.clean(text)
 
 
-    def _get_reply(self, view, user_projector):
+    def _walk_thread(self, topic_id, views, user_projector):
         """
-        Creates a reply, that can be saved in the .json file. Each reply structure has text, user_id, timestamp, and replies
-        The replies field is a list of replies which have the same structure. This can nest infinitely
-        (probably not in canvas)
-        :param view: dictionary that represents a reply to a thread post
+        Goes over the replies of a topic once, with a stack instead of recursion (so deep threads can not reach the
+        recursion limit), and builds both:
+        the nested replies that are saved in the discussions file. Each reply has text, user, timestamp, and replies,
+        a list of replies with the same structure.
+        one row for each reply: [thread id, post id, parent id, depth, user, posted_at], parent id 0 and depth 1 for the
+        replies to the topic itself.
+        Deleted replies are left out, with the replies under them.
+        :param topic_id: int
+        :param views: list of dictionaries, the 'view' of the topic (each has its replies in it)
         :param user_projector: dictionary from user_id to annonymized id
-        :return: ONE reply structure, that can be saved.
+        :return: list of replies, list of rows
+        """
+        replies = []
+        posts = []
+        stack = [(v, replies, 0, 1) for v in reversed(views)]
+        while stack:
+            view, siblings, parent_id, depth = stack.pop()
+            if view.get('deleted', False):  # if it has the field deleted in it, it means it was deleted
+                continue
+            reply = dict()
+            reply['text'] = self._clean_text(view['message'])
+            reply['user'] = user_projector.get(view['user_id'], -1)  # -1 here means the user is no longer in the class
+            reply['posted_at'] = view['created_at']
+            reply['replies'] = []
+            siblings.append(reply)
+            posts.append([topic_id, view['id'], parent_id, depth, reply['user'], reply['posted_at']])
+            stack.extend((r, reply['replies'], view['id'], depth + 1) for r in reversed(view.get('replies', [])))
+        return replies, posts
+
+
+    def _get_thread(self, topic, user_projector):
         """
-        if view.get('deleted', False):  # if it has the field deleted in it, it means it was deleted
-            return None
-        reply = dict()
-        reply['text'] = self._clean_text(view['message'])
-        reply['user'] = user_projector.get(view['user_id'], -1)  # -1 here means the user is no longer in the class???
-        reply['posted_at'] = view['created_at']
-        reply['replies'] = self._get_replies(view.get('replies', []), user_projector)
-        return reply
+        Downloads a topic with all its replies
+        :param topic: dictionary, as returned by get_discussion_topics
+        :param user_projector: dict from canvas_id -> anonymized id
+        :return: the thread structure that is saved in the discussions file, and the rows of its posts (see
+        _walk_thread), starting with the topic itself (post id 0, parent id -1, depth 0)
+        """
+        thread = dict()
+        thread['title'] = self._clean_text(topic['title'])  # each topic has a title
+        thread['text'] = self._clean_text(topic['message'])  # some text
+        thread['posted_at'] = topic['posted_at']  # a timestamp
+        thread['user'] = user_projector[topic['author']['id']]  # and an author
+
+        full_topic = self.canvas.get_discussion_topic(self.course_id, topic['id'])
+        views = full_topic['view']  # views are the replies to the original thread-post
+
+        # clean all the messages of the thread in one batch, _walk_thread then finds them memoized
+        messages = []
+        stack = list(views)
+        while stack:
+            v = stack.pop()
+            if 'message' in v:
+                messages.append(v['message'])
+            stack.extend(v.get('replies', []))
+        self.cleaner.clean_many(messages)
+
+        thread['replies'], posts = self._walk_thread(topic['id'], views, user_projector)
+        posts.insert(0, [topic['id'], 0, -1, 0, thread['user'], thread['posted_at']])
+        return thread, posts
+
+
+    def _save_discussion_posts(self, topics, posts):
+        """
+        Saves the flat tables of the discussions: discussion_posts, one row per post (see _get_thread) in the order of
+        the topics, and discussion_threads, one row per topic with its number of replies, the depth of its deepest
+        reply and the number of distinct participants (the author and the users that replied, without the users that
+        are no longer in the class)
+        :param topics: list of topic dictionaries
+        :param posts: dictionary from topic id to the rows of its posts, for every topic
+        :return:
+        """
+        post_rows = []
+        thread_rows = []
+        for topic in topics:
+            rows = posts[topic['id']]
+            post_rows.extend(rows)
+            thread_rows.append(self._thread_row(topic['id'], rows))
 
+        self._save_table('discussion_posts', self.POST_TITLES, post_rows)
+        self._save_table('discussion_threads', self.THREAD_TITLES, thread_rows)
 
-    def _get_replies(self, replies, user_projector):
+
+    def _thread_row(self, topic_id, rows):
         """
-        Recursively creates a list of replies for a post. Each reply
-        :param replies:
-        :param user_projector:
-        :return: a list of replies, each of whom have their nested replies in them
+        :param topic_id: int
+        :param rows: list, the rows of the posts of the topic (see _get_thread)
+        :return: the row of the topic in discussion_threads (see _save_discussion_posts)
         """
-        result = []
-        for r in replies:
-            if r.get('deleted', False):
-                continue
-            reply = self._get_reply(r, user_projector)
-            result.append(reply)
-        return result
+        participants = set(row[4] for row in rows if row[4] != -1)
+        return [topic_id, rows[0][4], rows[0][5], len(rows) - 1, max(row[3] for row in rows), len(participants)]
+
+
+    def _load_discussion_posts(self):
+        """
+        :return: dictionary from topic id to the rows of its posts, from the discussion_posts table of the last run
+        (empty if there is none)
+        """
+        posts = {}
+        if file_exists('./data/%s/discussion_posts.col' % self.course_name):
+            for row in self._load_table('discussion_posts')[2]:
+                posts.setdefault(row[0], []).append(row)
+        return posts
 
 
+    @stage('discussions', requires=['users'],
+           outputs=['discussions.json', 'discussions.ndjson', 'discussion_posts.col', 'discussion_posts.csv',
+                    'discussion_threads.col', 'discussion_threads.csv'])
     def _create_discussions_file(self, user_projector):
         """
         Creates a .json file with all the discussions from the class. Only keeps some information for each post, in order
@@ -200,69 +644,197 @@ class CourseCrawler(object):
         A Thread has a title, text, timestamp, user id (author) and a list of replies
         The file has the format of a dictionary.
         One of the fields is the field reply. This is a list of dicts ???
+        The posts are also saved flat, one row per post, with a table of statistics per thread (see
+        _save_discussion_posts).
+        The topics are downloaded with self.workers threads.
+        With incremental sync, only the topics whose last_reply_at changed since the last run are downloaded again.
+        With discussions_format 'ndjson', see _create_discussions_ndjson
         :param course_id:
         :param user_projector: dict from canvas_id -> anonymized id
         :return:
         """
+        if self.discussions_format == 'ndjson':
+            return self._create_discussions_ndjson(user_projector)
+
         filename = './data/%s/discussions.json' % self.course_name
-        if file_exists(filename):
+        state_filename = './data/%s/tmp/discussions_state.pkl' % self.course_name
+        if file_exists(filename) and not self.incremental:
             return
 
-        forum = []
-        topics = self.canvas.get_discussion_topics(self.course_id)
+        old_forum = []
+        state = {}  # topic id -> (last_reply_at, position of the thread in the old forum)
+        posts = {}
+        if file_exists(filename) and file_exists(state_filename):
+            old_forum = load_json(filename)
+            state = load_pickle(state_filename)
+            posts = self._load_discussion_posts()
 
+        topics = self.canvas.get_discussion_topics(self.course_id, self.TOPIC_FIELDS)
+
+        def unchanged(topic):  # and its posts are in the table of the last run
+            last_reply_at, position = state.get(topic['id'], (None, None))
+            return position is not None and last_reply_at == topic['last_reply_at'] and topic['id'] in posts
+
+        to_download = [t for t in topics if not unchanged(t)]
+        downloaded = self._map(lambda t: self._get_thread(t, user_projector), to_download)
+        threads = dict((t['id'], thread) for t, (thread, _) in zip(to_download, downloaded))
+        posts.update((t['id'], rows) for t, (_, rows) in zip(to_download, downloaded))
+
+        forum = []
+        new_state = {}
         for topic in topics:
-            thread = dict()
-            thread['title'] = self._clean_text(topic['title'])  # each topic has a title
-            thread['text'] = self._clean_text(topic['message'])  # some text
-            thread['posted_at'] = topic['posted_at']  # a timestamp
-            thread['user'] = user_projector[topic['author']['id']]  # and an author
-            thread['replies'] = []
-
-            full_topic = self.canvas.get_discussion_topic(self.course_id, topic['id'])
-            views = full_topic['view']  # views are the replies to the original thread-post
-            for v in views:
-                if v.get('deleted', False):
-                    continue
-                # recursively creates the nested structure of replies for this view
-                reply = self._get_reply(v, user_projector)
-                thread['replies'].append(reply)
+            if topic['id'] in threads:
+                thread = threads[topic['id']]
+            else:
+                thread = old_forum[state[topic['id']][1]]  # nothing new in this topic
+            new_state[topic['id']] = (topic['last_reply_at'], len(forum))
             forum.append(thread)
 
         save_json(filename, forum)
+        self._save_discussion_posts(topics, posts)
+        save_pickle(state_filename, new_state)
+        if self.incremental:
+            print '--> %d of %d topics downloaded' % (len(to_download), len(topics))
 
 
-    def _clean_date(self, datestr):
+    def _create_discussions_ndjson(self, user_projector):
+        """
+        Same as _create_discussions_file, but writes a .ndjson file (JSON Lines): one thread per line, with an extra
+        topic_id field. Each thread is written as soon as it is downloaded (topics are downloaded with self.workers
+        threads), so memory does not grow with the size of the forum. Lines are in the order the topics finished.
+        The rows of the posts of each topic (see _get_thread) and its row of discussion_threads are written the same
+        way, just before its thread, in tmp/discussion_posts.ndjson. At the end the tables are written from that file
+        one topic at a time (see _save_table_chunks), in the order of the lines, so they are never in memory whole.
+        The files are written as .part files and renamed when all the topics are in them. If the crawl is interrupted,
+        the next run keeps the topics that are in the .part files and downloads the rest.
+        With incremental sync, the threads and posts of the topics whose last_reply_at did not change are copied from
+        the previous files.
+        :param user_projector: dict from canvas_id -> anonymized id
+        :return:
+        """
+        filename = './data/%s/discussions.ndjson' % self.course_name
+        part_filename = filename + '.part'
+        posts_filename = './data/%s/tmp/discussion_posts.ndjson' % self.course_name
+        posts_part_filename = posts_filename + '.part'
+        state_filename = './data/%s/tmp/discussions_ndjson_state.pkl' % self.course_name
+        if file_exists(filename) and not self.incremental:
+            return
+
+        topics = self.canvas.get_discussion_topics(self.course_id, self.TOPIC_FIELDS)
+        state = {}  # topic id -> last_reply_at of the previous run
+        old_posts = set()  # topics in the posts file of the previous run
+        if file_exists(filename) and file_exists(state_filename) and file_exists(posts_filename):
+            state = load_pickle(state_filename)
+            old_posts = set(line['topic_id'] for line in iter_json_lines(posts_filename))
+        unchanged = set(t['id'] for t in topics if t['id'] in old_posts and state.get(t['id']) == t['last_reply_at'])
+
+        done = set()
+        if file_exists(part_filename):
+            repair_json_lines(part_filename)
+            saved_posts = set()
+            if file_exists(posts_part_filename):
+                repair_json_lines(posts_part_filename)
+                saved_posts = set(line['topic_id'] for line in iter_json_lines(posts_part_filename))
+            done = set(thread['topic_id'] for thread in iter_json_lines(part_filename))
+            if done - saved_posts:  # threads written without their posts (by an older version), download them again
+                with open(part_filename + '.tmp', 'w') as fp:
+                    for thread in iter_json_lines(part_filename):
+                        if thread['topic_id'] in saved_posts:
+                            write_json_line(fp, thread)
+                os.rename(part_filename + '.tmp', part_filename)
+                done &= saved_posts
+            if saved_posts - done:  # posts written without their thread (the run stopped between the two lines)
+                with open(posts_part_filename + '.tmp', 'w') as fp:
+                    for line in iter_json_lines(posts_part_filename):
+                        if line['topic_id'] in done:
+                            write_json_line(fp, line)
+                os.rename(posts_part_filename + '.tmp', posts_part_filename)
+
+        make_dir(part_filename)
+        make_dir(posts_part_filename)
+        with open(part_filename, 'a') as fp, open(posts_part_filename, 'a') as posts_fp:
+            if unchanged - done:
+                for line in iter_json_lines(posts_filename):
+                    if line['topic_id'] in unchanged and line['topic_id'] not in done:
+                        write_json_line(posts_fp, line)
+                for thread in iter_json_lines(filename):
+                    if thread['topic_id'] in unchanged and thread['topic_id'] not in done:
+                        write_json_line(fp, thread)
+
+            to_download = [t for t in topics if t['id'] not in done and t['id'] not in unchanged]
+            print '--> Downloading %d of %d topics (%d already saved)' % (len(to_download), len(topics),
+                                                                       len(topics) - len(to_download))
+
+            def download(topic):
+                thread, rows = self._get_thread(topic, user_projector)
+                thread['topic_id'] = topic['id']
+                return thread, rows
+
+            for thread, rows in self._imap_unordered(download, to_download):
+                write_json_line(posts_fp, {'topic_id': thread['topic_id'], 'posts': rows,
+                                           'thread': self._thread_row(thread['topic_id'], rows)})  # before its thread
+                write_json_line(fp, thread)
+
+        topic_ids = set(t['id'] for t in topics)
+
+        def lines():
+            for line in iter_json_lines(posts_part_filename):
+                if line['topic_id'] in topic_ids:
+                    if 'thread' not in line:  # written by an older version
+                        line['thread'] = self._thread_row(line['topic_id'], line['posts'])
+                    yield line
+
+        self._save_table_chunks('discussion_posts', self.POST_TITLES, lambda: (line['posts'] for line in lines()))
+        self._save_table_chunks('discussion_threads', self.THREAD_TITLES,
+                                lambda: ([line['thread']] for line in lines()))
+        os.rename(posts_part_filename, posts_filename)
+        os.rename(part_filename, filename)
+        save_pickle(state_filename, dict((t['id'], t['last_reply_at']) for t in topics))
+
+
+    def _clean_participations(self, participations):
         """
-        return the date in a more human readable form. Also converts from UTC to California time
-        :param data:
-        :return: 3 strings: date, time, url
+        return the dates in a more human readable form. Also converts from UTC to the timezone of the config file
+        :param participations: list of dicts, with url and created_at
+        :return: list of (date, time, url)
         """
-        dt = datetime.strptime(datestr, "%Y-%m-%dT%H:%M:%S")
-        dt = dt.replace(tzinfo=tz.gettz('UTC')).astimezone(tz.gettz('America/Los Angeles'))
-        date = dt.strftime("%Y-%m-%d")
-        time = dt.strftime("%H:%M")
-        return date, time
+        dates, times = self.dates.convert([p['created_at'][:-1] for p in participations])
+        return zip(dates, times, [p['url'] for p in participations])
 
 
-    def _clean_participation(self, data):
-        date, time = self._clean_date(data['created_at'][:-1])
-        return date, time, data['url']
+    def _clean_page_views(self, page_views):
+        """
+        :param page_views: list of (date, views)
+        :return: list of (date, time, views)
+        """
+        dates, times = self.dates.convert([date[:-6] for date, _ in page_views])
+        return zip(dates, times, [views for _, views in page_views])
+
 
+    def _get_user_activity(self, real_user_id):
+        """
+        Downloads the participations and the views of a user.
+        These are aggregated over some time period
+        :param real_user_id: canvas id
+        :return: list of (date, time, url) and list of (date, time, views)
+        """
+        data = self.canvas.get_student_activity_analytics(self.course_id, real_user_id)
+        participation = data['participations']  # list of dicts, with url, and datetime
+        participation = sorted(participation, key=lambda x: x['created_at'])
+        participation = self._clean_participations(participation)
 
-    def _clean_page_view(self, data):
-        date, views = data
-        date, time = self._clean_date(date[:-6])
-        return date, time, views
+        page_views = data['page_views']
+        page_views = sorted(page_views.items())
+        page_views = self._clean_page_views(page_views)
+        return participation, page_views
 
 
     def _save_user_activity(self, user_id, real_user_id):
         """
         Saves two files for each user.
         One with his participations and one with his views.
-        These are aggregated over some time period
-        :param course_id: str
         :param user_id: str
+        :param real_user_id: canvas id
         :return:
         """
         participation_filename = './data/%s/user_activity_data/participation/%s_participation.csv' % (
@@ -270,22 +842,92 @@ class CourseCrawler(object):
         page_views_filename = './data/%s/user_activity_data/page_views/%s_aggregated_page_views.csv' % (
             self.course_name, user_id)
 
-        if file_exists(participation_filename) and file_exists(page_views_filename):
-            return
+        participation, page_views = self._get_user_activity(real_user_id)
+        save_csv(participation_filename, participation, verbose=False)
+        save_csv(page_views_filename, page_views, verbose=False)
 
-        data = self.canvas.get_student_activity_analytics(self.course_id, real_user_id)
-        participation = data['participations']  # list of dicts, with url, and datetime
-        participation = sorted(participation, key=lambda x: x['created_at'])
-        participation = map(self._clean_participation, participation)
 
-        page_views = data['page_views']
-        page_views = sorted(page_views.items())
-        page_views = map(self._clean_page_view, page_views)
+    def _completed_user_activity(self, manifest_filename):
+        """
+        :param manifest_filename: str file with the anonymized id of each student whose activity is saved
+        :return: set of anonymized ids (strings) that do not need to be downloaded again
+        """
+        if file_exists(manifest_filename):
+            return load_lines(manifest_filename)
+
+        # runs from before the manifest existed: a student is done if both files are there
+        directory = './data/%s/user_activity_data/' % self.course_name
+        if not os.path.isdir(directory + 'participation') or not os.path.isdir(directory + 'page_views'):
+            return set()
+        participation = set(f[:-len('_participation.csv')] for f in os.listdir(directory + 'participation'))
+        page_views = set(f[:-len('_aggregated_page_views.csv')] for f in os.listdir(directory + 'page_views'))
+        completed = participation & page_views
+        for user_id in completed:
+            append_line(manifest_filename, user_id)
+        return completed
+
+
+    def _open_activity_store(self):
+        """
+        :return: ActivityStore of the course. The students saved as csv files by an older run are added to a new store
+        """
+        directory = './data/%s/user_activity_data' % self.course_name
+        store = ActivityStore(directory + '/activity.sqlite')
+        if not store.completed():
+            count = store.import_csv(directory, directory + '/completed.txt')
+            if count > 0:
+                print '--> Added the csv files of %d students to %s' % (count, store.filename)
+        return store
 
-        save_csv(participation_filename, participation, verbose=False)
-        save_csv(page_views_filename, page_views, verbose=False)
 
+    def _save_users_activity(self, users):
+        """
+        Saves the activity of many students, with self.workers threads. Each student that is done is written to
+        a manifest (or to the completed table of the store), so an interrupted run continues with the students that
+        are left.
+        :param users: list of (anonymized id, canvas id)
+        :return:
+        """
+        store = None
+        if self.activity_format == 'sqlite':
+            store = self._open_activity_store()
+            completed = store.completed()
+        else:
+            manifest_filename = './data/%s/user_activity_data/completed.txt' % self.course_name
+            completed = self._completed_user_activity(manifest_filename)
+        users = [(user_id, real_user_id) for user_id, real_user_id in users if str(user_id) not in completed]
+        print '--> Downloading the activity of %d students (%d already saved)' % (len(users), len(completed))
+        if len(users) == 0:
+            if store is not None:
+                store.close()
+            return
 
+        lock = threading.Lock()
+        progress = {'done': 0, 'start': time.time()}
+
+        def save(user):
+            if store is not None:
+                store.add(user[0], *self._get_user_activity(user[1]))
+            else:
+                self._save_user_activity(*user)
+            with lock:
+                if store is None:
+                    append_line(manifest_filename, user[0])
+                progress['done'] += 1
+                if progress['done'] % 50 == 0 or progress['done'] == len(users):
+                    elapsed = time.time() - progress['start']
+                    print '--> %d/%d students, %.1f students/s' % (progress['done'], len(users),
+                                                                   progress['done'] / elapsed)
+
+        try:
+            self._map(save, users)
+        finally:
+            if store is not None:
+                store.close()  # writes the last batch, also when a download failed
+
+
+    @stage('user_analytics', requires=['users'],
+           outputs=['student_usage_analytics.col', 'student_usage_analytics.csv', 'user_activity_data'])
     def _create_user_analytics(self, user_projector):
         """
         Saves usage data for each student in the course. (aggregated number of views, participations etc)
@@ -294,11 +936,12 @@ class CourseCrawler(object):
         :param user_projector: dict
         :return:
         """
-        filename = './data/%s/student_usage_analytics.csv' % self.course_name
+        filename = './data/%s/student_usage_analytics.col' % self.course_name
         if file_exists(filename):
             return
-        user_analytics = self.canvas.get_student_summary_analytics(self.course_id)
+        user_analytics = self.canvas.get_student_summary_analytics(self.course_id, self.SUMMARY_FIELDS)
         user_analytics_array = list()
+        users = list()
 
         tmp = user_analytics[0]
         for ua in user_analytics:
@@ -314,25 +957,26 @@ class CourseCrawler(object):
             user_info.append(ua['tardiness_breakdown']['missing'])
             user_info.append(ua['tardiness_breakdown']['on_time'])
             user_analytics_array.append(user_info)
+            users.append((user_id, ua['id']))
 
-            self._save_user_activity(user_projector[ua['id']], ua['id'])
+        self._save_users_activity(users)
 
         user_analytics_array.sort(key=lambda x: x[0])
-        user_analytics_array.insert(0, ['max', tmp['max_page_views'], tmp['max_participations']])
-        user_analytics_array.insert(0,
-                                    ['id', 'page views', 'participations', 'floating submissions', 'late submissions',
-                                     'missing submissions', 'on time submissions'])
-        save_csv(filename, user_analytics_array)
+        titles = ['id', 'page views', 'participations', 'floating submissions', 'late submissions',
+                  'missing submissions', 'on time submissions']
+        self._save_table('student_usage_analytics', titles, user_analytics_array,
+                         extra_rows=[['max', tmp['max_page_views'], tmp['max_participations']]])
 
 
+    @stage('course_analytics', outputs=['course_analytics.col', 'course_analytics.csv', 'course_analytics_hist.pdf'])
     def _create_course_analytics(self):
         """
-        saves a .csv file that contains a row for each day, and the  total number of participations and views for that day
+        saves a table that contains a row for each day, and the  total number of participations and views for that day
         Also saves a plot with the same data
         :param course_id: str eg '1112'
         :return:
         """
-        filename = './data/%s/course_analytics.csv' % self.course_name
+        filename = './data/%s/course_analytics.col' % self.course_name
         plot_name = './data/%s/course_analytics_hist.pdf' % self.course_name
         if file_exists(filename) and file_exists(plot_name):
             return
@@ -344,7 +988,7 @@ class CourseCrawler(object):
         for a in analytics:
             data.append([a['date'], a['participations'], a['views']])
 
-        save_csv(filename, data)
+        self._save_table('course_analytics', data[0], data[1:])
 
         plot_data = []
         plot_data.append(list(zip(*data[1:])[2]))
@@ -354,8 +998,18 @@ class CourseCrawler(object):
 
 
 if __name__ == '__main__':
-    crawler = CourseCrawler()
-    crawler.run()
+    parser = argparse.ArgumentParser(description='downloads the data of the course in config.txt')
+    parser.add_argument('stages', nargs='*', help='stages to run (with the stages they require), all by default')
+    parser.add_argument('--list', action='store_true', help='show the stages and what they require')
+    parser.add_argument('--sequential', action='store_true', help='run the stages one by one')
+    arguments = parser.parse_args()
+
+    if arguments.list:
+        for info, _ in CourseCrawler.stage_methods():
+            print '%-20s requires: %s' % (info['name'], ', '.join(info['requires']) or '-')
+    else:
+        crawler = CourseCrawler()
+        crawler.run(stages=arguments.stages or None, parallel=not arguments.sequential)
 
 
 
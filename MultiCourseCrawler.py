@@ -0,0 +1,120 @@
+# __author__ = 'dimitrios'
+import argparse
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+from calls import HTTPTransport
+from scheduler import RateLimitScheduler
+from read import CanvasReader
+from CourseCrawler import CourseCrawler
+import utils.config as config
+
+
+class MultiCourseCrawler(object):
+    """
+    Downloads many courses (a list of course ids, or all the courses of an account in a term) with CourseCrawler,
+    several courses at the same time.
+    All the crawlers share one connection pool (HTTPTransport) and one RateLimitScheduler, so the whole crawl has a
+    single request budget: at most max_in_flight requests are sent to canvas at the same time, no matter how many
+    courses are running, and the concurrency backs off for all of them when the rate limit of the token gets low.
+    Each course is saved under its own ./data/<course name>/ directory, as with CourseCrawler. A course that fails
+    does not stop the others; its error is shown in the summary.
+    """
+
+    def __init__(self, course_ids=None, account_id=None, term_id=None, courses_at_once=4, max_in_flight=16,
+                 print_urls=False, **crawler_kwargs):
+        """
+        :param course_ids: list of strings eg ['1112', '1113']
+        :param account_id: string if course_ids is None, the courses of this account are downloaded
+        :param term_id: string only the courses of the account in this enrollment term. None means all of them
+        :param courses_at_once: int number of courses downloaded at the same time
+        :param max_in_flight: int max number of requests running at the same time, over all the courses
+        :param print_urls: boolean print every url that is requested
+        :param crawler_kwargs: passed to each CourseCrawler (eg workers, bulk_gradebook, cache, incremental)
+        """
+        self.courses_at_once = courses_at_once
+        self.print_urls = print_urls
+        self.crawler_kwargs = crawler_kwargs
+        self.transport = HTTPTransport(pool_size=max_in_flight, max_in_flight=max_in_flight)
+        self.scheduler = RateLimitScheduler(max_concurrency=max_in_flight)
+
+        if course_ids is None:
+            if account_id is None:
+                raise ValueError('give either course_ids or account_id')
+            info = config.get_config('info')
+            reader = CanvasReader(info['token'], info['canvas_instance_url'], info['api_prefix'], verbose=print_urls,
+                                  transport=self.transport, scheduler=self.scheduler)
+            course_ids = [str(c['id']) for c in reader.get_account_courses(account_id, term_id)]
+        self.course_ids = list(course_ids)
+
+    def _crawl(self, course_id):
+        """
+        Downloads one course
+        :param course_id: string
+        :return: dictionary with the course id and name, the total seconds, the seconds of each stage and the error
+        (None if it succeeded)
+        """
+        t = time.time()
+        result = {'course_id': course_id, 'name': None, 'seconds': 0, 'stages': [], 'error': None}
+        try:
+            crawler = CourseCrawler(print_urls=self.print_urls, transport=self.transport, scheduler=self.scheduler,
+                                    course_id=course_id, **self.crawler_kwargs)
+            result['name'] = crawler.course_name
+            try:
+                crawler.run(report=False)
+            finally:
+                result['stages'] = crawler.timings
+        except Exception:
+            result['error'] = traceback.format_exc().strip().split('\n')[-1]
+            print '--> course %s failed:\n%s' % (course_id, traceback.format_exc())
+        result['seconds'] = time.time() - t
+        return result
+
+    def run(self):
+        """
+        Downloads all the courses, and prints a summary of the time each one took
+        :return: list of dictionaries, one for each course (see _crawl), in the order of course_ids
+        """
+        t = time.time()
+        pool = ThreadPool(self.courses_at_once)
+        try:
+            results = pool.map(self._crawl, self.course_ids, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        self.report(results, time.time() - t)
+        return results
+
+    def report(self, results, seconds):
+        """
+        Prints the time of each course and of its stages
+        :param results: list of dictionaries returned by run
+        :param seconds: float wall time of the whole crawl
+        :return:
+        """
+        print '--> Crawled %d courses in %.1f seconds' % (len(results), seconds)
+        for r in sorted(results, key=lambda x: -x['seconds']):
+            stages = ', '.join('%s %.1f' % (stage, s) for stage, s in r['stages'])
+            status = 'failed: %s' % r['error'] if r['error'] else 'ok'
+            print '    %-10s %-40s %8.1f s  %s  (%s)' % (r['course_id'], (r['name'] or '')[:40], r['seconds'], status,
+                                                         stages)
+        self.scheduler.report()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='downloads several courses at once, with one request budget')
+    parser.add_argument('course_ids', nargs='*', help='ids of the courses, the course of config.txt by default')
+    parser.add_argument('--account', help='download all the courses of this account instead (the token must be an '
+                                          'admin of it)')
+    parser.add_argument('--term', help='with --account, only the courses of this enrollment term')
+    arguments = parser.parse_args()
+    if arguments.account is not None and arguments.course_ids:
+        parser.error('give either course ids or --account, not both')
+    if arguments.term is not None and arguments.account is None:
+        parser.error('--term needs --account')
+
+    if arguments.account is not None:
+        crawler = MultiCourseCrawler(account_id=arguments.account, term_id=arguments.term)
+    else:
+        crawler = MultiCourseCrawler(course_ids=arguments.course_ids or [config.get_config('info')['course_id']])
+    crawler.run()
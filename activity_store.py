@@ -0,0 +1,194 @@
+# __author__ = 'dimitrios'
+import argparse
+import csv
+import itertools
+import os
+import sqlite3
+import threading
+from utils.file_utilities import make_dir, save_csv, load_lines
+
+PARTICIPATION_CSV = '%s/participation/%s_participation.csv'
+PAGE_VIEWS_CSV = '%s/page_views/%s_aggregated_page_views.csv'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS participation (user_id INTEGER NOT NULL, date TEXT NOT NULL, time TEXT NOT NULL,
+                                          url TEXT);
+CREATE TABLE IF NOT EXISTS page_views (user_id INTEGER NOT NULL, date TEXT NOT NULL, time TEXT NOT NULL,
+                                       views INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS completed (user_id INTEGER PRIMARY KEY);
+CREATE INDEX IF NOT EXISTS participation_user_date ON participation (user_id, date);
+CREATE INDEX IF NOT EXISTS participation_date ON participation (date);
+CREATE INDEX IF NOT EXISTS page_views_user_date ON page_views (user_id, date);
+CREATE INDEX IF NOT EXISTS page_views_date ON page_views (date);
+"""
+
+
+class ActivityStore(object):
+    """
+    One sqlite file with the activity of all the students of a course: their participations (date, time, url) and
+    their page views per hour (date, time, views), instead of two small csv files for each student.
+    Students are added in batches, each batch in one transaction together with the list of completed students, so
+    after a crash a student is either fully saved or not at all (and is downloaded again).
+    Both tables are indexed by (anonymized id, date) and by date. Rows keep the order they were added in.
+    export_csv writes the old layout (user_activity_data/participation/<id>_participation.csv and
+    page_views/<id>_aggregated_page_views.csv) when files are needed.
+    """
+
+    def __init__(self, filename, batch_size=50):
+        """
+        :param filename: string eg './data/<course name>/user_activity_data/activity.sqlite'
+        :param batch_size: int students that are kept in memory before they are written in one transaction
+        """
+        make_dir(filename)
+        self.filename = filename
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pending = []  # (user_id, participation, page_views) not written yet
+        self.connection = sqlite3.connect(filename, check_same_thread=False)  # used under self.lock only
+        self.connection.text_factory = str
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def completed(self):
+        """
+        :return: set of the anonymized ids (strings) of the students that are saved (or waiting for the next batch)
+        """
+        with self.lock:
+            saved = set(str(row[0]) for row in self.connection.execute('SELECT user_id FROM completed'))
+        return saved | set(str(user_id) for user_id, _, _ in self.pending)
+
+    def add(self, user_id, participation, page_views):
+        """
+        Adds the activity of a student. It is written with the next batch (see flush)
+        :param user_id: int anonymized id
+        :param participation: list of (date, time, url)
+        :param page_views: list of (date, time, views)
+        :return:
+        """
+        with self.lock:
+            self.pending.append((int(user_id), participation, page_views))
+            if len(self.pending) >= self.batch_size:
+                self._write()
+
+    def flush(self):
+        """
+        Writes the students that were added since the last batch
+        """
+        with self.lock:
+            self._write()
+
+    def _write(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        with self.connection:  # one transaction
+            user_ids = [(user_id,) for user_id, _, _ in pending]
+            self.connection.executemany('DELETE FROM participation WHERE user_id = ?', user_ids)
+            self.connection.executemany('DELETE FROM page_views WHERE user_id = ?', user_ids)
+            self.connection.executemany(
+                'INSERT INTO participation VALUES (?, ?, ?, ?)',
+                ((user_id, date, time, url) for user_id, rows, _ in pending for date, time, url in rows))
+            self.connection.executemany(
+                'INSERT INTO page_views VALUES (?, ?, ?, ?)',
+                ((user_id, date, time, views) for user_id, _, rows in pending for date, time, views in rows))
+            self.connection.executemany('INSERT OR REPLACE INTO completed VALUES (?)', user_ids)
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.connection.close()
+
+    def _select(self, table, columns, user_id=None, start=None, end=None):
+        query = 'SELECT user_id, %s FROM %s' % (columns, table)
+        conditions, arguments = [], []
+        if user_id is not None:
+            conditions.append('user_id = ?')
+            arguments.append(int(user_id))
+        if start is not None:
+            conditions.append('date >= ?')
+            arguments.append(start)
+        if end is not None:
+            conditions.append('date <= ?')
+            arguments.append(end)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY user_id, rowid'
+        with self.lock:
+            return self.connection.execute(query, arguments).fetchall()
+
+    def participation(self, user_id=None, start=None, end=None):
+        """
+        :param user_id: int anonymized id, None means all the students
+        :param start: string first date 'YYYY-MM-DD' (included), None means no limit
+        :param end: string last date (included), None means no limit
+        :return: list of (user_id, date, time, url)
+        """
+        return self._select('participation', 'date, time, url', user_id, start, end)
+
+    def page_views(self, user_id=None, start=None, end=None):
+        """
+        Same as participation
+        :return: list of (user_id, date, time, views)
+        """
+        return self._select('page_views', 'date, time, views', user_id, start, end)
+
+    def export_csv(self, directory):
+        """
+        Writes the two csv files of every completed student, as the crawler saved them before the store
+        :param directory: string eg './data/<course name>/user_activity_data'
+        :return: int number of students
+        """
+        self.flush()
+        user_ids = sorted(int(user_id) for user_id in self.completed())
+        for table, pattern in (('participation', PARTICIPATION_CSV), ('page_views', PAGE_VIEWS_CSV)):
+            rows = getattr(self, table)()
+            by_user = dict((user_id, [row[1:] for row in group])
+                           for user_id, group in itertools.groupby(rows, key=lambda row: row[0]))
+            for user_id in user_ids:
+                save_csv(pattern % (directory, user_id), by_user.get(user_id, []), verbose=False)
+        return len(user_ids)
+
+    def import_csv(self, directory, manifest_filename=None):
+        """
+        Adds the students saved as csv files by a crawl from before the store
+        :param directory: string eg './data/<course name>/user_activity_data'
+        :param manifest_filename: string file with the ids of the completed students. None means the students that
+        have both files
+        :return: int number of students
+        """
+        if manifest_filename is not None and os.path.isfile(manifest_filename):
+            user_ids = load_lines(manifest_filename)
+        else:
+            participation = directory + '/participation'
+            page_views = directory + '/page_views'
+            if not os.path.isdir(participation) or not os.path.isdir(page_views):
+                return 0
+            user_ids = set(f[:-len('_participation.csv')] for f in os.listdir(participation)) & \
+                set(f[:-len('_aggregated_page_views.csv')] for f in os.listdir(page_views))
+
+        count = 0
+        for user_id in sorted(user_ids, key=int):
+            try:
+                with open(PARTICIPATION_CSV % (directory, user_id)) as fp:
+                    participation = [tuple(row) for row in csv.reader(fp)]
+                with open(PAGE_VIEWS_CSV % (directory, user_id)) as fp:
+                    page_views = [(date, time, int(views)) for date, time, views in csv.reader(fp)]
+            except IOError:  # listed but not saved, it is downloaded again
+                continue
+            self.add(user_id, participation, page_views)
+            count += 1
+        self.flush()
+        return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='writes the per student csv files of an activity store')
+    parser.add_argument('store', help='eg "./data/<course name>/user_activity_data/activity.sqlite"')
+    parser.add_argument('directory', nargs='?', help='where the csv files are written, the directory of the store '
+                                                     'by default')
+    args = parser.parse_args()
+    store = ActivityStore(args.store)
+    count = store.export_csv(args.directory or os.path.dirname(args.store))
+    store.close()
+    print '--> Exported the activity of %d students' % count
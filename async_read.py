@@ -0,0 +1,131 @@
+# __author__ = 'dimitrios'
+import traceback
+from multiprocessing.pool import ThreadPool
+from calls import HTTPTransport
+from read import CanvasReader
+
+
+def _guarded(callback, name):
+    """
+    :return: function that calls callback, and prints its exception instead of raising it (an exception in the result
+    handler thread of a pool stops it, and every later call would wait forever)
+    """
+    def call(value):
+        try:
+            callback(value)
+        except Exception:
+            print '--> %s failed:\n%s' % (name, traceback.format_exc())
+    return call
+
+
+def apply_async(pool, function, args=(), kwargs=None, callback=None, error_callback=None):
+    """
+    Same as pool.apply_async, with the error_callback that the python 2 pool does not have. A callback that raises
+    does not stop the pool
+    :param pool: ThreadPool
+    :param function: blocking function to run on the pool
+    :param callback: function called with the result when it is ready, from the result handler thread of the pool
+    :param error_callback: function called with the exception if function raises, from the pool thread that ran it
+    (before .get() raises the exception)
+    :return: AsyncResult
+    """
+    kwargs = kwargs or {}
+
+    def run():
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            if error_callback is not None:
+                _guarded(error_callback, 'error callback of %s' % getattr(function, '__name__', function))(e)
+            raise
+
+    if callback is not None:
+        callback = _guarded(callback, 'callback of %s' % getattr(function, '__name__', function))
+    return pool.apply_async(run, callback=callback)
+
+
+class AsyncAPICalls(object):
+    """
+    Non blocking version of APICalls. Every call returns at once with an AsyncResult, and runs (with its pagination)
+    on a shared pool of threads. The size of the pool is the concurrency limit: at most that many calls are being
+    downloaded at the same time, no matter how many are waiting.
+    Use result.get() to wait for a result, or give a callback, which is called with the result from the result handler
+    thread of the pool (eg to hand it over to an event loop with loop.call_soon_threadsafe), and an error_callback,
+    which is called with the exception of a call that failed (see apply_async).
+    """
+    def __init__(self, api, max_concurrency=10, pool=None):
+        """
+        :param api: APICalls that does the actual requests
+        :param max_concurrency: int number of calls running at the same time (ignored if pool is given)
+        :param pool: ThreadPool to share with other AsyncAPICalls. If None, one is created
+        """
+        self.api = api
+        if pool is None:
+            pool = ThreadPool(max_concurrency)
+        self.pool = pool
+
+    def submit(self, function, *args, **kwargs):
+        """
+        :param function: blocking function to run on the pool
+        :param callback: function called with the result when it is ready (optional keyword argument)
+        :param error_callback: function called with the exception if the call fails (optional keyword argument)
+        :return: AsyncResult
+        """
+        callback = kwargs.pop('callback', None)
+        error_callback = kwargs.pop('error_callback', None)
+        return apply_async(self.pool, function, args, kwargs, callback=callback, error_callback=error_callback)
+
+    def get(self, request_url, to_json=True, parameters=None, single=False, callback=None, error_callback=None):
+        """
+        Same as APICalls.get, but does not wait for the pages to be downloaded
+        :return: AsyncResult of the list of json objects
+        """
+        return self.submit(self.api.get, request_url, to_json=to_json, parameters=parameters, single=single,
+                           callback=callback, error_callback=error_callback)
+
+    def close(self):
+        """
+        Waits for the calls that were submitted, and stops the threads of the pool
+        """
+        self.pool.close()
+        self.pool.join()
+
+
+class AsyncCanvasReader(object):
+    """
+    Non blocking version of CanvasReader. It has the same get_* methods (get_users, get_assignments,
+    get_discussion_topic, the analytics calls, ...), with the same arguments, but each of them returns an AsyncResult
+    right away. The optional callback and error_callback keyword arguments are called with the result or the
+    exception (see AsyncAPICalls).
+    All the calls share one connection pool (HTTPTransport) and one concurrency limit, so many courses can be read at
+    the same time without wrapping every call in a thread:
+        reader = AsyncCanvasReader(token, url, max_concurrency=20)
+        users = [reader.get_users(course_id) for course_id in courses]
+        users = [u.get() for u in users]
+    """
+    def __init__(self, access_token, base_url, api_prefix='/api/v1', verbose=True, transport=None, max_concurrency=10,
+                 pool=None, **kwargs):
+        """
+        :param transport: HTTPTransport. If None, one is created with a connection for each concurrent call
+        :param max_concurrency: int number of calls running at the same time
+        :param pool: ThreadPool to share with other readers
+        :param kwargs: passed to CanvasReader (eg parallel_pages, scheduler, cache)
+        """
+        if transport is None:
+            transport = HTTPTransport(pool_size=max_concurrency)
+        self.reader = CanvasReader(access_token, base_url, api_prefix, verbose=verbose, transport=transport, **kwargs)
+        self.api = AsyncAPICalls(self.reader.api, max_concurrency=max_concurrency, pool=pool)
+
+    def __getattr__(self, name):
+        if not name.startswith('get_') or not hasattr(CanvasReader, name):
+            raise AttributeError(name)
+        method = getattr(self.reader, name)
+
+        def call(*args, **kwargs):
+            return self.api.submit(method, *args, **kwargs)
+        call.__name__ = name
+        call.__doc__ = method.__doc__
+        return call
+
+    def close(self):
+        self.api.close()
@@ -0,0 +1,139 @@
+# __author__ = 'dimitrios'
+"""
+Runs CourseCrawler.run() end to end against a local MockCanvasServer, and reports the wall time, requests, throttled
+requests, bytes and peak memory of each stage. Every result is appended to data/benchmarks/crawl.ndjson with the git
+revision, and compared with the last result of the same scenario, so that regressions between versions show up.
+Run from the root directory:
+    python -m benchmarks.bench_crawl --students 500 --assignments 40 --latency 0.02 --workers 8 --bulk
+With more than 100 students in each bulk request, the submissions of a chunk take several pages:
+    python -m benchmarks.bench_crawl --students 500 --bulk --students-per-request 250
+"""
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import time
+from benchmarks.mock_canvas import MockCanvasServer, SyntheticCourse
+from calls import HTTPTransport
+from read import CanvasReader
+from scheduler import RateLimitScheduler
+from CourseCrawler import CourseCrawler
+from utils.file_utilities import iter_json_lines, make_dir, write_json_line
+
+RESULTS = './data/benchmarks/crawl.ndjson'
+
+
+def revision():
+    """
+    :return: string short git hash of the code that is benchmarked (with + if there are uncommitted changes)
+    """
+    try:
+        rev = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no']).strip()
+        return rev + ('+' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # kilobytes on linux
+
+
+def crawl(scenario):
+    """
+    :param scenario: dictionary with the size of the course, the server and the crawler settings
+    :return: list of dictionaries, one for each stage, and one for the whole crawl
+    """
+    course = SyntheticCourse(1, students=scenario['students'], assignments=scenario['assignments'],
+                             topics=scenario['topics'], replies=scenario['replies'], days=scenario['days'])
+    server = MockCanvasServer([course], latency=scenario['latency'], quota=scenario['quota'],
+                              refill_rate=scenario['refill_rate']).start()
+    shutil.rmtree('./data/%s' % course.name, ignore_errors=True)  # the crawler skips what is already saved
+
+    pool = max(scenario['workers'], scenario['parallel_pages'], 10)
+    reader = CanvasReader('token', server.url, verbose=False, transport=HTTPTransport(pool_size=pool),
+                          parallel_pages=scenario['parallel_pages'], scheduler=RateLimitScheduler(max_concurrency=pool))
+    stages = []
+    last = dict(server.stats())
+
+    def measure(stage, seconds):
+        stats = server.stats()
+        stages.append({'stage': stage, 'seconds': seconds, 'requests': stats['requests'] - last['requests'],
+                       'throttled': stats['throttled'] - last['throttled'], 'bytes': stats['bytes'] - last['bytes'],
+                       'peak_rss_mb': peak_rss_mb()})
+        last.update(stats)
+
+    t = time.time()
+    start = server.stats()
+    crawler = CourseCrawler(print_urls=False, workers=scenario['workers'], bulk_gradebook=scenario['bulk'],
+                            students_per_request=scenario['students_per_request'], course_id='1', canvas=reader)
+    crawler.stage_listeners.append(measure)
+    crawler.run(report=False, parallel=scenario['parallel_stages'])
+    stats = server.stats()
+    stages.append({'stage': 'total', 'seconds': time.time() - t, 'requests': stats['requests'] - start['requests'],
+                   'throttled': stats['throttled'] - start['throttled'], 'bytes': stats['bytes'] - start['bytes'],
+                   'peak_rss_mb': peak_rss_mb()})
+    server.shutdown()
+    return stages
+
+
+def previous(scenario):
+    """
+    :return: the last saved result of the same scenario, or None
+    """
+    if not os.path.isfile(RESULTS):
+        return None
+    last = None
+    for result in iter_json_lines(RESULTS):
+        if result['scenario'] == scenario:
+            last = result
+    return last
+
+
+def report(stages, before):
+    old = dict((s['stage'], s) for s in before['stages']) if before else {}
+    print '%-18s %9s %9s %9s %11s %9s   %s' % ('stage', 'seconds', 'requests', 'throttled', 'KB', 'peak MB',
+                                               'vs %s' % before['revision'] if before else '')
+    for s in stages:
+        change = ''
+        if s['stage'] in old and old[s['stage']]['seconds'] > 0:
+            change = '%+.0f%%' % ((s['seconds'] / old[s['stage']]['seconds'] - 1) * 100)
+        print '%-18s %9.2f %9d %9d %11.1f %9.1f   %s' % (s['stage'], s['seconds'], s['requests'], s['throttled'],
+                                                       s['bytes'] / 1024.0, s['peak_rss_mb'], change)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='end to end crawl benchmark against a mock canvas server')
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--assignments', type=int, default=20)
+    parser.add_argument('--topics', type=int, default=10)
+    parser.add_argument('--replies', type=int, default=30)
+    parser.add_argument('--days', type=int, default=70)
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds added to every request')
+    parser.add_argument('--quota', type=float, default=None, help='rate limit bucket, none by default')
+    parser.add_argument('--refill-rate', type=float, default=10.0, help='quota given back per second')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--parallel-pages', type=int, default=1)
+    parser.add_argument('--bulk', action='store_true', help='bulk gradebook')
+    parser.add_argument('--students-per-request', type=int, default=100,
+                        help='student ids in each bulk request, more than 100 makes every request take several pages')
+    parser.add_argument('--parallel-stages', action='store_true',
+                        help='run independent stages at the same time (the requests and bytes of overlapping stages '
+                             'are then counted in the stage that ends first)')
+    parser.add_argument('--no-save', action='store_true', help='do not append the result to %s' % RESULTS)
+    args = parser.parse_args()
+
+    scenario = dict((k, v) for k, v in vars(args).items() if k != 'no_save')
+    before = previous(scenario)
+    stages = crawl(scenario)
+    report(stages, before)
+    if not args.no_save:
+        make_dir(RESULTS)
+        with open(RESULTS, 'a') as fp:
+            write_json_line(fp, {'revision': revision(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                                 'scenario': scenario, 'stages': stages})
+
+
+if __name__ == '__main__':
+    main()
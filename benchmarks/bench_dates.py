@@ -0,0 +1,56 @@
+# __author__ = 'dimitrios'
+"""
+Compares the rows per second of the per row date conversion (strptime + two tz lookups + two strftime for each row,
+as _clean_date did) with the column conversion of DateConverter, and checks that they give the same dates and times,
+including around the daylight saving changes. Run from the root directory:
+    python -m benchmarks.bench_dates
+"""
+import random
+import time
+from datetime import datetime, timedelta
+from dateutil import tz
+from utils.dates import DateConverter
+
+
+def clean_date(datestr):
+    """
+    the per row conversion, as it was in CourseCrawler
+    """
+    dt = datetime.strptime(datestr, "%Y-%m-%dT%H:%M:%S")
+    dt = dt.replace(tzinfo=tz.gettz('UTC')).astimezone(tz.gettz('America/Los Angeles'))
+    return dt.strftime("%Y-%m-%d"), dt.strftime("%H:%M")
+
+
+def timestamps(rows):
+    """
+    random timestamps over a year, plus every minute around the daylight saving changes of 2016
+    """
+    start = datetime(2016, 1, 1)
+    result = [(start + timedelta(seconds=random.randint(0, 366 * 86400))).strftime('%Y-%m-%dT%H:%M:%S')
+              for _ in range(rows)]
+    for change in (datetime(2016, 3, 13, 10), datetime(2016, 11, 6, 9)):  # 2am local time, in utc
+        for minute in range(-90, 90):
+            result.append((change + timedelta(minutes=minute, seconds=30)).strftime('%Y-%m-%dT%H:%M:%S'))
+    return result
+
+
+def main(rows=100000):
+    data = timestamps(rows)
+
+    t = time.time()
+    expected = zip(*map(clean_date, data))
+    row_time = time.time() - t
+
+    converter = DateConverter('America/Los_Angeles')
+    t = time.time()
+    dates, times = converter.convert(data)
+    column_time = time.time() - t
+
+    mismatches = sum(1 for a, b in zip(zip(*expected), zip(dates, times)) if a != b)
+    print '%d of %d rows match' % (len(data) - mismatches, len(data))
+    print 'per row (strptime)      : %.0f rows/s' % (len(data) / row_time)
+    print 'per column (numpy)      : %.0f rows/s' % (len(data) / column_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# __author__ = 'dimitrios'
+"""
+Compares decoding pages into dictionaries (what r.json() does) with decoding them into Records of a few fields
+(APICalls.iter with fields), for pages of submissions and of assignments with long html descriptions. Prints the
+decode speed and the memory kept by the decoded objects. Run from the root directory:
+    python -m benchmarks.bench_records [--students 2000] [--assignments 20]
+"""
+import argparse
+import sys
+import time
+import simplejson as json
+from benchmarks.mock_canvas import SyntheticCourse
+from records import iter_records, Record
+
+DESCRIPTION = u'<p>Read chapter %d and answer the questions below. Show your work.</p>' + \
+              u'<ol>' + u''.join(u'<li>Question %d: explain why the result holds &amp; give an example.</li>' % q
+                                 for q in range(20)) + u'</ol>'
+
+
+def deep_size(obj, seen=None):
+    """
+    :return: int approximate bytes held by obj and everything it references (shared objects are counted once)
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.iteritems())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_size(v, seen) for v in obj)
+    return size
+
+
+def pages(objects, per_page=100):
+    return [json.dumps(objects[i:i + per_page]) for i in range(0, len(objects), per_page)]
+
+
+def compare(name, bodies, fields):
+    t = time.time()
+    full = [o for body in bodies for o in json.loads(body)]
+    full_time = time.time() - t
+    t = time.time()
+    projected = [r for body in bodies for r in iter_records(body, fields)]
+    projected_time = time.time() - t
+    assert [[o.get(f) for f in fields] for o in full] == [list(r) for r in projected]
+    assert all(isinstance(r, Record) for r in projected)
+
+    size = sum(len(body) for body in bodies) / 1024.0 ** 2
+    print '%s: %d objects, %.1f MB of json' % (name, len(full), size)
+    print '  dictionaries : %6.0f objects/s, %7.1f MB kept' % (len(full) / full_time, deep_size(full) / 1024.0 ** 2)
+    print '  records      : %6.0f objects/s, %7.1f MB kept' % (len(projected) / projected_time,
+                                                              deep_size(projected) / 1024.0 ** 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='decoding into dictionaries vs projected records')
+    parser.add_argument('--students', type=int, default=2000)
+    parser.add_argument('--assignments', type=int, default=20)
+    args = parser.parse_args()
+
+    course = SyntheticCourse(1, students=args.students, assignments=args.assignments)
+    submissions = [course.submission(a, u) for a in course.assignments for u in range(args.students)]
+    compare('submissions', pages(submissions), ['id', 'user_id', 'assignment_id', 'grade', 'workflow_state'])
+
+    assignments = [dict(a, description=DESCRIPTION % a['id'], html_url='https://canvas.example.edu/courses/1/'
+                        'assignments/%d' % a['id']) for a in course.assignments for _ in range(50)]
+    compare('assignments', pages(assignments), ['id', 'name', 'points_possible', 'assignment_group_id'])
+
+
+if __name__ == '__main__':
+    main()
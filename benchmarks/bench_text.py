@@ -0,0 +1,86 @@
+# __author__ = 'dimitrios'
+"""
+Checks that html_to_text gives the same text as BeautifulSoup(text, 'html.parser').get_text() (which the crawler used
+before), and compares their speed. Run from the root directory:
+    python -m benchmarks.bench_text [corpus.json]
+corpus.json is a json list of html strings (eg the raw 'message' fields of discussion entries). Without it, a built in
+corpus of canvas style html is used.
+"""
+import sys
+import time
+import simplejson as json
+from bs4 import BeautifulSoup
+from utils.html_text import html_to_text, HTMLTextCleaner
+
+CORPUS = [
+    u'',
+    u'plain text, no tags at all',
+    u'<p>Hello class,</p>\r\n<p>The midterm is on <strong>Friday</strong>.&nbsp; Bring a pencil &amp; eraser.</p>',
+    u'<p>It&#39;s &#8220;quoted&#8221; &#147;windows&#148; &#x27;hex&#X27; &#0; &#128; &#129; &#1114112;</p>',
+    u'<p>Unknown &foo; entity &amp without semicolon &lt;b&gt; &copy 2016 &AElig;</p>',
+    u'<div class="x"><a href="http://a.b/?q=1&amp;r=2">link</a><br/><img src="x.png" alt="alt"/>after</div>',
+    u'<ul>\n  <li>one</li>\n  <li>two <em>nested <b>deep</b></em></li>\n</ul>',
+    u'<table><tr><td>1</td><td>2</td></tr></table>tail',
+    u'<p>before<!-- a comment -->after</p><!DOCTYPE html><?php echo 1 ?>',
+    u'<script type="text/javascript">var a = "<p>not text</p>";</script><style>p {color: red}</style>visible',
+    u'<![CDATA[ cdata text ]]> and <p>more</p>',
+    u'<p>unclosed <b>bold <i>italic</p> </b> stray </i> end',
+    u'<p>1 < 2 and 3 > 2, a<b</p>',
+    u'<ruby>漢<rp>(</rp><rt>kan</rt><rp>)</rp></ruby>',
+    u'<iframe src="https://www.youtube.com/embed/x" width="560"></iframe><p>video above</p>',
+    u'<p>Unicode éè 中文 emoji \U0001f600</p>',
+    u'<math><mi>x</mi><mo>=</mo><mn>2</mn></math>',
+    u'<p>trailing entity &amp',
+    u'<p>trailing tag <b',
+    u'<pre>\n  code\n    indented\n</pre>\n  <p> </p>\t<textarea>  </textarea>',
+    u'<template><p>hidden</p></template><p>shown</p>',
+    u'<p>a</p>   <p>b</p>\n\n<p>&nbsp;</p> <br> <p>&#32;</p>',
+    u'Q&A',
+    u'R&D',
+    u'<b>x</b> AT&T',
+    u'Week 3 Q&A',
+    u'x &#12',
+    u'\t',
+    u' \n',
+]
+
+
+def soup_text(text):
+    return BeautifulSoup(text, 'html.parser').get_text()
+
+
+def main(corpus=None):
+    if corpus is None:
+        corpus = CORPUS
+    mismatches = 0
+    for text in corpus:
+        expected = soup_text(text)
+        got = html_to_text(text)
+        if got != expected:
+            mismatches += 1
+            print 'MISMATCH %r\n  soup: %r\n  fast: %r' % (text, expected, got)
+    print '%d of %d documents match' % (len(corpus) - mismatches, len(corpus))
+
+    repeats = max(1, 20000 // len(corpus))
+    batch = corpus * repeats
+    t = time.time()
+    map(soup_text, batch)
+    soup_time = time.time() - t
+    t = time.time()
+    map(html_to_text, batch)
+    fast_time = time.time() - t
+    t = time.time()
+    HTMLTextCleaner().clean_many(batch)
+    batch_time = time.time() - t
+
+    print 'BeautifulSoup get_text : %.0f documents/s' % (len(batch) / soup_time)
+    print 'html_to_text           : %.0f documents/s' % (len(batch) / fast_time)
+    print 'clean_many (memoized)  : %.0f documents/s' % (len(batch) / batch_time)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as fp:
+            main(json.load(fp))
+    else:
+        main()
@@ -0,0 +1,43 @@
+# __author__ = 'dimitrios'
+"""
+Compares pages per second of a new connection per page (plain requests.get, the old behavior) against the pooled
+keep-alive HTTPTransport. Run from the root directory:
+    python -m benchmarks.bench_transport
+"""
+import time
+import requests
+from calls import APICalls, HTTPTransport
+from benchmarks.stub_server import StubServer
+
+
+class NoPoolTransport(object):
+    """
+    Opens a new connection for every page, as APICalls did before HTTPTransport existed
+    """
+    def get(self, url, params=None, headers=None):
+        return requests.get(url, params=params, headers=headers)
+
+
+def pages_per_second(transport, api_url, pages, rounds):
+    api = APICalls('token', api_url, verbose=False, transport=transport)
+    t = time.time()
+    for _ in range(rounds):
+        api.get('/courses/1/users', parameters={'per_page': 10})
+    return pages * rounds / (time.time() - t)
+
+
+def main(pages=50, rounds=10):
+    server = StubServer(pages=pages).start()
+    api_url = server.url + '/api/v1'
+
+    before = pages_per_second(NoPoolTransport(), api_url, pages, rounds)
+    after = pages_per_second(HTTPTransport(), api_url, pages, rounds)
+
+    print 'new connection per page: %.1f pages/s' % before
+    print 'pooled keep-alive      : %.1f pages/s' % after
+    print 'speedup                : %.2fx' % (after / before)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,470 @@
+# __author__ = 'dimitrios'
+"""
+A local stand in for a canvas instance, that serves every endpoint CanvasReader uses (and the GraphQL endpoint of
+GraphQLReader), for synthetic courses of any size. Used by the crawl benchmark, and handy to try the crawler without a
+real token:
+    server = MockCanvasServer([SyntheticCourse(1, students=500)], latency=0.05).start()
+    reader = CanvasReader('any token', server.url)
+"""
+import hashlib
+import random
+import re
+import threading
+import time
+import urllib
+import urlparse
+from datetime import datetime, timedelta
+import simplejson as json
+from BaseHTTPServer import BaseHTTPRequestHandler
+from benchmarks.mock_graphql import CanvasSchema, execute
+from benchmarks.stub_server import StubServer
+
+
+class LazyList(object):
+    """
+    A list whose items are made when they are asked for, so that a page of a huge collection (eg the submissions of
+    10000 students) costs only the items of that page
+    """
+    def __init__(self, length, item):
+        """
+        :param length: int number of items
+        :param item: function from the index to the item
+        """
+        self.length = length
+        self.item = item
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.item(i) for i in range(*index.indices(self.length))]
+        return self.item(index)
+
+
+class SyntheticCourse(object):
+    """
+    A fake course with students, assignments in groups, submissions, discussions and analytics. The same arguments
+    always give the same course
+    """
+    START = datetime(2016, 1, 4, 8, 0, 0)
+
+    def __init__(self, course_id=1, students=100, assignments=20, groups=4, topics=10, replies=30, days=70, seed=0,
+                 name=None):
+        """
+        :param course_id: int
+        :param students: int
+        :param assignments: int
+        :param groups: int number of assignment groups
+        :param topics: int number of discussion topics
+        :param replies: int number of replies in each topic (nested at random)
+        :param days: int length of the course, for the dates of the activity
+        :param seed: int
+        :param name: string name of the course. None gives one from the id and the size
+        """
+        self.id = course_id
+        self.name = name or 'Synthetic Course %d (%d students)' % (course_id, students)
+        self.students = students
+        self.days = days
+        self.seed = seed
+        self.replies = replies
+
+        self.users = LazyList(students, lambda i: {
+            'id': self.user_id(i), 'name': 'Student %d' % i, 'sortable_name': '%d, Student' % i,
+            'short_name': 'Student %d' % i})
+        self.groups = [{'id': g + 1, 'name': 'Group %d' % (g + 1), 'position': g + 1,
+                        'group_weight': 100.0 / groups,
+                        'rules': {'drop_lowest': 1} if g == 0 and assignments >= 2 * groups else {}}
+                       for g in range(groups)]
+        self.assignments = [{'id': 100 + a, 'name': 'Assignment %d' % (a + 1), 'course_id': course_id,
+                             'points_possible': 10.0 * (1 + a % 3), 'assignment_group_id': 1 + a % groups,
+                             'position': a + 1, 'published': True, 'grading_type': 'points',
+                             'due_at': self._time(days * (a + 1) // (assignments + 1))}
+                            for a in range(assignments)]
+        self.topics = [{'id': t + 1, 'title': '<b>Topic %d</b>' % (t + 1),
+                        'message': '<p>What do you think about question %d? &amp; why</p>' % (t + 1),
+                        'posted_at': self._time(t), 'last_reply_at': self._time(t + 1),
+                        'author': {'id': self.user_id(t % max(students, 1))},
+                        'discussion_subentry_count': replies}
+                       for t in range(topics)]
+
+    def _random(self, *key):
+        return random.Random(hash((self.seed,) + key))
+
+    def _time(self, day, seconds=0):
+        return (self.START + timedelta(days=day, seconds=seconds)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def user_id(self, index):
+        return 1000 + index
+
+    def submission(self, assignment, user_index):
+        """
+        :param assignment: dictionary
+        :param user_index: int
+        :return: dictionary, one of every ten is unsubmitted and one of every ten is submitted but not graded
+        """
+        rng = self._random('submission', assignment['id'], user_index)
+        state = rng.random()
+        s = {'id': assignment['id'] * 1000000 + user_index, 'user_id': self.user_id(user_index),
+             'assignment_id': assignment['id'], 'excused': False, 'late': rng.random() < 0.1, 'attempt': 1,
+             'submission_type': 'online_text_entry', 'grade': None, 'score': None, 'submitted_at': None,
+             'graded_at': None, 'workflow_state': 'unsubmitted'}
+        if state < 0.1:
+            return s
+        s['submitted_at'] = self._time(rng.randint(0, self.days - 1), rng.randint(0, 86399))
+        s['workflow_state'] = 'submitted'
+        if state < 0.2:
+            return s
+        score = float(rng.randint(0, int(assignment['points_possible'])))
+        s.update({'workflow_state': 'graded', 'score': score, 'grade': '%g' % score, 'graded_at': s['submitted_at']})
+        return s
+
+    def assignment_submissions(self, assignment):
+        return LazyList(self.students, lambda i: self.submission(assignment, i))
+
+    def student_submissions(self, user_indices, grouped):
+        """
+        :param user_indices: list of int
+        :param grouped: boolean
+        :return: list of dictionaries, one for each student (with their submissions) if grouped, else one for each
+        submission
+        """
+        if grouped:
+            return LazyList(len(user_indices), lambda i: {
+                'user_id': self.user_id(user_indices[i]), 'section_id': 1,
+                'submissions': [self.submission(a, user_indices[i]) for a in self.assignments]})
+        per_student = len(self.assignments)
+        return LazyList(len(user_indices) * per_student, lambda i: self.submission(self.assignments[i % per_student],
+                                                                                   user_indices[i // per_student]))
+
+    def topic_view(self, topic_id):
+        """
+        :return: dictionary with the replies of a topic, nested at random, some of them deleted
+        """
+        rng = self._random('topic', topic_id)
+        view = []
+        entries = []
+        for r in range(self.replies):
+            if rng.random() < 0.05:
+                entry = {'id': topic_id * 100000 + r, 'deleted': True}
+            else:
+                entry = {'id': topic_id * 100000 + r, 'user_id': self.user_id(rng.randrange(max(self.students, 1))),
+                         'message': '<p>reply <i>%d</i> to topic %d</p>' % (r, topic_id),
+                         'created_at': self._time(topic_id + rng.randint(0, 5), rng.randint(0, 86399))}
+            parent = rng.choice(entries) if entries and rng.random() < 0.6 else None
+            if parent is None:
+                view.append(entry)
+            else:
+                parent.setdefault('replies', []).append(entry)
+            if 'deleted' not in entry:
+                entries.append(entry)
+        return {'view': view, 'participants': [], 'unread_entries': [], 'new_entries': [], 'forced_entries': []}
+
+    def student_summary(self, user_index):
+        rng = self._random('summary', user_index)
+        return {'id': self.user_id(user_index), 'page_views': rng.randint(0, 2000),
+                'participations': rng.randint(0, 200), 'max_page_views': 2000, 'max_participations': 200,
+                'tardiness_breakdown': {'floating': 0, 'late': rng.randint(0, 3), 'missing': rng.randint(0, 3),
+                                        'on_time': rng.randint(0, len(self.assignments))}}
+
+    def student_activity(self, user_index):
+        rng = self._random('activity', user_index)
+        page_views = {}
+        for day in range(self.days):
+            for hour in rng.sample(range(24), rng.randint(0, 3)):
+                moment = self.START + timedelta(days=day, hours=hour)
+                page_views[moment.strftime('%Y-%m-%dT%H:00:00-00:00')] = rng.randint(1, 40)
+        participations = [{'created_at': self._time(rng.randint(0, self.days - 1), rng.randint(0, 86399)),
+                           'url': 'http://canvas.example.com/courses/%d/discussion_topics/%d' % (self.id, t['id'])}
+                          for t in self.topics if rng.random() < 0.5]
+        return {'page_views': page_views, 'participations': participations}
+
+    def course_activity(self):
+        rng = self._random('course activity')
+        return [{'date': (self.START + timedelta(days=day)).strftime('%Y-%m-%d'),
+                 'participations': rng.randint(0, 5 * self.students), 'views': rng.randint(0, 50 * self.students)}
+                for day in range(self.days)]
+
+    def assignment_analytics(self):
+        return [{'assignment_id': a['id'], 'title': a['name'], 'points_possible': a['points_possible'],
+                 'due_at': a['due_at'], 'max_score': a['points_possible'], 'min_score': 0,
+                 'median': a['points_possible'] / 2, 'tardiness_breakdown': {'on_time': 0.8, 'late': 0.1,
+                                                                             'missing': 0.1}}
+                for a in self.assignments]
+
+    def info(self):
+        return {'id': self.id, 'name': self.name, 'course_code': 'SYN%d' % self.id, 'account_id': 1,
+                'enrollment_term_id': 1, 'workflow_state': 'available', 'apply_assignment_group_weights': True,
+                'start_at': self._time(0), 'end_at': self._time(self.days), 'default_view': 'modules'}
+
+
+class MockCanvasHandler(BaseHTTPRequestHandler):
+    """
+    Answers the canvas API calls of CanvasReader from the synthetic courses of the server. Collections are paginated
+    with the page and per_page parameters and a Link header, as canvas does. Every response has the rate limit headers,
+    and requests are refused with 403 (Rate Limit Exceeded) while the quota of the server is used up.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    ROUTES = [
+        (r'^/accounts/(\d+)/courses$', 'account_courses'),
+        (r'^/courses/(\d+)$', 'course'),
+        (r'^/courses/(\d+)/users$', 'users'),
+        (r'^/courses/(\d+)/students/submissions$', 'student_submissions'),
+        (r'^/courses/(\d+)/assignments$', 'assignments'),
+        (r'^/courses/(\d+)/assignments/(\d+)/submissions$', 'assignment_submissions'),
+        (r'^/courses/(\d+)/assignment_groups$', 'assignment_groups'),
+        (r'^/courses/(\d+)/discussion_topics$', 'discussion_topics'),
+        (r'^/courses/(\d+)/discussion_topics/(\d+)/view$', 'topic_view'),
+        (r'^/courses/(\d+)/analytics/student_summaries$', 'student_summaries'),
+        (r'^/courses/(\d+)/analytics/users/(\d+)/activity$', 'student_activity'),
+        (r'^/courses/(\d+)/analytics/activity$', 'course_activity'),
+        (r'^/courses/(\d+)/analytics/assignments$', 'assignment_analytics'),
+    ]
+    ROUTES = [(re.compile(pattern), name) for pattern, name in ROUTES]
+
+    def do_GET(self):
+        parsed = urlparse.urlparse(self.path)
+        query = urlparse.parse_qsl(parsed.query, keep_blank_values=True)
+        path = parsed.path
+        if path.startswith(self.server.api_prefix):
+            path = path[len(self.server.api_prefix):]
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        remaining, cost, allowed = self.server.spend()
+        if not allowed:
+            return self._send(403, '403 Forbidden (Rate Limit Exceeded)', remaining, cost, content_type='text/plain')
+
+        for pattern, name in self.ROUTES:
+            match = pattern.match(path)
+            if match is None:
+                continue
+            args = [int(a) for a in match.groups()]
+            course = self.server.courses.get(args[0]) if name != 'account_courses' else None
+            if name != 'account_courses' and course is None:
+                break
+            result = getattr(self, '_' + name)(course, args[1:], query)
+            if isinstance(result, (list, LazyList)):
+                return self._send_page(parsed.path, query, result, remaining, cost)
+            return self._send(200, json.dumps(result), remaining, cost)
+
+        self._send(404, json.dumps({'errors': [{'message': 'The specified resource does not exist.'}]}), remaining,
+                   cost)
+
+    def do_POST(self):
+        """
+        The GraphQL endpoint (see mock_graphql). Every query costs request_cost, plus node_cost for each node it returns
+        """
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        remaining, cost, allowed = self.server.spend()
+        if not allowed:
+            return self._send(403, '403 Forbidden (Rate Limit Exceeded)', remaining, cost, content_type='text/plain')
+        if urlparse.urlparse(self.path).path != self.server.graphql_path:
+            return self._send(404, json.dumps({'errors': [{'message': 'The specified resource does not exist.'}]}),
+                              remaining, cost)
+        try:
+            query = json.loads(body)['query']
+        except (ValueError, KeyError, TypeError):
+            return self._send(400, json.dumps({'errors': [{'message': 'No query string was present'}]}), remaining,
+                              cost)
+        result, nodes = execute(CanvasSchema(self.server.courses), query, self.server.max_complexity)
+        extra = self.server.spend_extra(nodes * self.server.node_cost)
+        self._send(200, json.dumps(result), remaining - extra, cost + extra)
+
+    def _send_page(self, path, query, collection, remaining, cost):
+        parameters = dict(query)
+        page = int(parameters.get('page', 1))
+        per_page = min(int(parameters.get('per_page', 10)), 100)
+        pages = max(1, (len(collection) + per_page - 1) // per_page)
+        records = collection[(page - 1) * per_page:page * per_page]
+        self._send(200, json.dumps(records), remaining, cost, links=self._links(path, query, page, pages))
+
+    def _links(self, path, query, page, pages):
+        """
+        :return: canvas style Link header, that keeps the parameters of the request (every value of array parameters
+        like student_ids[], the last value of the others)
+        """
+        links = [('current', page), ('first', 1)]
+        if page < pages:
+            links.append(('next', page + 1))
+        if page > 1:
+            links.append(('prev', page - 1))
+        links.append(('last', pages))
+
+        last = dict(query)
+        others = []
+        for k, v in query:
+            if k in ('page', 'access_token'):
+                continue
+            if k.endswith('[]'):
+                others.append((k, v))
+            elif k in last:
+                others.append((k, last.pop(k)))
+        result = []
+        for rel, number in links:
+            url = '%s%s?%s' % (self.server.url, path, urllib.urlencode(others + [('page', number)]))
+            result.append('<%s>; rel="%s"' % (url, rel))
+        return ','.join(result)
+
+    def _send(self, status, body, remaining, cost, links=None, content_type='application/json; charset=utf-8'):
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            status, body = 304, ''
+        self.send_response(status)
+        if status != 304:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('X-Rate-Limit-Remaining', '%.3f' % remaining)
+        self.send_header('X-Request-Cost', '%.3f' % cost)
+        if links:
+            self.send_header('Link', links)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(len(body))
+
+    def _account_courses(self, course, args, query):
+        return [c.info() for c in self.server.courses.values()]
+
+    def _course(self, course, args, query):
+        return course.info()
+
+    def _users(self, course, args, query):
+        return course.users
+
+    def _student_submissions(self, course, args, query):
+        students = [v for k, v in query if k == 'student_ids[]']
+        if students == ['all'] or not students:
+            indices = range(course.students)
+        else:
+            indices = [int(s) - course.user_id(0) for s in students]
+            indices = [i for i in indices if 0 <= i < course.students]
+        parameters = dict(query)
+        grouped = parameters.get('grouped', 'false').lower() in ('true', '1')
+        since = parameters.get('submitted_since') or parameters.get('graded_since')
+        if since is None:
+            return course.student_submissions(indices, grouped)
+        field = 'submitted_at' if 'submitted_since' in parameters else 'graded_at'
+        since = since.replace('Z', '')
+        return [s for s in course.student_submissions(indices, False)[:]
+                if s[field] is not None and s[field].replace('Z', '') > since]
+
+    def _assignments(self, course, args, query):
+        return course.assignments
+
+    def _assignment_submissions(self, course, args, query):
+        for a in course.assignments:
+            if a['id'] == args[0]:
+                return course.assignment_submissions(a)
+        return []
+
+    def _assignment_groups(self, course, args, query):
+        return course.groups
+
+    def _discussion_topics(self, course, args, query):
+        return course.topics
+
+    def _topic_view(self, course, args, query):
+        return course.topic_view(args[0])
+
+    def _student_summaries(self, course, args, query):
+        return LazyList(course.students, course.student_summary)
+
+    def _student_activity(self, course, args, query):
+        return course.student_activity(args[0] - course.user_id(0))
+
+    def _course_activity(self, course, args, query):
+        return course.course_activity()
+
+    def _assignment_analytics(self, course, args, query):
+        return course.assignment_analytics()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockCanvasServer(StubServer):
+    """
+    Serves synthetic courses like a canvas instance, with a rate limit that works like the one of canvas: a bucket of
+    quota that every request takes its cost from, and that fills up again at a steady rate. While the bucket is empty,
+    requests are refused with 403 Forbidden (Rate Limit Exceeded).
+    Keeps the number of requests, throttled requests and bytes sent.
+    """
+
+    def __init__(self, courses, port=0, latency=0.0, quota=None, refill_rate=10.0, request_cost=1.0,
+                 api_prefix='/api/v1', graphql_path='/api/graphql', node_cost=0.01, max_complexity=None):
+        """
+        :param courses: list of SyntheticCourse
+        :param port: int 0 picks a free port
+        :param latency: float seconds each request waits before it is answered
+        :param quota: float size of the rate limit bucket. None means no rate limit (the headers are still sent)
+        :param refill_rate: float quota given back per second
+        :param request_cost: float quota taken by each request
+        :param api_prefix: string
+        :param graphql_path: string path of the GraphQL endpoint
+        :param node_cost: float quota taken by each node a GraphQL query returns, on top of request_cost
+        :param max_complexity: int GraphQL queries that can return more nodes than this are refused with an error.
+        None means no limit
+        """
+        StubServer.__init__(self, port=port)
+        self.RequestHandlerClass = MockCanvasHandler
+        self.courses = dict((c.id, c) for c in courses)
+        self.latency = latency
+        self.quota = quota
+        self.refill_rate = refill_rate
+        self.request_cost = request_cost
+        self.api_prefix = api_prefix
+        self.graphql_path = graphql_path
+        self.node_cost = node_cost
+        self.max_complexity = max_complexity
+
+        self.lock = threading.Lock()
+        self.remaining = quota if quota is not None else 700.0
+        self.last_refill = time.time()
+        self.requests = 0
+        self.throttled = 0
+        self.bytes = 0
+
+    def spend(self):
+        """
+        Takes the cost of a request from the quota
+        :return: the remaining quota, the cost, and whether the request is allowed
+        """
+        with self.lock:
+            self.requests += 1
+            if self.quota is None:
+                return self.remaining, self.request_cost, True
+            now = time.time()
+            self.remaining = min(self.quota, self.remaining + (now - self.last_refill) * self.refill_rate)
+            self.last_refill = now
+            if self.remaining < self.request_cost:
+                self.throttled += 1
+                return self.remaining, 0.0, False
+            self.remaining -= self.request_cost
+            return self.remaining, self.request_cost, True
+
+    def spend_extra(self, cost):
+        """
+        Takes more quota for a request that was already allowed (eg for the size of a GraphQL query). The quota can go
+        below zero, then the next requests are refused until it fills up again
+        :return: the cost taken
+        """
+        with self.lock:
+            if self.quota is not None:
+                self.remaining -= cost
+            return cost
+
+    def count(self, size):
+        with self.lock:
+            self.bytes += size
+
+    def stats(self):
+        """
+        :return: dictionary with the requests, throttled requests and bytes served so far
+        """
+        with self.lock:
+            return {'requests': self.requests, 'throttled': self.throttled, 'bytes': self.bytes}
@@ -0,0 +1,250 @@
+# __author__ = 'dimitrios'
+"""
+A small GraphQL endpoint for MockCanvasServer (POST /api/graphql), with the part of the canvas schema that
+GraphQLReader uses: course(id) with its assignments, assignment groups and users, assignment(id) with its submissions.
+Lists are cursor paginated connections (first, after, nodes, pageInfo { hasNextPage endCursor }), as in canvas.
+The parser knows queries with aliases, arguments and nested selections, written with literal values (no variables or
+fragments).
+"""
+import base64
+import re
+
+MAX_PAGE_SIZE = 100
+
+_token = re.compile(r'(?P<skip>[\s,]+|#[^\n]*)|(?P<punct>[{}():\[\]])|(?P<string>"(?:[^"\\]|\\.)*")|'
+                    r'(?P<number>-?\d+(?:\.\d+)?)|(?P<name>[_A-Za-z][_0-9A-Za-z]*)|(?P<other>\S)')
+
+
+class GraphQLError(Exception):
+    pass
+
+
+def _tokens(query):
+    tokens = []
+    for match in _token.finditer(query):
+        kind = match.lastgroup
+        if kind == 'skip':
+            continue
+        if kind == 'other':
+            raise GraphQLError('the stub does not know %r (variables and fragments are not supported)' %
+                               match.group())
+        tokens.append((kind, match.group()))
+    return tokens
+
+
+class _Parser(object):
+    def __init__(self, query):
+        self.tokens = _tokens(query)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        kind, text = self.peek()
+        if kind is None or (value is not None and text != value):
+            raise GraphQLError('expected %s, found %s' % (value or 'more', text))
+        self.position += 1
+        return text
+
+    def document(self):
+        if self.peek() == ('name', 'query'):
+            self.take()
+            if self.peek()[0] == 'name':
+                self.take()
+        selections = self.selection_set()
+        if self.peek()[0] is not None:
+            raise GraphQLError('only one operation is supported')
+        return selections
+
+    def selection_set(self):
+        self.take('{')
+        selections = []
+        while self.peek()[1] != '}':
+            selections.append(self.selection())
+        self.take('}')
+        return selections
+
+    def selection(self):
+        name = alias = self.take()
+        if self.peek()[1] == ':':
+            self.take()
+            name = self.take()
+        arguments = {}
+        if self.peek()[1] == '(':
+            self.take()
+            while self.peek()[1] != ')':
+                key = self.take()
+                self.take(':')
+                arguments[key] = self.value()
+            self.take(')')
+        selections = self.selection_set() if self.peek()[1] == '{' else None
+        return alias, name, arguments, selections
+
+    def value(self):
+        kind, text = self.peek()
+        if text == '[':
+            self.take()
+            values = []
+            while self.peek()[1] != ']':
+                values.append(self.value())
+            self.take(']')
+            return values
+        if text == '{':
+            self.take()
+            values = {}
+            while self.peek()[1] != '}':
+                key = self.take()
+                self.take(':')
+                values[key] = self.value()
+            self.take('}')
+            return values
+        self.take()
+        if kind == 'string':
+            return text[1:-1].decode('string_escape')
+        if kind == 'number':
+            return float(text) if '.' in text else int(text)
+        return {'null': None, 'true': True, 'false': False}.get(text, text)  # enum values stay names
+
+
+def parse(query):
+    """
+    :param query: string
+    :return: list of (alias, field name, arguments dictionary, selections or None)
+    """
+    return _Parser(query).document()
+
+
+def _connection(items, arguments, node):
+    """
+    :param items: list (or LazyList) of all the items
+    :param arguments: dictionary with first and after
+    :param node: function that makes the graphql object of an item
+    :return: dictionary with the nodes of the page and its pageInfo
+    """
+    first = min(int(arguments.get('first') or MAX_PAGE_SIZE), MAX_PAGE_SIZE)
+    start = int(base64.b64decode(arguments['after'])) if arguments.get('after') else 0
+    page = items[start:start + first]
+    end = start + len(page)
+    return {'nodes': [node(item) for item in page],
+            'pageInfo': {'hasNextPage': end < len(items), 'endCursor': base64.b64encode(str(end)) if page else None,
+                         'hasPreviousPage': start > 0, 'startCursor': base64.b64encode(str(start)) if page else None}}
+
+
+class CanvasSchema(object):
+    """
+    Resolves the fields of the queries from the synthetic courses of a server. Each object is a dictionary, whose
+    values are either the values of the fields, or functions of the arguments of the field
+    """
+
+    def __init__(self, courses):
+        """
+        :param courses: dictionary from course id to SyntheticCourse
+        """
+        self.courses = courses
+
+    def root(self):
+        return {'course': lambda args: self._course(args), 'assignment': lambda args: self._assignment(args)}
+
+    def _course(self, args):
+        course = self.courses.get(int(args['id']))
+        if course is None:
+            return None
+        return {'_id': str(course.id), 'name': course.name, 'courseCode': 'SYN%d' % course.id,
+                'assignmentsConnection': lambda a: _connection(course.assignments, a,
+                                                                lambda x: self._assignment_node(course, x)),
+                'assignmentGroupsConnection': lambda a: _connection(course.groups, a, self._group_node),
+                'usersConnection': lambda a: _connection(course.users, a, self._user_node)}
+
+    def _assignment(self, args):
+        assignment_id = int(args['id'])
+        for course in self.courses.values():
+            for assignment in course.assignments:
+                if assignment['id'] == assignment_id:
+                    return self._assignment_node(course, assignment)
+        return None
+
+    def _assignment_node(self, course, a):
+        return {'_id': str(a['id']), 'name': a['name'], 'pointsPossible': a['points_possible'],
+                'assignmentGroupId': str(a['assignment_group_id']), 'position': a['position'],
+                'published': a['published'], 'gradingType': a['grading_type'], 'dueAt': a['due_at'],
+                'submissionsConnection': lambda args: _connection(course.assignment_submissions(a), args,
+                                                                  self._submission_node)}
+
+    def _submission_node(self, s):
+        return {'_id': str(s['id']), 'userId': str(s['user_id']), 'assignmentId': str(s['assignment_id']),
+                'grade': s['grade'], 'score': s['score'], 'state': s['workflow_state'],
+                'submittedAt': s['submitted_at'], 'gradedAt': s['graded_at'], 'late': s['late'],
+                'excused': s['excused'], 'attempt': s['attempt'], 'submissionType': s['submission_type']}
+
+    def _group_node(self, g):
+        rules = g.get('rules') or {}
+        return {'_id': str(g['id']), 'name': g['name'], 'groupWeight': g['group_weight'], 'position': g['position'],
+                'rules': {'dropLowest': rules.get('drop_lowest'), 'dropHighest': rules.get('drop_highest'),
+                          'neverDrop': [{'_id': str(i)} for i in rules.get('never_drop', [])] or None}}
+
+    def _user_node(self, u):
+        return {'_id': str(u['id']), 'name': u['name'], 'sortableName': u['sortable_name'],
+                'shortName': u['short_name']}
+
+
+def complexity(selections, multiplier=1):
+    """
+    :param selections: parsed selections
+    :param multiplier: int how many times the selections can be resolved (the page sizes of the enclosing connections)
+    :return: int the most nodes the query can return, the sum over its connections of their page size times the page
+    sizes of the connections around them
+    """
+    total = 0
+    for alias, name, arguments, children in selections:
+        if children is None:
+            continue
+        inner = multiplier
+        if name.endswith('Connection'):
+            inner = multiplier * min(int(arguments.get('first') or MAX_PAGE_SIZE), MAX_PAGE_SIZE)
+            total += inner
+        total += complexity(children, inner)
+    return total
+
+
+def execute(schema, query, max_complexity=None):
+    """
+    :param schema: CanvasSchema
+    :param query: string
+    :param max_complexity: int queries that can return more nodes than this are refused (see complexity). None means
+    no limit
+    :return: the response (dictionary with data, or errors) and the number of nodes in it (its cost)
+    """
+    counter = {'nodes': 0}
+
+    def resolve(obj, selections, path):
+        result = {}
+        for alias, name, arguments, children in selections:
+            if name == '__typename':
+                result[alias] = 'Object'
+                continue
+            if name not in obj:
+                raise GraphQLError("Field '%s' doesn't exist (at %s)" % (name, '.'.join(path) or 'query'))
+            value = obj[name]
+            if callable(value):
+                value = value(arguments)
+            result[alias] = complete(value, children, path + [alias])
+        return result
+
+    def complete(value, children, path):
+        if value is None or children is None:
+            return value
+        if isinstance(value, list):
+            counter['nodes'] += len(value)
+            return [complete(v, children, path) for v in value]
+        return resolve(value, children, path)
+
+    try:
+        selections = parse(query)
+        if max_complexity is not None and complexity(selections) > max_complexity:
+            raise GraphQLError('Query has complexity of %d, which exceeds max complexity of %d' %
+                               (complexity(selections), max_complexity))
+        data = resolve(schema.root(), selections, [])
+    except GraphQLError as e:
+        return {'errors': [{'message': str(e)}]}, 0
+    return {'data': data}, counter['nodes']
@@ -0,0 +1,90 @@
+# __author__ = 'dimitrios'
+import hashlib
+import threading
+import urlparse
+import urllib
+import simplejson as json
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers every GET with a page of fake records and a Canvas style Link header pointing to the next page.
+    Speaks HTTP/1.1 so that clients can keep the connection alive between pages.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        parsed = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(parsed.query))
+        page = int(query.get('page', '1').replace('bookmark:', ''))
+        per_page = int(query.get('per_page', 10))
+        pages = self.server.pages
+
+        records = [{'id': (page - 1) * per_page + i, 'name': 'record %d' % i} for i in range(per_page)]
+        body = json.dumps(records)
+
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        links = self._links(parsed.path, query, page, pages)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Link', links)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Link', links)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _links(self, path, query, page, pages):
+        """
+        Canvas style Link header. Pages are numbered, unless the server uses bookmarks (then there is no 'last' link,
+        as canvas does for bookmarked collections)
+        """
+        links = [('current', page), ('first', 1)]
+        if page < pages:
+            links.append(('next', page + 1))
+        if not self.server.bookmarks:
+            links.append(('last', pages))
+
+        result = []
+        for rel, number in links:
+            query['page'] = ('bookmark:%d' % number) if self.server.bookmarks else number
+            url = 'http://%s:%d%s?%s' % (self.server.server_address[0], self.server.server_address[1], path,
+                                         urllib.urlencode(query))
+            result.append('<%s>; rel="%s"' % (url, rel))
+        return ','.join(result)
+
+    def log_message(self, format, *args):
+        pass  # keep the benchmark output clean
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, pages=50, bookmarks=False):
+        HTTPServer.__init__(self, ('127.0.0.1', port), StubHandler)
+        self.pages = pages
+        self.bookmarks = bookmarks
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def start(self):
+        """
+        serves requests in a background thread
+        :return: self
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
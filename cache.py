@@ -0,0 +1,228 @@
+# __author__ = 'dimitrios'
+import hashlib
+import os
+import re
+import threading
+import time
+import urllib
+import urlparse
+import requests
+import simplejson as json
+from requests.structures import CaseInsensitiveDict
+
+
+def normalize_url(url, parameters=None):
+    """
+    :param url: string
+    :param parameters: dictionary
+    :return: string the full url with its parameters sorted, and without the access token
+    """
+    full_url = requests.Request('GET', url, params=parameters).prepare().url
+    parsed = urlparse.urlparse(full_url)
+    query = sorted((k, v) for k, v in urlparse.parse_qsl(parsed.query, keep_blank_values=True)
+                   if k != 'access_token')
+    return urlparse.urlunparse(parsed._replace(query=urllib.urlencode(query)))
+
+
+class ResponseCache(object):
+    """
+    On disk cache of API responses, used by APICalls so that crawling the same course again does not download every
+    page again.
+    Responses are keyed by their url and parameters (without the access token). Each entry keeps the body and the
+    ETag / Last-Modified / Link headers. While an entry is younger than the ttl of its endpoint it is used as is,
+    afterwards it is revalidated with a conditional request: if canvas answers 304 Not Modified the stored body is used,
+    so an unchanged page costs a 304 instead of a full download.
+    The cache is bounded in size, and the least recently used entries are removed first.
+    """
+    HEADERS = ['ETag', 'Last-Modified', 'Link', 'Content-Type']
+
+    def __init__(self, directory='./data/cache', max_bytes=512 * 1024 * 1024, ttls=None, default_ttl=0):
+        """
+        :param directory: string where the entries are saved
+        :param max_bytes: int max total size of the entries
+        :param ttls: list of (regular expression, seconds). The first expression found in the url of a request gives
+        how long its response is used without revalidation eg [('/analytics/', 24 * 3600), ('/users', 3600)]
+        :param default_ttl: float seconds, for urls that do not match any expression. 0 means always revalidate
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls or [])]
+        self.default_ttl = default_ttl
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        # key -> [last time used, size in bytes] (the time is kept on disk as the mtime of the meta file)
+        self.entries = {}
+        self.size = 0
+        for name in os.listdir(directory):
+            if not name.endswith('.meta'):
+                continue
+            key = name[:-len('.meta')]
+            size = self._entry_size(key)
+            self.entries[key] = [os.path.getmtime(self._path(key, 'meta')), size]
+            self.size += size
+        self._evict()  # max_bytes may be smaller than in the last run
+
+    def _path(self, key, kind):
+        return os.path.join(self.directory, '%s.%s' % (key, kind))
+
+    def _entry_size(self, key):
+        size = 0
+        for kind in ('meta', 'body'):
+            if os.path.isfile(self._path(key, kind)):
+                size += os.path.getsize(self._path(key, kind))
+        return size
+
+    def normalize(self, url, parameters):
+        return normalize_url(url, parameters)
+
+    def key(self, url, parameters=None):
+        return hashlib.sha1(self.normalize(url, parameters)).hexdigest()
+
+    def ttl(self, url):
+        """
+        :param url: string
+        :return: float seconds a response of this url is used without revalidation
+        """
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def lookup(self, key):
+        """
+        :param key: string
+        :return: dictionary with the stored meta data of this entry ('url', 'stored_at', 'headers') or None
+        """
+        with self.lock:
+            if key not in self.entries:
+                return None
+        try:
+            with open(self._path(key, 'meta'), 'r') as fp:
+                return json.load(fp)
+        except (IOError, ValueError):  # removed by another process, or half written
+            return None
+
+    def is_fresh(self, meta):
+        return time.time() - meta['stored_at'] < self.ttl(meta['url'])
+
+    def conditional_headers(self, meta):
+        """
+        :param meta: dictionary of a stored entry
+        :return: dictionary of headers that ask canvas to answer 304 if the entry is still valid
+        """
+        headers = {}
+        if meta['headers'].get('ETag'):
+            headers['If-None-Match'] = meta['headers']['ETag']
+        if meta['headers'].get('Last-Modified'):
+            headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+        return headers
+
+    def response(self, key, meta):
+        """
+        Rebuilds a response from a stored entry, and marks the entry as recently used
+        :param key: string
+        :param meta: dictionary
+        :return: response, or None if the body is gone
+        """
+        try:
+            with open(self._path(key, 'body'), 'rb') as fp:
+                body = fp.read()
+        except IOError:
+            return None
+        self._touch(key)
+
+        r = requests.Response()
+        r.status_code = 200
+        r.url = meta['url']
+        r.headers = CaseInsensitiveDict(meta['headers'])
+        r.encoding = 'utf-8'
+        r._content = body
+        return r
+
+    def hit(self, key, meta):
+        """
+        :return: the stored response, for a fresh entry
+        """
+        with self.lock:
+            self.hits += 1
+        return self.response(key, meta)
+
+    def refresh(self, key, meta):
+        """
+        Canvas answered 304 Not Modified: the entry is valid for another ttl
+        :return: the stored response
+        """
+        meta['stored_at'] = time.time()
+        self._write(key, meta)
+        with self.lock:
+            self.revalidated += 1
+        return self.response(key, meta)
+
+    def store(self, key, url, r):
+        """
+        Saves a (200) response. The least recently used entries are evicted if the cache gets too big
+        :param key: string
+        :param url: string the normalized url of the request
+        :param r: response
+        :return:
+        """
+        with self.lock:
+            self.misses += 1
+        if r.status_code != 200:
+            return
+        meta = {'url': url, 'stored_at': time.time(),
+                'headers': dict((h, r.headers[h]) for h in self.HEADERS if h in r.headers)}
+        with open(self._path(key, 'body'), 'wb') as fp:
+            fp.write(r.content)
+        self._write(key, meta)
+
+    def _write(self, key, meta):
+        tmp_filename = self._path(key, 'meta.tmp')
+        with open(tmp_filename, 'w') as fp:
+            json.dump(meta, fp)
+        os.rename(tmp_filename, self._path(key, 'meta'))  # readers never see half an entry
+
+        with self.lock:
+            size = self._entry_size(key)
+            old_size = self.entries.get(key, [0, 0])[1]
+            self.entries[key] = [time.time(), size]
+            self.size += size - old_size
+        self._evict()
+
+    def _touch(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries[key][0] = time.time()
+        try:
+            os.utime(self._path(key, 'meta'), None)
+        except OSError:
+            pass
+
+    def _evict(self):
+        with self.lock:
+            if self.size <= self.max_bytes:
+                return
+            by_last_use = sorted(self.entries.items(), key=lambda item: item[1][0])
+            for key, (_, size) in by_last_use:
+                if self.size <= self.max_bytes:
+                    break
+                for kind in ('meta', 'body'):
+                    try:
+                        os.remove(self._path(key, kind))
+                    except OSError:
+                        pass
+                del self.entries[key]
+                self.size -= size
+
+    def stats(self):
+        """
+        :return: dictionary with the hits (fresh), revalidations (304), misses and size of the cache
+        """
+        return {'hits': self.hits, 'revalidated': self.revalidated, 'misses': self.misses,
+                'entries': len(self.entries), 'bytes': self.size}
@@ -1,6 +1,121 @@
 # __author__ = 'dimitrios'
 import requests
+import simplejson as json
 import itertools
+import sys
+import threading
+import time
+import urllib
+import urlparse
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+from scheduler import RateLimitScheduler
+from metrics import Metrics
+from records import iter_records, project
+
+
+def _page_number(url):
+    """
+    :param url: string a pagination link given by canvas
+    :return: int the value of the page parameter, or None if it is not a number (eg an opaque bookmark)
+    """
+    page = urlparse.parse_qs(urlparse.urlparse(url).query).get('page', [''])[0]
+    if not page.isdigit():
+        return None
+    return int(page)
+
+
+def _with_page(url, page):
+    """
+    :param url: string a pagination link given by canvas
+    :param page: int
+    :return: string the same url, asking for another page
+    """
+    parsed = urlparse.urlparse(url)
+    query = [(k, v) for k, v in urlparse.parse_qsl(parsed.query, keep_blank_values=True) if k != 'page']
+    query.append(('page', str(page)))
+    return urlparse.urlunparse(parsed._replace(query=urllib.urlencode(query)))
+
+
+def _records(responses, fields=None):
+    """
+    :param responses: iterable of responses, each with a json list
+    :param fields: list of field names. If given, each page is decoded one object at a time and only these fields are
+    kept (as a Record), instead of decoding the whole page into dictionaries
+    :return: generator of the json objects (or Records) of all the responses
+    """
+    for r in responses:
+        if fields is None:
+            for record in r.json():
+                yield record
+        else:
+            for record in iter_records(r.content, fields):
+                yield record
+
+
+def _wrap(hook, label, url, send):
+    """
+    :return: function with no arguments that calls the hook around send
+    """
+    return lambda: hook(label, url, send)
+
+
+class HTTPTransport(object):
+    """
+    Shared HTTP layer used by APICalls.
+    Keeps one requests.Session with a pool of keep-alive connections, so consecutive pages (and different endpoints on
+    the same Canvas host) reuse the same TCP+TLS connection instead of opening a new one for every page.
+    One transport can be given to several APICalls / CanvasReader objects so that they all share the pool.
+    """
+    def __init__(self, pool_size=10, connect_timeout=10, read_timeout=60, gzip=True, max_in_flight=None):
+        """
+        :param pool_size: int max number of connections kept open per host
+        :param connect_timeout: float seconds to wait for a connection to be established
+        :param read_timeout: float seconds to wait for the server to send data
+        :param gzip: boolean ask the server for compressed responses
+        :param max_in_flight: int cap on the requests that can be running at the same time, over all the threads that
+        use this transport. None means no cap
+        """
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.in_flight = None
+        if max_in_flight is not None:
+            self.in_flight = threading.BoundedSemaphore(max_in_flight)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Connection'] = 'keep-alive'
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate' if gzip else 'identity'
+
+    def get(self, url, params=None, headers=None):
+        """
+        :param url: string full url
+        :param params: dictionary query parameters
+        :param headers: dictionary extra request headers
+        :return: one response
+        """
+        if self.in_flight is None:
+            return self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+        with self.in_flight:
+            return self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+
+    def post(self, url, data=None, params=None, headers=None):
+        """
+        :param url: string full url
+        :param data: string body of the request
+        :param params: dictionary query parameters
+        :param headers: dictionary extra request headers
+        :return: one response
+        """
+        if self.in_flight is None:
+            return self.session.post(url, data=data, params=params, headers=headers, timeout=self.timeout)
+        with self.in_flight:
+            return self.session.post(url, data=data, params=params, headers=headers, timeout=self.timeout)
+
+    def close(self):
+        self.session.close()
 
 
 class APICalls(object):
@@ -10,69 +125,350 @@ class APICalls(object):
     Code based on https://github.com/hawesie/python-canvas-api
     Canvas API returns a responses which contain several data points in them. This combines all the responses to a list
     """
-    def __init__(self, oauth_token, api_url, verbose=True):
+    def __init__(self, oauth_token, api_url, verbose=True, transport=None, parallel_pages=1, scheduler=None,
+                 cache=None, metrics=None, hooks=None, journal=None):
+        """
+        :param oauth_token: string
+        :param api_url: string eg 'https://canvas.eee.uci.edu/api/v1'
+        :param verbose: boolean print every url that is requested
+        :param transport: HTTPTransport, if None one is created
+        :param parallel_pages: int when more than 1, and the first page tells which page is the last one, the rest of
+        the pages are downloaded in parallel with this many threads (instead of following the 'next' links one by one)
+        :param scheduler: RateLimitScheduler that paces the requests around the rate limit, if None one is created
+        :param cache: ResponseCache that keeps the responses on disk between runs. None means no cache
+        :param metrics: Metrics that records the pages, latency, bytes, retries and throttles of each endpoint. If None,
+        one is created
+        :param hooks: list of functions that wrap every page request, for profiling. Each one is called as
+        hook(label, url, send) where label is the CanvasReader method, and must return send() (the response)
+        :param journal: PageJournal that saves the progress of paginated calls (iter and get), so that a call that was
+        interrupted continues from its last complete page in the next run. None means no journal
+        """
         self.oauth_token = oauth_token
         self.api_url = api_url
         self.verbose = verbose
+        self.parallel_pages = parallel_pages
+        if transport is None:
+            transport = HTTPTransport()
+        self.transport = transport
+        if scheduler is None:
+            scheduler = RateLimitScheduler()
+        self.scheduler = scheduler
+        self.cache = cache
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+        self.hooks = list(hooks or [])
+        self.journal = journal
 
-    def _get_response(self, url, parameters=None):
+    def _get_response(self, url, parameters=None, label=None):
         """
         lowest call, directly to the API. Combines the parameters with the access token. Returns 100 results if not
-        otherwise specified
+        otherwise specified (in the parameters or in the url)
         :param url: string
-        :param parameters: dictionary
+        :param parameters: dictionary, None for the pagination links of canvas, which already carry the query
+        :param label: string the CanvasReader method that asks for this page, for the metrics
         :return: one response
         """
-        if parameters is None:
-            parameters = {}
+        parameters = dict(parameters or {})  # pages can be downloaded from other threads, do not share the dict
         parameters['access_token'] = self.oauth_token
 
-        if parameters.get('per_page', None) is None:
+        in_url = 'per_page' in urlparse.parse_qs(urlparse.urlparse(url).query)
+        if parameters.get('per_page', None) is None and not in_url:
             parameters['per_page'] = 100
 
-        r = requests.get(url, params=parameters)
+        send = lambda: self._measured_response(url, parameters, label)
+        for hook in reversed(self.hooks):
+            send = _wrap(hook, label, url, send)
+        return send()
+
+
+    def post(self, url, body, label=None):
+        """
+        Sends a json body to an url outside the REST api (eg the GraphQL endpoint), through the same scheduler,
+        metrics and hooks as the pages. Posts are never cached
+        :param url: string full url eg 'https://canvas.eee.uci.edu/api/graphql'
+        :param body: json object
+        :param label: string the reader method, for the metrics
+        :return: one response
+        """
+        parameters = {'access_token': self.oauth_token}
+        data = json.dumps(body)
+        send = lambda: self._measured_response(url, parameters, label, data)
+        for hook in reversed(self.hooks):
+            send = _wrap(hook, label, url, send)
+        return send()
+
+
+    def _measured_response(self, url, parameters, label, data=None):
+        """
+        Gets one page (from the cache or canvas), and records it in the metrics
+        :param url: string
+        :param parameters: dictionary, with the access token
+        :param label: string
+        :param data: string json body. If given, the request is a POST (and skips the cache)
+        :return: one response
+        """
+        t = time.time()
+        throttled = []  # one boolean for each attempt, whether canvas refused it because of the rate limit
+
+        def send(headers=None):
+            def request():
+                throttled.append(False)
+                if data is None:
+                    r = self.transport.get(url, params=parameters, headers=headers)
+                else:
+                    r = self.transport.post(url, data=data, params=parameters,
+                                            headers={'Content-Type': 'application/json'})
+                throttled[-1] = self.scheduler.is_throttled(r)
+                return r
+            return self.scheduler.send(request)
+
+        try:
+            if self.cache is not None and data is None:
+                r = self._get_cached_response(url, parameters, send)
+            else:
+                r = send()
+                r.raise_for_status()
+        except Exception:
+            self.metrics.record_request(label, url, time.time() - t, 0, retries=max(len(throttled) - 1, 0),
+                                        throttles=sum(throttled), error=True)
+            raise
+        self.metrics.record_request(label, url, time.time() - t, len(r.content), retries=max(len(throttled) - 1, 0),
+                                    throttles=sum(throttled), cached=not throttled)
+        return r
+
+
+    def _get_cached_response(self, url, parameters, send):
+        """
+        Same as _get_response, but goes through the cache. A fresh entry is returned without a request, a stale one is
+        revalidated with a conditional request (and reused if canvas answers 304 Not Modified)
+        :param url: string
+        :param parameters: dictionary, with the access token
+        :param send: function that sends the request (with optional extra headers) and returns the response
+        :return: one response
+        """
+        key = self.cache.key(url, parameters)
+        meta = self.cache.lookup(key)
+        headers = None
+        if meta is not None:
+            if self.cache.is_fresh(meta):
+                r = self.cache.hit(key, meta)
+                if r is not None:
+                    return r
+            headers = self.cache.conditional_headers(meta)
+
+        r = send(headers)
+        if r.status_code == 304:
+            cached = self.cache.refresh(key, meta)
+            if cached is not None:
+                return cached
+            # the stored body is gone, download it again
+            r = send()
+
         r.raise_for_status()
+        self.cache.store(key, self.cache.normalize(url, parameters), r)
         return r
 
 
-    def _get_responses(self, url, parameters=None):
+    def _fetch_in_background(self, url, parameters=None, label=None):
         """
-        Simple wrapper that keeps asking for responses until there are no more left, returns a list of responses
+        Starts downloading one page in a background thread
         :param url: string
         :param parameters: dictionary
-        :return: list of responses
+        :param label: string
+        :return: a function that waits for the download and returns the response (or raises its exception)
+        """
+        result = {}
+
+        def fetch():
+            try:
+                result['response'] = self._get_response(url, parameters, label)
+            except Exception:
+                result['error'] = sys.exc_info()
+
+        thread = threading.Thread(target=fetch)
+        thread.daemon = True
+        thread.start()
+
+        def wait():
+            thread.join()
+            if 'error' in result:
+                error_type, error, traceback = result['error']
+                raise error_type, error, traceback
+            return result['response']
+        return wait
+
+
+    def _fetch(self, url, parameters=None, prefetch=True, label=None):
+        """
+        :param url: string
+        :param parameters: dictionary
+        :param label: string
+        :param prefetch: boolean start downloading now, in the background, instead of when the response is needed
+        :return: a function that returns the response
+        """
+        if prefetch:
+            return self._fetch_in_background(url, parameters, label)
+        return lambda: self._get_response(url, parameters, label)
+
+
+    def _remaining_page_urls(self, r):
+        """
+        Uses the 'next' and 'last' links of a response to find the urls of all the pages that follow it.
+        :param r: response
+        :return: list of urls. Empty if parallel pages are off, or the links are not numbered pages (bookmarks)
+        """
+        if self.parallel_pages <= 1 or 'next' not in r.links or 'last' not in r.links:
+            return []
+        next_url = r.links['next']['url']
+        next_page = _page_number(next_url)
+        last_page = _page_number(r.links['last']['url'])
+        if next_page is None or last_page is None:
+            return []
+        return [_with_page(next_url, page) for page in range(next_page, last_page + 1)]
+
+
+    def _fetch_pages(self, urls, label=None):
+        """
+        Downloads the pages in parallel (self.parallel_pages threads) and yields them in the order of urls
+        :param urls: list of strings, pagination links (they have the query already)
+        :param label: string
+        :return: generator of responses
+        """
+        pool = ThreadPool(min(self.parallel_pages, len(urls)))
+        try:
+            for r in pool.imap(lambda u: self._get_response(u, None, label), urls):
+                yield r
+        finally:
+            pool.terminate()
+
+
+    def _iter_responses(self, url, parameters=None, prefetch=True, label=None):
+        """
+        Yields the responses of an url one page at a time, following the 'next' links. Pages are not kept after they
+        are yielded. If parallel_pages is on and the page range is known from the first page, the rest of the pages
+        are downloaded in parallel.
+        :param url: string
+        :param parameters: dictionary
+        :param prefetch: boolean download the next page in the background while the caller handles the current one
+        :param label: string the CanvasReader method, for the metrics
+        :return: generator of responses
         """
         url = self.api_url + url
         if self.verbose:
             print url
-        responses = []
-        while True:
-            r = self._get_response(url, parameters)
-            responses.append(r)
+        return self._follow(url, parameters, prefetch, label)
+
 
+    def _follow(self, url, parameters=None, prefetch=True, label=None):
+        """
+        Same as _iter_responses, starting from the full url of any page. The parameters are sent with that url only:
+        the 'next' links of canvas carry the whole query, sending the parameters again would repeat every array
+        parameter (eg student_ids[]) on each page
+        :param parameters: dictionary, None if url is itself a pagination link
+        """
+        pending = self._fetch(url, parameters, prefetch, label)
+        while pending is not None:
+            r = pending()
+            page_urls = self._remaining_page_urls(r)
+            if page_urls:
+                yield r
+                for r in self._fetch_pages(page_urls, label):
+                    yield r
+
+            # keep following 'next' (after a parallel download, only if pages were added in the meantime)
+            pending = None
             if 'next' in r.links:
-                url = r.links['next']['url']
+                pending = self._fetch(r.links['next']['url'], None, prefetch, label)
+            if not page_urls:
+                yield r
+
+
+    def _get_responses(self, url, parameters=None, label=None):
+        """
+        Simple wrapper that keeps asking for responses until there are no more left, returns a list of responses
+        :param url: string
+        :param parameters: dictionary
+        :param label: string
+        :return: list of responses
+        """
+        return list(self._iter_responses(url, parameters, prefetch=False, label=label))
+
+
+    def iter(self, request_url, parameters=None, prefetch=True, label=None, fields=None):
+        """
+        Streams the records of an entity page by page, instead of keeping all of them in memory.
+        :param request_url: string API given url for this entity
+        :param parameters: dictionary extra parameters in the API given url
+        :param prefetch: boolean download the next page in the background while the current one is being consumed
+        :param label: string name of the caller (the CanvasReader method), the metrics are kept by label and endpoint
+        :param fields: list of field names to keep. None keeps the whole json objects (as dictionaries), otherwise
+        every object is a Record with only these fields (see records.py)
+        :return: generator of json objects, based on the url
+        """
+        if self.journal is not None:
+            records = self._iter_journaled(request_url, parameters, prefetch, label)
+            if fields is None:
+                return records
+            return (project(record, fields) for record in records)  # the journal keeps the whole objects
+        return _records(self._iter_responses(request_url, parameters, prefetch=prefetch, label=label), fields)
+
+
+    def _iter_journaled(self, request_url, parameters=None, prefetch=True, label=None):
+        """
+        Same as iter, but saves every page in the journal before its records are yielded. If a previous run was
+        interrupted during this call, its saved records are yielded first, and the download continues from the page
+        after them
+        :return: generator of json objects
+        """
+        entry = self.journal.open(self.api_url + request_url, parameters)
+        if entry is None:  # another thread is downloading the same call, without the journal then
+            for record in _records(self._iter_responses(request_url, parameters, prefetch=prefetch, label=label)):
+                yield record
+            return
+
+        completed = False
+        try:
+            for record in entry.saved_records():
+                yield record
+            if entry.pages == 0:
+                responses = self._iter_responses(request_url, parameters, prefetch=prefetch, label=label)
+            elif entry.next_url is not None:
+                if self.verbose:
+                    print '%s (resumed after %d pages)' % (entry.next_url, entry.pages)
+                responses = self._follow(entry.next_url, None, prefetch, label)
             else:
-                break
+                responses = []  # all the pages were saved, the last run stopped right after them
 
-        return responses
+            for r in responses:
+                records = r.json()
+                entry.append(records, r.links['next']['url'] if 'next' in r.links else None)
+                for record in records:
+                    yield record
+            completed = True
+        finally:
+            if completed:
+                entry.discard()
+            else:
+                entry.close()
 
 
-    def get(self, request_url, to_json=True, parameters=None, single=False):
+    def get(self, request_url, to_json=True, parameters=None, single=False, label=None, fields=None):
         """
         :param request_url: string API given url for this entity
         :param to_json: boolean Decides whether make responses as a list of dictionaries (based on their json object)
         :param parameters: string extra parameters in the API given url to specify different behavior if needed
         :param single: boolean if there is only one response returned rather than a list (of there is only one, then
         a list is returned. This depends on the API call)
+        :param label: string name of the caller, for the metrics
+        :param fields: list of field names to keep (see iter)
         :return: list of json objects, based on the url
         """
-        responses = self._get_responses(request_url, parameters=parameters)
+        if single:
+            r = next(self._iter_responses(request_url, parameters, prefetch=False, label=label))
+            return r.json() if to_json else r
 
         if to_json:
-            responses = [r.json() for r in responses]
-        if single:
-            return responses[0]
-        else:
-            # combine the list of dictionaries (or responses) into one list
-            return list(reduce(lambda x, y: itertools.chain(x, y), responses))
\ No newline at end of file
+            return list(self.iter(request_url, parameters=parameters, label=label, fields=fields))
+        # combine the responses into one list
+        return list(itertools.chain.from_iterable(self._iter_responses(request_url, parameters, label=label)))
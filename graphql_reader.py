@@ -0,0 +1,299 @@
+# __author__ = 'dimitrios'
+import threading
+import simplejson as json
+from read import CanvasReader, _with_fields
+from records import project
+
+
+def _int(value):
+    return int(value) if value is not None else None
+
+
+def _rules(rules):
+    """
+    :param rules: dictionary the rules of an assignment group, as GraphQL gives them
+    :return: dictionary the rules as the REST api gives them (only the rules that are set)
+    """
+    result = {}
+    if rules is None:
+        return result
+    if rules.get('dropLowest') is not None:
+        result['drop_lowest'] = rules['dropLowest']
+    if rules.get('dropHighest') is not None:
+        result['drop_highest'] = rules['dropHighest']
+    if rules.get('neverDrop'):
+        result['never_drop'] = [int(a['_id']) for a in rules['neverDrop']]
+    return result
+
+
+# for each entity, the REST field, the GraphQL field it comes from, and how its value is converted (ids are strings in
+# GraphQL, numbers in REST)
+ASSIGNMENT_FIELDS = [('id', '_id', _int), ('name', 'name', None), ('points_possible', 'pointsPossible', None),
+                     ('assignment_group_id', 'assignmentGroupId', _int), ('position', 'position', None),
+                     ('published', 'published', None), ('grading_type', 'gradingType', None),
+                     ('due_at', 'dueAt', None)]
+SUBMISSION_FIELDS = [('id', '_id', _int), ('user_id', 'userId', _int), ('assignment_id', 'assignmentId', _int),
+                     ('grade', 'grade', None), ('score', 'score', None), ('workflow_state', 'state', None),
+                     ('submitted_at', 'submittedAt', None), ('graded_at', 'gradedAt', None), ('late', 'late', None),
+                     ('excused', 'excused', None), ('attempt', 'attempt', None),
+                     ('submission_type', 'submissionType', None)]
+GROUP_FIELDS = [('id', '_id', _int), ('name', 'name', None), ('group_weight', 'groupWeight', None),
+                ('position', 'position', None),
+                ('rules', 'rules { dropLowest dropHighest neverDrop { _id } }', _rules)]
+USER_FIELDS = [('id', '_id', _int), ('name', 'name', None), ('sortable_name', 'sortableName', None),
+               ('short_name', 'shortName', None)]
+
+PAGE_INFO = 'pageInfo { hasNextPage endCursor }'
+
+
+class GraphQLError(ValueError):
+    """
+    The GraphQL endpoint answered with errors (canvas sends them with status 200)
+    """
+    pass
+
+
+class QueryComplexityError(GraphQLError):
+    """
+    The query could return more nodes than the endpoint allows
+    """
+    pass
+
+
+def _mapping(entity, fields):
+    """
+    :param entity: list of (REST field, GraphQL field, conversion)
+    :param fields: list of REST field names, None means all of them
+    :return: the part of entity that is needed for fields
+    """
+    if fields is None:
+        return entity
+    known = dict((f[0], f) for f in entity)
+    missing = [f for f in fields if f not in known]
+    if missing:
+        raise ValueError('the GraphQL reader does not download %s' % ', '.join(missing))
+    return [known[f] for f in fields]
+
+
+def _convert(node, mapping, fields):
+    """
+    :param node: dictionary a GraphQL node
+    :param mapping: list of (REST field, GraphQL field, conversion), the fields that were asked for
+    :param fields: list of REST field names, None returns a dictionary
+    :return: dictionary (or Record with fields) in the shape of the REST api
+    """
+    obj = {}
+    for rest, graphql, conversion in mapping:
+        value = node.get(graphql.split(' ', 1)[0])
+        if conversion is not None:
+            value = conversion(value)
+        obj[rest] = value
+    return obj if fields is None else project(obj, fields)
+
+
+def _selection(mapping):
+    return ' '.join(graphql for _, graphql, _ in mapping)
+
+
+def _literal(value):
+    """
+    :return: string value written as a GraphQL literal (strings are quoted the same way in json)
+    """
+    return json.dumps(value)
+
+
+class GraphQLReader(CanvasReader):
+    """
+    A CanvasReader that downloads the assignments, their submissions, the assignment groups and the users of a course
+    with batched queries to the GraphQL endpoint of canvas (/api/graphql), instead of one series of REST pages for each
+    of them. The objects have the same keys as in CanvasReader (only the keys listed in ASSIGNMENT_FIELDS,
+    SUBMISSION_FIELDS, GROUP_FIELDS and USER_FIELDS). Everything else is downloaded with the REST api, as CanvasReader
+    does. Drop in for the crawler: CourseCrawler(canvas=GraphQLReader(token, url))
+
+    Connections are followed with their cursors (pageInfo). The first query of get_assignments also asks for the
+    assignment groups, which are kept for get_assignment_groups. The first get_assignment_submissions after
+    get_assignments downloads the submissions of all those assignments at once: each query asks for a page of the
+    submissions of as many assignments as fit in max_cost (nodes), and the next one continues the assignments that have
+    more pages. Submissions are kept until they are asked for, then dropped.
+    A query that the endpoint refuses as too complex is sent again with half the budget. The rate limit is handled by
+    the scheduler as for the REST pages (it reads the X-Request-Cost of the answers).
+    """
+
+    def __init__(self, access_token, base_url, api_prefix='/api/v1', graphql_path='/api/graphql', page_size=100,
+                 max_cost=5000, **kwargs):
+        """
+        :param graphql_path: string path of the GraphQL endpoint
+        :param page_size: int nodes asked for in each page of a connection (canvas gives at most 100)
+        :param max_cost: int most nodes a query can return (the sum over its connections of the page size times the
+        pages of the connections around them). Halved every time canvas refuses a query as too complex
+        The rest of the parameters are those of CanvasReader
+        """
+        CanvasReader.__init__(self, access_token, base_url, api_prefix, **kwargs)
+        self.graphql_url = base_url + graphql_path
+        self.page_size = page_size
+        self.max_cost = max_cost
+        self.lock = threading.Lock()
+        self.groups = {}  # course id -> list of group nodes, from the first query of get_assignments
+        self.assignment_ids = {}  # course id -> ids of the assignments whose submissions were not downloaded yet
+        self.submissions = {}  # (assignment id, fields) -> list of submissions downloaded but not asked for yet
+
+    def query(self, query, label=None):
+        """
+        :param query: string GraphQL query
+        :param label: string the reader method, for the metrics
+        :return: dictionary the data of the answer
+        """
+        if self.api.verbose:
+            print '%s (%s)' % (self.graphql_url, label)
+        r = self.api.post(self.graphql_url, {'query': query}, label=label)
+        result = r.json()
+        errors = result.get('errors')
+        if errors:
+            message = '; '.join(e.get('message', '') for e in errors)
+            if 'complexity' in message:
+                raise QueryComplexityError(message)
+            raise GraphQLError(message)
+        return result['data']
+
+    def _first(self, multiplier=1):
+        """
+        :param multiplier: int times the connection is asked for in the query
+        :return: int page size that keeps the query within max_cost
+        """
+        return max(1, min(self.page_size, self.max_cost // multiplier))
+
+    def _halve_cost(self, error):
+        if self.max_cost <= 1:
+            raise error
+        self.max_cost //= 2
+
+    def _course(self, course_id, connections, label):
+        """
+        Follows connections of a course, all in the same queries until each one runs out of pages
+        :param course_id: string
+        :param connections: list of (connection name, selection of its nodes)
+        :param label: string
+        :return: generator of (connection name, list of nodes), one for each page
+        """
+        cursors = [(name, selection, None) for name, selection in connections]
+        while cursors:
+            first = self._first(len(cursors))
+            fields = []
+            for name, selection, cursor in cursors:
+                arguments = 'first: %d' % first
+                if cursor is not None:
+                    arguments += ', after: %s' % _literal(cursor)
+                fields.append('%s(%s) { nodes { %s } %s }' % (name, arguments, selection, PAGE_INFO))
+            try:
+                data = self.query('{ course(id: %s) { %s } }' % (_literal(str(course_id)), ' '.join(fields)), label)
+            except QueryComplexityError as e:
+                self._halve_cost(e)
+                continue
+            if data['course'] is None:
+                raise GraphQLError('course %s does not exist' % course_id)
+            following = []
+            for name, selection, _ in cursors:
+                connection = data['course'][name]
+                yield name, connection['nodes']
+                if connection['pageInfo']['hasNextPage']:
+                    following.append((name, selection, connection['pageInfo']['endCursor']))
+            cursors = following
+
+    def iter_users(self, course_id, fields=None):
+        mapping = _mapping(USER_FIELDS, fields)
+        for _, nodes in self._course(course_id, [('usersConnection', _selection(mapping))], 'get_users'):
+            for node in nodes:
+                yield _convert(node, mapping, fields)
+
+    def iter_assignments(self, course_id, fields=None):
+        """
+        Same as CanvasReader, also downloads the first page of the assignment groups (see get_assignment_groups), and
+        remembers the assignments for the next get_assignment_submissions
+        """
+        mapping = _mapping(ASSIGNMENT_FIELDS, _with_fields(fields, 'id'))
+        connections = [('assignmentsConnection', _selection(mapping)),
+                       ('assignmentGroupsConnection', _selection(GROUP_FIELDS))]
+        groups = []
+        assignment_ids = []
+        for name, nodes in self._course(course_id, connections, 'get_assignments'):
+            if name == 'assignmentGroupsConnection':
+                groups.extend(nodes)
+                continue
+            for node in nodes:
+                assignment_ids.append(int(node['_id']))
+                yield _convert(node, mapping, fields)
+        with self.lock:
+            self.groups[str(course_id)] = groups
+            self.assignment_ids[str(course_id)] = assignment_ids
+
+    def iter_assignment_groups(self, course_id, fields=None):
+        """
+        Same as CanvasReader. The groups downloaded by the last get_assignments are used, if there are any
+        """
+        mapping = _mapping(GROUP_FIELDS, fields)
+        with self.lock:
+            groups = self.groups.pop(str(course_id), None)
+        if groups is None:
+            groups = [node for _, nodes in self._course(course_id, [('assignmentGroupsConnection',
+                                                                     _selection(mapping))], 'get_assignment_groups')
+                      for node in nodes]
+        return (_convert(node, mapping, fields) for node in groups)
+
+    def iter_assignment_submissions(self, course_id, assignment_id, grouped=False, fields=None):
+        """
+        Same as CanvasReader (grouped is not used). If the assignment was listed by the last get_assignments, the
+        submissions of all its assignments are downloaded together
+        """
+        key = (int(assignment_id), tuple(fields) if fields is not None else None)
+        with self.lock:  # the other threads wait for the batch, that has their submissions too
+            if key not in self.submissions:
+                assignment_ids = self.assignment_ids.get(str(course_id), [])
+                if key[0] in assignment_ids:
+                    del self.assignment_ids[str(course_id)]
+                else:
+                    assignment_ids = [key[0]]
+                self._download_submissions(assignment_ids, fields)
+            submissions = self.submissions.pop(key)
+        return (s for s in submissions if s['workflow_state'] != 'unsubmitted')
+
+    def _download_submissions(self, assignment_ids, fields):
+        """
+        Downloads the submissions of many assignments, in queries with one page of several assignments each, and keeps
+        them in self.submissions
+        :param assignment_ids: list of int
+        :param fields: list of REST field names, None means all of them
+        """
+        record_fields = _with_fields(fields, 'workflow_state')
+        mapping = _mapping(SUBMISSION_FIELDS, record_fields)
+        selection = _selection(mapping)
+        submissions = dict((a, []) for a in assignment_ids)
+        cursors = [(a, None) for a in assignment_ids]
+        while cursors:
+            first = self._first()
+            batch = cursors[:max(1, self.max_cost // first)]
+            aliases = []
+            for i, (assignment_id, cursor) in enumerate(batch):
+                arguments = 'first: %d' % first
+                if cursor is not None:
+                    arguments += ', after: %s' % _literal(cursor)
+                aliases.append('a%d: assignment(id: %s) { submissionsConnection(%s) { nodes { %s } %s } }' %
+                               (i, _literal(str(assignment_id)), arguments, selection, PAGE_INFO))
+            try:
+                data = self.query('{ %s }' % ' '.join(aliases), 'get_assignment_submissions')
+            except QueryComplexityError as e:
+                self._halve_cost(e)
+                continue
+            following = []
+            for i, (assignment_id, _) in enumerate(batch):
+                if data['a%d' % i] is None:
+                    raise GraphQLError('assignment %s does not exist' % assignment_id)
+                connection = data['a%d' % i]['submissionsConnection']
+                submissions[assignment_id].extend(_convert(node, mapping, record_fields)
+                                                  for node in connection['nodes'])
+                if connection['pageInfo']['hasNextPage']:
+                    following.append((assignment_id, connection['pageInfo']['endCursor']))
+            cursors = following + cursors[len(batch):]
+
+        key_fields = tuple(fields) if fields is not None else None
+        for assignment_id, found in submissions.iteritems():
+            self.submissions[(assignment_id, key_fields)] = found
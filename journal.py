@@ -0,0 +1,152 @@
+# __author__ = 'dimitrios'
+import hashlib
+import os
+import threading
+import time
+import simplejson as json
+from cache import normalize_url
+
+
+class JournalEntry(object):
+    """
+    The progress of one paginated call: the records of the pages downloaded so far (<key>.ndjson, one record per
+    line) and the url of the next page (<key>.json). A page counts as done only when its records are on disk and the
+    meta file points past it, so after a crash the call continues from the last complete page.
+    """
+
+    def __init__(self, journal, key, url):
+        self.journal = journal
+        self.key = key
+        self.records_filename = journal.path(key, 'ndjson')
+        self.meta_filename = journal.path(key, 'json')
+        self.meta = {'url': url, 'next': None, 'pages': 0, 'records': 0, 'offset': 0, 'updated_at': time.time()}
+
+        meta = self._read_meta()
+        if meta is not None and meta['url'] == url and time.time() - meta['updated_at'] < journal.max_age:
+            self.meta = meta
+            # drop what a crash left after the last complete page
+            if os.path.isfile(self.records_filename):
+                with open(self.records_filename, 'r+b') as fp:
+                    fp.truncate(meta['offset'])
+        else:
+            self._remove_files()
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_filename, 'r') as fp:
+                return json.load(fp)
+        except (IOError, ValueError):
+            return None
+
+    @property
+    def pages(self):
+        return self.meta['pages']
+
+    @property
+    def next_url(self):
+        """
+        :return: string url of the page to download next. None if no page was downloaded, or the last one was
+        """
+        return self.meta['next']
+
+    @property
+    def complete(self):
+        return self.meta['pages'] > 0 and self.meta['next'] is None
+
+    def saved_records(self):
+        """
+        :return: generator of the records of the pages downloaded in a previous run
+        """
+        if self.meta['pages'] == 0:
+            return
+        with open(self.records_filename, 'rb') as fp:
+            for _ in range(self.meta['records']):
+                yield json.loads(fp.readline())
+
+    def append(self, records, next_url):
+        """
+        Saves the records of a page, then marks the page as done
+        :param records: list of json objects
+        :param next_url: string the 'next' link of the page, None if it is the last one
+        :return:
+        """
+        with open(self.records_filename, 'ab') as fp:
+            for record in records:
+                fp.write(json.dumps(record) + '\n')
+            fp.flush()
+            if self.journal.fsync:
+                os.fsync(fp.fileno())
+            offset = fp.tell()
+
+        self.meta.update({'next': next_url, 'offset': offset, 'updated_at': time.time(),
+                          'pages': self.meta['pages'] + 1, 'records': self.meta['records'] + len(records)})
+        tmp_filename = self.meta_filename + '.tmp'
+        with open(tmp_filename, 'w') as fp:
+            json.dump(self.meta, fp)
+        os.rename(tmp_filename, self.meta_filename)  # the page is done only once this is on disk
+
+    def _remove_files(self):
+        for filename in (self.meta_filename, self.records_filename):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def discard(self):
+        """
+        The call was completed: removes its files
+        """
+        self._remove_files()
+        self.journal.release(self.key)
+
+    def close(self):
+        """
+        The call was interrupted: keeps its files, for the next run
+        """
+        self.journal.release(self.key)
+
+
+class PageJournal(object):
+    """
+    Optional journal of APICalls, that makes long paginated calls (eg the analytics of a large course, with hundreds of
+    pages) survive a crash. While a call is being downloaded, the records of each page and the url of the next page are
+    saved. If the crawl stops (an error, a kill), the next run gives back the saved records and continues from the next
+    page, instead of downloading the whole call again. The entry of a call is removed when its last page is done.
+    Calls are keyed by their url and parameters (without the access token).
+    """
+
+    def __init__(self, directory='./data/journal', max_age=7 * 24 * 3600, fsync=True):
+        """
+        :param directory: string where the entries are saved
+        :param max_age: float seconds. Entries that were not updated for longer are stale, and are started over
+        :param fsync: boolean force every page to disk before it is marked as done (safe after a power loss too)
+        """
+        self.directory = directory
+        self.max_age = max_age
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.open_keys = set()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def path(self, key, kind):
+        return os.path.join(self.directory, '%s.%s' % (key, kind))
+
+    def open(self, url, parameters=None):
+        """
+        :param url: string full url of the first page
+        :param parameters: dictionary
+        :return: JournalEntry with the progress saved so far (none if this call was not started before). None if the
+        same call is being downloaded by another thread right now
+        """
+        normalized = normalize_url(url, parameters)
+        key = hashlib.sha1(normalized).hexdigest()
+        with self.lock:
+            if key in self.open_keys:
+                return None
+            self.open_keys.add(key)
+        return JournalEntry(self, key, normalized)
+
+    def release(self, key):
+        with self.lock:
+            self.open_keys.discard(key)
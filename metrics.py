@@ -0,0 +1,217 @@
+# __author__ = 'dimitrios'
+import re
+import threading
+import time
+import urlparse
+import simplejson as json
+
+
+class Histogram(object):
+    """
+    Counts observations (eg latencies in seconds) in cumulative buckets, as prometheus histograms do
+    """
+    BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+    def __init__(self, buckets=None):
+        """
+        :param buckets: sorted list of upper bounds. An infinite bucket is always added at the end
+        """
+        self.buckets = list(buckets or self.BUCKETS) + [float('inf')]
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        :return: list of (upper bound, number of observations up to it)
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def to_dict(self):
+        return {'buckets': [['+Inf' if bound == float('inf') else bound, count] for bound, count in self.cumulative()],
+                'sum': self.sum, 'count': self.count}
+
+
+class Metrics(object):
+    """
+    Collects what the crawl does, so that it can be exported (to_json, to_prometheus) instead of read from the console.
+    For each CanvasReader method and endpoint (the path with the ids replaced by :id): requests (pages), a latency
+    histogram, bytes, retries, throttled responses, errors and cache hits.
+    For each stage of the crawler: runs, seconds and size of the files it saved.
+    For each kind of file save and load (see utils.file_utilities.add_file_listener): count, seconds and bytes.
+    One Metrics is shared by everything that uses the same APICalls (and can be shared between crawlers).
+    """
+    ID = re.compile(r'/\d+(?=/|$)')
+
+    def __init__(self, buckets=None):
+        """
+        :param buckets: list of upper bounds (seconds) of the latency histograms
+        """
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.endpoints = {}  # (method, endpoint) -> dictionary of counters
+        self.stages = {}  # stage -> dictionary of counters
+        self.files = {}  # (operation, kind) -> dictionary of counters
+        self.started = time.time()
+
+    def endpoint(self, url):
+        """
+        :param url: string full url of a request eg https://canvas.eee.uci.edu/api/v1/courses/1112/users?page=2
+        :return: string eg '/courses/:id/users'
+        """
+        path = urlparse.urlparse(url).path
+        if '/api/v1' in path:
+            path = path.split('/api/v1', 1)[1]
+        return self.ID.sub('/:id', path)
+
+    def record_request(self, method, url, seconds, size, retries=0, throttles=0, error=False, cached=False):
+        """
+        :param method: string the CanvasReader method (or None)
+        :param url: string
+        :param seconds: float time to get the page, including retries
+        :param size: int bytes of the body
+        :param retries: int times the request was sent again
+        :param throttles: int responses that were refused because of the rate limit
+        :param error: boolean the request failed
+        :param cached: boolean the page came from the cache, without a request
+        """
+        key = (method or '', self.endpoint(url))
+        with self.lock:
+            counters = self.endpoints.get(key)
+            if counters is None:
+                counters = {'pages': 0, 'bytes': 0, 'retries': 0, 'throttles': 0, 'errors': 0, 'cache_hits': 0,
+                            'latency': Histogram(self.buckets)}
+                self.endpoints[key] = counters
+            counters['pages'] += 1
+            counters['bytes'] += size
+            counters['retries'] += retries
+            counters['throttles'] += throttles
+            counters['errors'] += int(error)
+            counters['cache_hits'] += int(cached)
+            counters['latency'].observe(seconds)
+
+    def record_stage(self, stage, seconds, output_bytes):
+        """
+        :param stage: string eg 'gradebook'
+        :param seconds: float
+        :param output_bytes: int size of the files that the stage saved
+        """
+        with self.lock:
+            counters = self.stages.setdefault(stage, {'runs': 0, 'seconds': 0.0, 'last_seconds': 0.0,
+                                                      'output_bytes': 0})
+            counters['runs'] += 1
+            counters['seconds'] += seconds
+            counters['last_seconds'] = seconds
+            counters['output_bytes'] = output_bytes
+
+    def record_file(self, operation, kind, filename, seconds, size):
+        """
+        Same arguments as the file listeners of utils.file_utilities
+        :param operation: string 'save' or 'load'
+        :param kind: string the format eg 'csv writer'
+        :param filename: string (not kept, files are counted by operation and kind)
+        :param seconds: float
+        :param size: int bytes of the file
+        """
+        with self.lock:
+            counters = self.files.setdefault((operation, kind), {'count': 0, 'seconds': 0.0, 'bytes': 0})
+            counters['count'] += 1
+            counters['seconds'] += seconds
+            counters['bytes'] += size
+
+    def to_json(self):
+        """
+        :return: dictionary with all the metrics, that can be saved as json
+        """
+        with self.lock:
+            endpoints = []
+            for (method, endpoint), counters in sorted(self.endpoints.items()):
+                entry = dict((k, v) for k, v in counters.items() if k != 'latency')
+                entry.update({'method': method, 'endpoint': endpoint, 'latency': counters['latency'].to_dict()})
+                endpoints.append(entry)
+            stages = [dict(counters, stage=stage) for stage, counters in sorted(self.stages.items())]
+            files = [dict(counters, operation=operation, kind=kind)
+                     for (operation, kind), counters in sorted(self.files.items())]
+        return {'started': self.started, 'uptime_seconds': time.time() - self.started, 'endpoints': endpoints,
+                'stages': stages, 'files': files}
+
+    def save_json(self, filename):
+        with open(filename, 'w') as fp:
+            json.dump(self.to_json(), fp, indent=2)
+
+    def to_prometheus(self):
+        """
+        :return: string with the metrics in the prometheus text exposition format
+        """
+        data = self.to_json()
+        lines = []
+
+        def family(name, kind, description, samples):
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in samples:
+                lines.append('%s{%s} %s' % (name, _labels(labels), _number(value)))
+
+        endpoints = data['endpoints']
+        for field, description in [('pages', 'Pages requested'), ('bytes', 'Bytes of the response bodies'),
+                                   ('retries', 'Requests sent again after a throttled response'),
+                                   ('throttles', 'Responses refused because of the rate limit'),
+                                   ('errors', 'Requests that failed'), ('cache_hits', 'Pages served by the cache')]:
+            family('canvas_api_%s_total' % field, 'counter', description,
+                   [((('method', e['method']), ('endpoint', e['endpoint'])), e[field]) for e in endpoints])
+
+        name = 'canvas_api_request_seconds'
+        lines.append('# HELP %s Time to get a page, including retries' % name)
+        lines.append('# TYPE %s histogram' % name)
+        for e in endpoints:
+            labels = (('method', e['method']), ('endpoint', e['endpoint']))
+            for bound, count in e['latency']['buckets']:
+                lines.append('%s_bucket{%s} %d' % (name, _labels(labels + (('le', _number(bound)),)), count))
+            lines.append('%s_sum{%s} %s' % (name, _labels(labels), _number(e['latency']['sum'])))
+            lines.append('%s_count{%s} %d' % (name, _labels(labels), e['latency']['count']))
+
+        stages = data['stages']
+        family('crawler_stage_runs_total', 'counter', 'Times a stage ran',
+               [((('stage', s['stage']),), s['runs']) for s in stages])
+        family('crawler_stage_seconds_total', 'counter', 'Time spent in a stage',
+               [((('stage', s['stage']),), s['seconds']) for s in stages])
+        family('crawler_stage_last_seconds', 'gauge', 'Time of the last run of a stage',
+               [((('stage', s['stage']),), s['last_seconds']) for s in stages])
+        family('crawler_stage_output_bytes', 'gauge', 'Size of the files saved by a stage',
+               [((('stage', s['stage']),), s['output_bytes']) for s in stages])
+
+        files = data['files']
+        for field, description in [('count', 'Files saved or loaded'),
+                                   ('seconds', 'Time spent saving or loading files'),
+                                   ('bytes', 'Bytes of the files saved or loaded')]:
+            family('crawler_file_%s_total' % field, 'counter', description,
+                   [((('operation', f['operation']), ('kind', f['kind'])), f[field]) for f in files])
+        return '\n'.join(lines) + '\n'
+
+    def save_prometheus(self, filename):
+        with open(filename, 'w') as fp:
+            fp.write(self.to_prometheus())
+
+
+def _labels(labels):
+    escape = lambda v: unicode(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join('%s="%s"' % (k, escape(v)) for k, v in labels)
+
+
+def _number(value):
+    if value == '+Inf' or value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
@@ -2,6 +2,17 @@
 from calls import APICalls
 
 
+def _with_fields(fields, *required):
+    """
+    :param fields: list of field names asked by the caller, None means all of them
+    :param required: names of the fields the reader itself needs
+    :return: fields with the required ones added
+    """
+    if fields is None:
+        return None
+    return list(fields) + [f for f in required if f not in fields]
+
+
 class CanvasReader(object):
     """
     Class that contains functions useful for downloading (reading) entities for a course.
@@ -10,10 +21,27 @@ class CanvasReader(object):
     Token that authorises this, has to have access to the course material in order for these to work. ie a professor
     or TA
     (Failure is not currently being handled ie you should handle your own exceptions :)
+    Functions that return lists take fields: a list of the keys to keep (eg ['id', 'name']). Then every object is a
+    Record (see records.py) with only these keys, which is much smaller than the whole dictionary and is decoded
+    without building one. None (the default) returns the whole dictionaries.
     """
 
-    def __init__(self, access_token, base_url, api_prefix='/api/v1', verbose=True):
-        self.api = APICalls(access_token, base_url + api_prefix, verbose=verbose)
+    def __init__(self, access_token, base_url, api_prefix='/api/v1', verbose=True, transport=None, parallel_pages=1,
+                 scheduler=None, cache=None, metrics=None, hooks=None, journal=None):
+        """
+        :param transport: HTTPTransport to share between readers. If None, a new one is created
+        :param parallel_pages: int threads used to download the pages of one entity in parallel (see APICalls)
+        :param scheduler: RateLimitScheduler to share between readers that use the same token. If None, a new one is
+        created
+        :param cache: ResponseCache that keeps the responses between runs. None means no cache
+        :param metrics: Metrics to share between readers. If None, a new one is created (self.api.metrics)
+        :param hooks: list of functions that wrap every page request (see APICalls)
+        :param journal: PageJournal that lets interrupted paginated calls continue where they stopped. None means no
+        journal
+        """
+        self.api = APICalls(access_token, base_url + api_prefix, verbose=verbose, transport=transport,
+                            parallel_pages=parallel_pages, scheduler=scheduler, cache=cache, metrics=metrics,
+                            hooks=hooks, journal=journal)
 
     def get_course_info(self, course_id):
         """
@@ -25,24 +53,91 @@ class CanvasReader(object):
         u'enrollment_term_id', u'hide_final_grades', u'end_at', u'apply_assignment_group_weights', u'calendar',
         u'enrollments', u'is_public', u'course_code', u'id', u'name']
         """
-        return self.api.get('/courses/%s' % course_id, single=True)
+        return self.api.get('/courses/%s' % course_id, single=True, label='get_course_info')
 
-    def get_users(self, course_id):
+    def get_account_courses(self, account_id, term_id=None, fields=None):
+        """
+        :param account_id: string eg '1'. The token must be an admin of the account
+        :param term_id: string enrollment term id, only the courses of this term. None means all the courses
+        :return: list of course dictionaries (same keys as get_course_info)
+        """
+        return list(self.iter_account_courses(account_id, term_id, fields))
+
+    def iter_account_courses(self, account_id, term_id=None, fields=None):
+        """
+        Same as get_account_courses, but streams the courses page by page
+        :return: generator of dictionaries
+        """
+        parameters = {}
+        if term_id is not None:
+            parameters['enrollment_term_id'] = term_id
+        return self.api.iter('/accounts/%s/courses' % account_id, parameters=parameters, label='get_account_courses',
+                             fields=fields)
+
+    def get_users(self, course_id, fields=None):
         """
         :param course_id: string eg: '1121'- you must have access to this course material for this to work
         :return: list of dictionaries (one for each user)
         dict has fields [u'sortable_name', u'id', u'short_name', u'name']
         """
-        return self.api.get('/courses/%s/users' % course_id)
+        return list(self.iter_users(course_id, fields))
+
+    def iter_users(self, course_id, fields=None):
+        """
+        Same as get_users, but streams the users page by page
+        :param course_id: string
+        :return: generator of dictionaries
+        """
+        return self.api.iter('/courses/%s/users' % course_id, label='get_users', fields=fields)
 
 
-    def get_student_assignment_submissions(self, course_id, students):
-        parameters = {'student_ids': students, 'grouped': True}
-        user_submissions = self.api.get('/courses/%s/students/submissions' % course_id, parameters=parameters)
-        return user_submissions
+    def get_student_assignment_submissions(self, course_id, students, grouped=True, fields=None):
+        """
+        Returns the submissions of many students, for all the assignments of the course, in one (paginated) call.
+        Keep the list of students short enough for the url (a few hundred ids at most).
+        :param course_id: string
+        :param students: list of user ids, or 'all'
+        :param grouped: boolean group the submissions by student
+        :return: list of dictionaries (one for each student if grouped, else one for each submission)
+        dict keys (grouped): [u'user_id', u'section_id', u'submissions'], where submissions is a list of dictionaries
+        with the same keys as in get_assignment_submissions
+        """
+        return list(self.iter_student_assignment_submissions(course_id, students, grouped=grouped, fields=fields))
+
+    def iter_student_assignment_submissions(self, course_id, students, grouped=True, fields=None):
+        """
+        Same as get_student_assignment_submissions, but streams the results page by page
+        :param course_id: string
+        :param students: list of user ids, or 'all'
+        :param grouped: boolean
+        :return: generator of dictionaries
+        """
+        if students != 'all':
+            students = list(students)
+        parameters = {'student_ids[]': students, 'grouped': grouped}
+        return self.api.iter('/courses/%s/students/submissions' % course_id, parameters=parameters,
+                             label='get_student_assignment_submissions', fields=fields)
 
 
-    def get_assignments(self, course_id):
+    def get_changed_submissions(self, course_id, since, fields=None):
+        """
+        Returns the submissions of all the students that were submitted or graded after a point in time. Used for
+        incremental sync.
+        :param course_id: string
+        :param since: string ISO 8601 time eg '2016-05-01T00:00:00Z'
+        :return: list of dictionaries (one for each submission, same keys as in get_assignment_submissions)
+        """
+        submissions = {}
+        fields = _with_fields(fields, 'id', 'workflow_state')
+        for field in ('submitted_since', 'graded_since'):
+            parameters = {'student_ids[]': 'all', field: since}
+            for s in self.api.iter('/courses/%s/students/submissions' % course_id, parameters=parameters,
+                                   label='get_changed_submissions', fields=fields):
+                submissions[s['id']] = s
+        return filter(lambda sub: sub['workflow_state'] != 'unsubmitted', submissions.values())
+
+
+    def get_assignments(self, course_id, fields=None):
         """
         All the assignments in the course
         :param course_id: string
@@ -54,10 +149,18 @@ class CanvasReader(object):
          u'created_at', u'post_to_sis', u'lock_at', u'assignment_group_id', u'automatic_peer_reviews', u'published',
          u'position', u'submission_types', u'submissions_download_url', u'unpublishable']
         """
-        return self.api.get('/courses/%s/assignments' % course_id)
+        return list(self.iter_assignments(course_id, fields))
+
+    def iter_assignments(self, course_id, fields=None):
+        """
+        Same as get_assignments, but streams the assignments page by page
+        :param course_id: string
+        :return: generator of dictionaries
+        """
+        return self.api.iter('/courses/%s/assignments' % course_id, label='get_assignments', fields=fields)
 
 
-    def get_assignment_submissions(self, course_id, assignment_id, grouped=False):
+    def get_assignment_submissions(self, course_id, assignment_id, grouped=False, fields=None):
         """
         Returns the submissions for a particular assignment
         Only returns those submissions that have actually been submitted, rather than potential submissions.
@@ -68,23 +171,41 @@ class CanvasReader(object):
         u'preview_url', u'late', u'grade', u'score', u'grade_matches_current_submission', u'grader_id', u'graded_at',
         u'submission_type', u'id', u'assignment_id']
         """
+        return list(self.iter_assignment_submissions(course_id, assignment_id, grouped=grouped, fields=fields))
+
+    def iter_assignment_submissions(self, course_id, assignment_id, grouped=False, fields=None):
+        """
+        Same as get_assignment_submissions, but streams the submissions page by page
+        :param course_id: string
+        :param assignment_id: string
+        :return: generator of dictionaries
+        """
         parameters = {'grouped': grouped}
-        submissions = self.api.get('/courses/%s/assignments/%s/submissions' % (course_id, assignment_id),
-                                   parameters=parameters)
-        return filter(lambda sub: sub['workflow_state'] != 'unsubmitted', submissions)
+        submissions = self.api.iter('/courses/%s/assignments/%s/submissions' % (course_id, assignment_id),
+                                    parameters=parameters, label='get_assignment_submissions',
+                                    fields=_with_fields(fields, 'workflow_state'))
+        return (sub for sub in submissions if sub['workflow_state'] != 'unsubmitted')
 
 
-    def get_assignment_groups(self, course_id):
+    def get_assignment_groups(self, course_id, fields=None):
         """
         Assignements in cavnas are classified intro groups. This returns the info for all such groups
         :param course_id: string
         :return: list of dictionaries with group info
         dictionary keys: [u'group_weight', u'position', u'rules', u'id', u'name']
         """
-        return self.api.get('/courses/%s/assignment_groups' % course_id)
+        return list(self.iter_assignment_groups(course_id, fields))
+
+    def iter_assignment_groups(self, course_id, fields=None):
+        """
+        Same as get_assignment_groups, but streams the groups page by page
+        :param course_id: string
+        :return: generator of dictionaries
+        """
+        return self.api.iter('/courses/%s/assignment_groups' % course_id, label='get_assignment_groups', fields=fields)
 
 
-    def get_discussion_topics(self, course_id):
+    def get_discussion_topics(self, course_id, fields=None):
         """
         Returns a list of all the topics in the discussion forum in the class
         :param course_id: string
@@ -97,7 +218,15 @@ class CanvasReader(object):
         u'group_category_id', u'only_graders_can_rate', u'lock_at', u'author', u'assignment_id', u'published',
         u'position']
         """
-        return self.api.get('/courses/%s/discussion_topics' % course_id)
+        return list(self.iter_discussion_topics(course_id, fields))
+
+    def iter_discussion_topics(self, course_id, fields=None):
+        """
+        Same as get_discussion_topics, but streams the topics page by page
+        :param course_id: string
+        :return: generator of dictionaries
+        """
+        return self.api.iter('/courses/%s/discussion_topics' % course_id, label='get_discussion_topics', fields=fields)
 
 
     def get_discussion_topic(self, course_id, topic_id):
@@ -111,17 +240,27 @@ class CanvasReader(object):
         """
         p = dict()
         p['include_new_entries'] = 1
-        return self.api.get('/courses/%s/discussion_topics/%s/view' % (course_id, topic_id), single=True, parameters=p)
+        return self.api.get('/courses/%s/discussion_topics/%s/view' % (course_id, topic_id), single=True, parameters=p,
+                            label='get_discussion_topic')
 
 
-    def get_student_summary_analytics(self, course_id):
+    def get_student_summary_analytics(self, course_id, fields=None):
         """
         Returns aggregated analytics for each user.
         :param course_id: string
         :return: list of dicitonaries (one for each student in the course)
         dictionary keys: [u'participations', u'tardiness_breakdown', u'max_page_views', u'max_participations', u'page_views', u'id']
         """
-        return self.api.get('/courses/%s/analytics/student_summaries' % course_id)
+        return list(self.iter_student_summary_analytics(course_id, fields))
+
+    def iter_student_summary_analytics(self, course_id, fields=None):
+        """
+        Same as get_student_summary_analytics, but streams the students page by page
+        :param course_id: string
+        :return: generator of dictionaries
+        """
+        return self.api.iter('/courses/%s/analytics/student_summaries' % course_id,
+                             label='get_student_summary_analytics', fields=fields)
 
 
     def get_student_activity_analytics(self, course_id, user_id):
@@ -132,12 +271,21 @@ class CanvasReader(object):
         :param user_id:
         :return:
         """
-        return self.api.get('/courses/%s/analytics/users/%s/activity' % (course_id, user_id), single=True)
+        return self.api.get('/courses/%s/analytics/users/%s/activity' % (course_id, user_id), single=True,
+                            label='get_student_activity_analytics')
+
+
+    def get_participation_analytics(self, course_id, fields=None):
+        return list(self.iter_participation_analytics(course_id, fields))
 
+    def iter_participation_analytics(self, course_id, fields=None):
+        return self.api.iter('/courses/%s/analytics/activity' % course_id, label='get_participation_analytics',
+                             fields=fields)
 
-    def get_participation_analytics(self, course_id):
-        return self.api.get('/courses/%s/analytics/activity' % course_id)
 
+    def get_assignment_analytics(self, course_id, fields=None):
+        return list(self.iter_assignment_analytics(course_id, fields))
 
-    def get_assignment_analytics(self, course_id):
-        return self.api.get('/courses/%s/analytics/assignments' % course_id)
+    def iter_assignment_analytics(self, course_id, fields=None):
+        return self.api.iter('/courses/%s/analytics/assignments' % course_id, label='get_assignment_analytics',
+                             fields=fields)
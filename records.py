@@ -0,0 +1,98 @@
+# __author__ = 'dimitrios'
+import simplejson as json
+
+_types = {}  # tuple of fields -> record class
+
+
+class Record(tuple):
+    """
+    A compact, read only canvas object that keeps only some fields (see record_type). It is a tuple (no dictionary
+    for each object), but can be read like the dictionary it replaces: record['name'], record.get('rules', {}),
+    'name' in record, record.keys(). record.name works too.
+    """
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            try:
+                return tuple.__getitem__(self, self._index[key])
+            except KeyError:
+                raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+    def __getattr__(self, name):
+        try:
+            return tuple.__getitem__(self, self._index[name])
+        except KeyError:
+            raise AttributeError(name)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key, default=None):
+        if key not in self._index:
+            return default
+        return tuple.__getitem__(self, self._index[key])
+
+    def keys(self):
+        return list(self._fields)
+
+    def items(self):
+        return zip(self._fields, self)
+
+    def as_dict(self):
+        return dict(zip(self._fields, self))
+
+    def __reduce__(self):  # the classes are made at run time, pickle them by their fields
+        return _make_record, (self._fields, tuple(self))
+
+    def __repr__(self):
+        return 'Record(%s)' % ', '.join('%s=%r' % item for item in self.items())
+
+
+def record_type(fields):
+    """
+    :param fields: list of field names eg ['id', 'name']
+    :return: the Record class with these fields (one class for each list of fields)
+    """
+    fields = tuple(fields)
+    cls = _types.get(fields)
+    if cls is None:
+        cls = type('Record', (Record,), {'__slots__': (), '_fields': fields,
+                                         '_index': dict((f, i) for i, f in enumerate(fields))})
+        _types[fields] = cls
+    return cls
+
+
+def _make_record(fields, values):
+    return record_type(fields)(values)
+
+
+def project(obj, fields):
+    """
+    :param obj: dictionary (a decoded canvas object)
+    :param fields: list of field names
+    :return: Record with these fields of obj (None for missing ones)
+    """
+    get = obj.get
+    return record_type(fields)([get(f) for f in fields])
+
+
+def iter_records(text, fields):
+    """
+    Decodes a page and keeps only some fields of each object. The page is decoded at once (the C decoder of simplejson
+    is faster on a whole page than on one object at a time, and a page has at most 100 objects), and each dictionary
+    is dropped as soon as its Record is made, so only the Records are kept
+    :param text: string the body of a response with a json list
+    :param fields: list of field names
+    :return: generator of Records, with only these fields of each element
+    """
+    cls = record_type(fields)
+    fields = cls._fields
+    page = json.loads(text)
+    page.reverse()
+    while page:
+        get = page.pop().get
+        yield cls([get(f) for f in fields])
@@ -0,0 +1,177 @@
+# __author__ = 'dimitrios'
+import collections
+import random
+import sys
+import threading
+import time
+import requests
+
+
+class RateLimitScheduler(object):
+    """
+    Schedules the requests of APICalls around the canvas rate limit.
+    Canvas gives every token a quota, and tells how much of it is left in the X-Rate-Limit-Remaining header (and how
+    much the last request cost in X-Request-Cost). When the quota runs out, requests fail with
+    403 'Rate Limit Exceeded'.
+    The scheduler keeps a concurrency limit (how many requests can be running at the same time): it grows slowly while
+    the remaining quota is high, and is halved when the quota gets low or a request is throttled. Throttled requests are
+    retried after a jittered exponential backoff, and so are requests that failed for a transient reason (the connection
+    dropped or timed out, or canvas answered 500, 502, 503 or 504).
+    One scheduler is shared by all the threads that use the same APICalls.
+    """
+
+    TRANSIENT_STATUS = (500, 502, 503, 504)
+    TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                        requests.exceptions.ChunkedEncodingError)
+
+    def __init__(self, max_concurrency=16, min_remaining=100, max_retries=8, backoff=1, max_backoff=60,
+                 window=60):
+        """
+        :param max_concurrency: int upper bound of the concurrency limit
+        :param min_remaining: float below this remaining quota the concurrency limit is halved
+        :param max_retries: int times a throttled (or failed) request is retried before its error is raised
+        :param backoff: float seconds, base of the exponential backoff
+        :param max_backoff: float seconds, longest wait between two retries
+        :param window: float seconds over which the throughput is measured
+        """
+        self.max_concurrency = max_concurrency
+        self.min_remaining = min_remaining
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.window = window
+
+        self.limit = float(max_concurrency)
+        self.active = 0
+        self.condition = threading.Condition()
+
+        self.remaining = None  # last X-Rate-Limit-Remaining seen
+        self.cost = None  # last X-Request-Cost seen
+        self.requests = 0
+        self.throttles = 0
+        self.errors = 0  # transient failures
+        self.retries = 0
+        self.finished = collections.deque()  # time of the requests finished within the window
+
+    def _acquire(self):
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+
+    def _release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def _update(self, r):
+        """
+        Reads the quota headers of a response, and moves the concurrency limit up or down
+        :param r: response
+        :return:
+        """
+        with self.condition:
+            now = time.time()
+            self.requests += 1
+            self.finished.append(now)
+            while self.finished and self.finished[0] < now - self.window:
+                self.finished.popleft()
+
+            remaining = r.headers.get('X-Rate-Limit-Remaining')
+            cost = r.headers.get('X-Request-Cost')
+            if cost is not None:
+                self.cost = float(cost)
+            if remaining is None:
+                return
+            self.remaining = float(remaining)
+
+            if self.remaining < self.min_remaining:
+                self.limit = max(1.0, self.limit / 2)  # multiplicative decrease
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)  # additive increase
+            self.condition.notify_all()
+
+    def is_throttled(self, r):
+        """
+        :param r: response
+        :return: boolean whether canvas refused the request because of the rate limit
+        """
+        if r.status_code == 429:
+            return True
+        return r.status_code == 403 and 'Rate Limit Exceeded' in r.text
+
+    def _wait(self, attempt):
+        """
+        Sleeps before retrying a throttled request. The wait is random (full jitter), so that threads that were
+        throttled together do not retry together
+        :param attempt: int number of retries so far
+        :return:
+        """
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    def send(self, request):
+        """
+        Runs a request within the concurrency limit, and retries it while it is throttled or fails for a transient
+        reason
+        :param request: function with no arguments, that sends the request and returns the response
+        :return: response (the last one, if it was still throttled after max_retries). The exception of the last
+        attempt is raised, if it was still failing after max_retries
+        """
+        attempt = 0
+        while True:
+            self._acquire()
+            error = None
+            try:
+                r = request()
+            except self.TRANSIENT_ERRORS:
+                error = sys.exc_info()
+            finally:
+                self._release()
+
+            throttled = error is None and self.is_throttled(r)
+            if error is None:
+                self._update(r)
+                if not throttled and r.status_code not in self.TRANSIENT_STATUS:
+                    return r
+            if attempt >= self.max_retries:
+                if error is not None:
+                    raise error[0], error[1], error[2]
+                return r
+
+            with self.condition:
+                self.retries += 1
+                if throttled:
+                    self.throttles += 1
+                    self.limit = max(1.0, self.limit / 2)
+                else:
+                    self.errors += 1
+            self._wait(attempt)
+            attempt += 1
+
+    def throughput(self):
+        """
+        :return: float requests per second, over the last window seconds
+        """
+        with self.condition:
+            now = time.time()
+            recent = [t for t in self.finished if t >= now - self.window]
+            if not recent:
+                return 0.0
+            return len(recent) / max(now - recent[0], 1e-3)
+
+    def stats(self):
+        """
+        :return: dictionary with the current state of the scheduler
+        """
+        return {'requests': self.requests,
+                'throttles': self.throttles,
+                'errors': self.errors,
+                'retries': self.retries,
+                'concurrency_limit': int(self.limit),
+                'rate_limit_remaining': self.remaining,
+                'last_request_cost': self.cost,
+                'requests_per_second': self.throughput()}
+
+    def report(self):
+        print '--> %(requests)d requests, %(requests_per_second).1f requests/s, %(throttles)d throttled, ' \
+              '%(errors)d failed and retried, concurrency limit %(concurrency_limit)d, rate limit remaining %(rate_limit_remaining)s' % self.stats()
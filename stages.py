@@ -0,0 +1,161 @@
+# __author__ = 'dimitrios'
+import itertools
+import sys
+import threading
+import time
+
+_order = itertools.count()
+
+
+def stage(name, requires=(), outputs=()):
+    """
+    Decorator that marks a method of a crawler as a stage (see CourseCrawler.stages). The method is called with the
+    results of the stages it requires, in the order they are listed
+    :param name: string eg 'gradebook'
+    :param requires: list of names of the stages that must be done before this one
+    :param outputs: list of the files that the stage saves (glob patterns under the course directory)
+    :return: the method, unchanged
+    """
+    def decorate(method):
+        method.stage_info = {'name': name, 'requires': tuple(requires), 'outputs': list(outputs),
+                             'order': next(_order)}
+        return method
+    return decorate
+
+
+class Stage(object):
+    def __init__(self, name, function, requires=(), outputs=()):
+        """
+        :param name: string
+        :param function: called with the results of the required stages, its result is given to the stages that
+        require this one
+        :param requires: list of stage names
+        :param outputs: list of glob patterns of the files it saves
+        """
+        self.name = name
+        self.function = function
+        self.requires = tuple(requires)
+        self.outputs = list(outputs)
+
+
+class StageRunner(object):
+    """
+    Runs a graph of stages: each stage starts as soon as the stages it requires are done, so stages that do not
+    depend on each other run at the same time (each in its own thread). A subset of the stages can be run, together
+    with everything they require.
+    If a stage fails, no new stage is started, the running ones are waited for, and the error is raised.
+    """
+
+    def __init__(self, stages):
+        """
+        :param stages: list of Stage. Every required stage must be in the list, and there can be no cycles
+        """
+        self.stages = dict((s.name, s) for s in stages)
+        self.order = self._topological_order([s.name for s in stages])
+
+    def _topological_order(self, names):
+        order = []
+        state = {}  # name -> 'visiting' or 'done'
+
+        def visit(name, path):
+            if name not in self.stages:
+                raise ValueError('unknown stage %s (required by %s)' % (name, ' -> '.join(path) or 'the selection'))
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError('the stages have a cycle: %s' % ' -> '.join(path + [name]))
+            state[name] = 'visiting'
+            for required in self.stages[name].requires:
+                visit(required, path + [name])
+            state[name] = 'done'
+            order.append(name)
+
+        for name in names:
+            visit(name, [])
+        return order
+
+    def select(self, names=None):
+        """
+        :param names: list of stage names, None means all of them
+        :return: list of the names of these stages and all the stages they require, in an order that can run them one
+        by one
+        """
+        if names is None:
+            return list(self.order)
+        return self._topological_order(names)
+
+    def run(self, names=None, max_parallel=None, on_done=None):
+        """
+        :param names: list of the stages to run (their requirements are added). None means all of them
+        :param max_parallel: int max number of stages running at the same time. None means no limit, 1 runs them one
+        by one
+        :param on_done: function called with (name, seconds) when a stage is done, from the thread of the stage
+        :return: dictionary from name to the result of the stage, and dictionary from name to seconds
+        """
+        selected = self.select(names)
+        waiting = list(selected)
+        results = {}
+        durations = {}
+        errors = []
+        running = set()
+        condition = threading.Condition()
+
+        def work(s):
+            t = time.time()
+            try:
+                result = s.function(*[results[r] for r in s.requires])
+                error = None
+            except Exception:
+                result, error = None, sys.exc_info()
+            seconds = time.time() - t
+            try:
+                if error is None and on_done is not None:
+                    on_done(s.name, seconds)
+            except Exception:  # fails the run like an error of the stage, instead of leaving it running forever
+                result, error = None, sys.exc_info()
+            with condition:
+                running.discard(s.name)
+                durations[s.name] = seconds
+                if error is None:
+                    results[s.name] = result
+                else:
+                    errors.append(error)
+                condition.notify_all()
+
+        with condition:
+            while True:
+                if not errors:
+                    for name in list(waiting):
+                        if max_parallel is not None and len(running) >= max_parallel:
+                            break
+                        if all(r in results for r in self.stages[name].requires):
+                            waiting.remove(name)
+                            running.add(name)
+                            thread = threading.Thread(target=work, args=(self.stages[name],))
+                            thread.daemon = True
+                            thread.start()
+                if not running:
+                    break
+                condition.wait()
+
+        if errors:
+            error_type, error, traceback = errors[0]
+            raise error_type, error, traceback
+        return results, durations
+
+    def critical_path(self, durations):
+        """
+        :param durations: dictionary from name to seconds, of the stages that ran
+        :return: the seconds of the longest chain of stages that had to run one after the other, and the list of their
+        names. No schedule can take less time than this
+        """
+        longest = {}  # name -> (seconds, path) of the longest chain that ends with it
+        for name in self.order:
+            if name not in durations:
+                continue
+            before = [longest[r] for r in self.stages[name].requires if r in longest]
+            seconds, path = max(before) if before else (0, [])
+            longest[name] = (seconds + durations[name], path + [name])
+        if not longest:
+            return 0, []
+        return max(longest.values())
@@ -0,0 +1,89 @@
+# __author__ = 'dimitrios'
+import argparse
+import hashlib
+import hmac
+import os
+from utils.file_utilities import load_csv, load_pickle, save_csv
+
+ID_BITS = 48  # the ids stay exact in float64 tables (eg the gradebook), and collide with probability ~n^2 / 2^49
+
+
+class KeyedAnonymizer(object):
+    """
+    Gives every canvas user a pseudonymous id derived from a secret key and the canvas id (a truncated HMAC-SHA256).
+    The same user always gets the same id, in every course, crawl and worker that uses the same key, so nothing has to
+    be shared between them (unlike the sequential ids, which come from one shuffled list of the students), and users
+    that join the course later get an id without renumbering anyone.
+    Keep the key secret: with the key, ids can be checked against a list of canvas ids.
+    """
+
+    def __init__(self, key, bits=ID_BITS):
+        """
+        :param key: string secret key
+        :param bits: int size of the ids, at most 53 so that they are exact as floats
+        """
+        if not key:
+            raise ValueError('the keyed anonymization needs a secret key (anonymization_key in config.txt)')
+        if not 1 <= bits <= 53:
+            raise ValueError('bits must be between 1 and 53')
+        self.key = key.encode('utf-8') if isinstance(key, unicode) else key
+        self.bits = bits
+
+    def anonymize(self, user_id):
+        """
+        :param user_id: canvas id (int or string)
+        :return: int between 1 and 2 ** bits
+        """
+        digest = hmac.new(self.key, str(user_id), hashlib.sha256).digest()
+        return (int(digest[:8].encode('hex'), 16) >> (64 - self.bits)) + 1
+
+    def projector(self, user_ids):
+        """
+        :param user_ids: list of canvas ids
+        :return: dictionary from canvas id to anonymized id, same as the sequential projector of CourseCrawler
+        """
+        projector = dict((user_id, self.anonymize(user_id)) for user_id in user_ids)
+        if len(set(projector.values())) != len(projector):
+            raise ValueError('two users got the same anonymized id, use more bits')
+        return projector
+
+
+def migrate_projector(course_directory, anonymizer):
+    """
+    Moves a course that was downloaded with sequential ids to keyed ids: user_info.csv gets the keyed ids, the old
+    and new id of each student are saved in user_id_migration.csv (no canvas ids in it, it can be shared to translate
+    the other files), and the projector pickle is renamed to user_projector.pkl.migrated.
+    The other files of the course still use the old ids: translate them with user_id_migration.csv, or delete them so
+    that the crawler downloads them again.
+    :param course_directory: string eg './data/<course name>'
+    :param anonymizer: KeyedAnonymizer
+    :return: dictionary from old anonymized id to new one
+    """
+    projector_filename = os.path.join(course_directory, 'tmp', 'user_projector.pkl')
+    users_filename = os.path.join(course_directory, 'user_info.csv')
+    projector = load_pickle(projector_filename)
+    keyed = anonymizer.projector(projector.keys())
+    migration = dict((old, keyed[user_id]) for user_id, old in projector.iteritems())
+
+    rows = load_csv(users_filename)
+    index = rows[0].index('Anonymised ID')
+    for row in rows[1:]:
+        row[index] = migration[int(row[index])]
+    save_csv(users_filename, rows)
+    save_csv(os.path.join(course_directory, 'user_id_migration.csv'),
+             [['Old Anonymised ID', 'Anonymised ID']] + sorted(migration.items()))
+    os.rename(projector_filename, projector_filename + '.migrated')
+    return migration
+
+
+if __name__ == '__main__':
+    import utils.config as config
+    parser = argparse.ArgumentParser(description='moves a downloaded course from sequential to keyed anonymized ids, '
+                                                 'with the anonymization_key of config.txt')
+    parser.add_argument('course_directory', help='eg "./data/<course name>". Run from the root directory, as '
+                                                 'python -m utils.anonymize')
+    args = parser.parse_args()
+    migration = migrate_projector(args.course_directory,
+                                  KeyedAnonymizer(config.get_config('info').get('anonymization_key')))
+    print '--> %d students have keyed ids. The other files of the course still use the old ids, translate them with ' \
+          'user_id_migration.csv or delete them to download them again' % len(migration)
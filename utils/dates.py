@@ -0,0 +1,56 @@
+# __author__ = 'dimitrios'
+from datetime import datetime
+import numpy as np
+from dateutil import tz
+
+
+class DateConverter(object):
+    """
+    Converts whole columns of UTC timestamps to local dates and times at once, with numpy.
+    The timezone is looked up once. The utc offset is computed once for each distinct hour of the column (and only
+    for the timestamps of an hour in which the offset changes, eg daylight saving, it is computed one by one).
+    """
+    def __init__(self, timezone='America/Los_Angeles'):
+        """
+        :param timezone: string name of the local timezone eg 'America/Los_Angeles'
+        """
+        self.timezone = tz.gettz(timezone)
+        if self.timezone is None:
+            raise ValueError('unknown timezone %s' % timezone)
+        self.utc = tz.tzutc()
+        self.offsets = {}  # utc hour (seconds since epoch) -> offset in seconds, None if it changes within the hour
+
+    def _offset(self, seconds):
+        """
+        :param seconds: int utc seconds since epoch
+        :return: int utc offset of the local timezone at that moment, in seconds
+        """
+        dt = datetime.utcfromtimestamp(seconds).replace(tzinfo=self.utc).astimezone(self.timezone)
+        offset = dt.utcoffset()
+        return offset.days * 86400 + offset.seconds
+
+    def _hour_offset(self, hour):
+        if hour not in self.offsets:
+            start = self._offset(hour)
+            self.offsets[hour] = start if start == self._offset(hour + 3599) else None
+        return self.offsets[hour]
+
+    def convert(self, timestamps):
+        """
+        :param timestamps: list of strings 'YYYY-MM-DDTHH:MM:SS' in UTC
+        :return: two lists of strings, the local dates 'YYYY-MM-DD' and times 'HH:MM'
+        """
+        if len(timestamps) == 0:
+            return [], []
+        utc = np.array(timestamps, dtype='datetime64[s]').astype(np.int64)
+        hours, inverse = np.unique(utc - utc % 3600, return_inverse=True)
+
+        hour_offsets = [self._hour_offset(int(h)) for h in hours]
+        offsets = np.array([0 if o is None else o for o in hour_offsets], dtype=np.int64)[inverse]
+        for i in np.flatnonzero(np.array([o is None for o in hour_offsets])[inverse]):
+            offsets[i] = self._offset(int(utc[i]))  # the offset changes within this hour
+
+        local = (utc + offsets).astype('datetime64[s]')
+        dates = np.datetime_as_string(local.astype('datetime64[D]'))
+        times = np.array([t[11:] for t in np.datetime_as_string(local.astype('datetime64[m]'))])
+        return dates.tolist(), times.tolist()
@@ -3,10 +3,43 @@
 import pickle
 import time
 import numpy as np
-import sys
 import simplejson as json
 import os
 import csv
+import struct
+
+
+_listeners = []  # functions called after every timed save and load, see add_file_listener
+
+
+def add_file_listener(listener):
+    """
+    Registers a function that is called after every save and load of these helpers, as
+    listener(operation, kind, filename, seconds, size), where operation is 'save' or 'load', kind the format (eg 'csv')
+    and size the bytes of the file. Used to collect the timings in Metrics (see Metrics.record_file)
+    :param listener: function
+    :return:
+    """
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_file_listener(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def _timed(operation, kind, filename, t, verbose):
+    """
+    Reports a save or load that started at t: prints its time if verbose, and calls the listeners
+    """
+    seconds = time.time() - t
+    if verbose:
+        print '--> %s ' % ('Saving' if operation == 'save' else 'Loading'), filename, ' with %s was ' % kind, seconds
+    if _listeners:
+        size = os.path.getsize(filename) if os.path.isfile(filename) else 0
+        for listener in list(_listeners):
+            listener(operation, kind, filename, seconds, size)
 
 
 def file_exists(filename):
@@ -16,37 +49,61 @@ def file_exists(filename):
 def make_dir(filename):
     dir_path = os.path.dirname(filename)
     if not os.path.exists(dir_path):
-        os.makedirs(dir_path)
+        try:
+            os.makedirs(dir_path)
+        except OSError:  # created by another thread in the meantime
+            if not os.path.isdir(dir_path):
+                raise
+
 
+def load_lines(filename):
+    """
+    reads a file with one item per line (eg a manifest of the work that is done)
+    :param filename: str
+    :return: set of strings, empty if the file does not exist
+    """
+    if not file_exists(filename):
+        return set()
+    with open(filename, 'r') as f:
+        return set(line.strip() for line in f if line.strip())
 
-def save_pickle(filename, obj):
+
+def append_line(filename, line):
+    """
+    appends one line to a file, and flushes it to disk so that it survives if the program is interrupted
+    :param filename: str
+    :param line: str
+    :return:
+    """
+    make_dir(filename)
+    with open(filename, 'a') as f:
+        f.write('%s\n' % line)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def save_pickle(filename, obj, verbose=True):
     make_dir(filename)
-    print '--> Saving ', filename, ' with pickle was ',
-    sys.stdout.flush()
     t = time.time()
     with open(filename, 'wb') as gfp:
         pickle.dump(obj, gfp, protocol=pickle.HIGHEST_PROTOCOL)
-    print time.time() - t
+    _timed('save', 'pickle', filename, t, verbose)
 
 
-def save_array(filename, obj):
+def save_array(filename, obj, verbose=True):
     make_dir(filename)
-    print '--> Saving ', filename, ' with np.array was ',
-    sys.stdout.flush()
     t = time.time()
     if not isinstance(obj, np.ndarray):
         obj = np.array(obj)
     np.save(filename, obj)
-    print time.time() - t
+    _timed('save', 'np.array', filename, t, verbose)
 
 
-def save_txt(filename, obj, delimiter=','):
+def save_txt(filename, obj, delimiter=',', verbose=True):
     make_dir(filename)
-    print '--> Saving ', filename, ' with np.savetxt was ',
-    sys.stdout.flush()
     t = time.time()
     np.savetxt(filename, obj, delimiter=delimiter)
-    print time.time() - t
+    _timed('save', 'np.savetxt', filename, t, verbose)
 
 
 def save_csv(filename, obj, verbose=True):
@@ -54,68 +111,261 @@ def save_csv(filename, obj, verbose=True):
     saves a list of lists as a csv file
     :param filename: str
     :param obj: list of lists
+    :param verbose: boolean print the time it took
     :return:
     """
     make_dir(filename)
-    if verbose:
-        print '--> Saving ', filename, ' with csv writer was ',
-        sys.stdout.flush()
-
     t = time.time()
     with open(filename, "w") as f:
         writer = csv.writer(f)
         writer.writerows(obj)
+    _timed('save', 'csv writer', filename, t, verbose)
 
-    if verbose:
-        print time.time() - t
+
+def load_csv(filename):
+    """
+    :param filename: str a file saved with save_csv
+    :return: list of lists of strings
+    """
+    with open(filename, 'r') as f:
+        return list(csv.reader(f))
 
 
-def load_pickle(filename):
-    print '--> Loading ', filename, ' with pickle was ',
-    sys.stdout.flush()
+def load_pickle(filename, verbose=True):
     t = time.time()
     with open(filename, 'rb') as gfp:
         r = pickle.load(gfp)
-    print time.time() - t
+    _timed('load', 'pickle', filename, t, verbose)
     return r
 
 
-def load_array(filename):
-    print '--> Loading ', filename, ' with pickle was ',
-    sys.stdout.flush()
+def load_array(filename, verbose=True):
     t = time.time()
     r = np.load(filename)
-    print time.time() - t
+    _timed('load', 'np.load', filename, t, verbose)
     return r
 
 
-def save_json(filename, obj):
+def save_json(filename, obj, verbose=True):
     make_dir(filename)
-    print '--> Saving ', filename, ' with json was ',
-    sys.stdout.flush()
     t = time.time()
     with open(filename, 'w') as fp:
         json.dump(obj, fp)
+    _timed('save', 'json', filename, t, verbose)
 
-    fp.close()
-    print time.time() - t
 
-
-def load_json(filename):
-    print '--> Loading ', filename, ' with json was ',
-    sys.stdout.flush()
+def load_json(filename, verbose=True):
     t = time.time()
     with open(filename, 'r') as fp:
         data = json.load(fp)
-
-    print time.time() - t
+    _timed('load', 'json', filename, t, verbose)
     return data
 
 
-def load_txt(filename, delimiter=','):
-    print '--> Loading ', filename, ' with np.loadtxt was ',
-    sys.stdout.flush()
+def write_json_line(fp, obj):
+    """
+    writes one object as a line of a json lines (.ndjson) file, and flushes it
+    :param fp: file open for writing
+    :param obj: object that can be saved as json
+    :return:
+    """
+    fp.write(json.dumps(obj) + '\n')
+    fp.flush()
+
+
+def iter_json_lines(filename):
+    """
+    reads a json lines (.ndjson) file one object at a time. A last line that was not fully written is skipped
+    :param filename: str
+    :return: generator of objects
+    """
+    with open(filename, 'r') as fp:
+        for line in fp:
+            if not line.endswith('\n'):
+                break
+            yield json.loads(line)
+
+
+def repair_json_lines(filename):
+    """
+    removes a last line that was not fully written (eg the program was interrupted), so that lines can be appended
+    :param filename: str
+    :return:
+    """
+    with open(filename, 'rb+') as fp:
+        fp.seek(0, os.SEEK_END)
+        position = fp.tell()
+        while position > 0:  # look for the last new line, from the end of the file backwards
+            step = min(4096, position)
+            position -= step
+            fp.seek(position)
+            index = fp.read(step).rfind('\n')
+            if index != -1:
+                fp.truncate(position + index + 1)
+                return
+        fp.truncate(0)
+
+
+COLUMNS_MAGIC = 'CANVCOL1'
+COLUMNS_ALIGNMENT = 64
+
+
+def _column_array(values):
+    """
+    :param values: list (or np.array) with the values of one column
+    :return: np.array with a fixed size type (numbers, or unicode strings), that can be memory mapped
+    """
+    array = np.asarray(values)
+    if array.dtype != object:
+        return array
+    try:  # numbers with missing values
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array([u'' if v is None else unicode(v) for v in values])
+
+
+def save_columns(filename, columns, metadata=None, verbose=True):
+    """
+    saves a table in a typed, columnar binary file. The file starts with a json header (names, types and offsets of
+    the columns, number of rows, metadata), followed by the raw data of each column. load_columns memory maps the
+    columns, without parsing or copying them.
+    :param filename: str
+    :param columns: list of (name, list of values or np.array), all columns must have the same length
+    :param metadata: dictionary saved in the header (anything that can be saved as json)
+    :param verbose: boolean print the time it took
+    :return:
+    """
+    make_dir(filename)
+    t = time.time()
+
+    arrays = [_column_array(values) for _, values in columns]
+    rows = len(arrays[0]) if arrays else 0
+    header = {'rows': rows, 'metadata': metadata or {}, 'columns': []}
+    offset = 0
+    for (name, _), array in zip(columns, arrays):
+        if len(array) != rows:
+            raise ValueError('column %s has %d rows instead of %d' % (name, len(array), rows))
+        header['columns'].append({'name': name, 'dtype': array.dtype.str, 'offset': offset})
+        offset += array.nbytes
+        offset += -offset % COLUMNS_ALIGNMENT
+
+    header = json.dumps(header)
+    start = len(COLUMNS_MAGIC) + 8 + len(header)
+    start += -start % COLUMNS_ALIGNMENT  # the columns start aligned
+    with open(filename, 'wb') as fp:
+        fp.write(COLUMNS_MAGIC)
+        fp.write(struct.pack('<Q', len(header)))
+        fp.write(header)
+        for array in arrays:
+            fp.write('\0' * (-fp.tell() % COLUMNS_ALIGNMENT))  # each column starts aligned
+            fp.write(np.ascontiguousarray(array).tostring())
+    _timed('save', 'columns', filename, t, verbose)
+
+
+def save_column_chunks(filename, names, chunks, metadata=None, verbose=True):
+    """
+    Same as save_columns, for a table that is made a part at a time (eg read from a large file), so that it is never
+    in memory whole. The file is the same as save_columns would save for all the rows.
+    :param filename: str
+    :param names: list with the name of each column
+    :param chunks: function that returns an iterable of chunks, each a list of rows (a value for each column). It is
+    called twice, once to find the type of every column and the number of rows, and once to write them
+    :param metadata: dictionary saved in the header (anything that can be saved as json)
+    :param verbose: boolean print the time it took
+    :return:
+    """
+    make_dir(filename)
+    t = time.time()
+
+    dtypes = [None] * len(names)
+    missing = [False] * len(names)
+    rows = 0
+    for chunk in chunks():
+        rows += len(chunk)
+        for i, values in enumerate(zip(*chunk)):
+            present = [v for v in values if v is not None]
+            missing[i] = missing[i] or len(present) < len(values)
+            if present:
+                dtype = _column_array(present).dtype
+                dtypes[i] = dtype if dtypes[i] is None else np.promote_types(dtypes[i], dtype)
+    for i, dtype in enumerate(dtypes):  # the types save_columns gives to the whole columns
+        if dtype is None or (missing[i] and dtype.kind in 'biu'):
+            dtypes[i] = np.dtype(np.float64)
+
+    header = {'rows': rows, 'metadata': metadata or {}, 'columns': []}
+    offsets = []
+    end = 0
+    for name, dtype in zip(names, dtypes):
+        end += -end % COLUMNS_ALIGNMENT
+        offsets.append(end)
+        header['columns'].append({'name': name, 'dtype': dtype.str, 'offset': end})
+        end += dtype.itemsize * rows
+    header = json.dumps(header)
+    start = len(COLUMNS_MAGIC) + 8 + len(header)
+    start += -start % COLUMNS_ALIGNMENT
+
+    written = 0
+    with open(filename, 'wb') as fp:
+        fp.write(COLUMNS_MAGIC)
+        fp.write(struct.pack('<Q', len(header)))
+        fp.write(header)
+        for chunk in chunks():
+            if written + len(chunk) > rows:
+                raise ValueError('the chunks of %s have more rows the second time' % filename)
+            for i, values in enumerate(zip(*chunk)):  # each column of the chunk goes after the rows written before it
+                empty = u'' if dtypes[i].kind == 'U' else np.nan
+                fp.seek(start + offsets[i] + written * dtypes[i].itemsize)
+                fp.write(np.array([empty if v is None else v for v in values], dtype=dtypes[i]).tostring())
+            written += len(chunk)
+        if written != rows:
+            raise ValueError('the chunks of %s have fewer rows the second time' % filename)
+        fp.truncate(start + end)  # the gaps between the columns are zeros, as the padding of save_columns
+    _timed('save', 'columns', filename, t, verbose)
+
+
+def load_columns(filename):
+    """
+    memory maps a file saved with save_columns. Nothing is read until the columns are used.
+    :param filename: str
+    :return: list of (name, read only np.array) in the order they were saved, and the metadata dictionary
+    """
+    with open(filename, 'rb') as fp:
+        if fp.read(len(COLUMNS_MAGIC)) != COLUMNS_MAGIC:
+            raise ValueError('%s is not a columns file' % filename)
+        length, = struct.unpack('<Q', fp.read(8))
+        header = json.loads(fp.read(length))
+    start = len(COLUMNS_MAGIC) + 8 + length
+    start += -start % COLUMNS_ALIGNMENT
+
+    columns = []
+    for column in header['columns']:
+        dtype = np.dtype(column['dtype'])
+        if header['rows'] == 0 or dtype.itemsize == 0:
+            array = np.zeros(header['rows'], dtype=dtype)
+        else:
+            array = np.memmap(filename, dtype=dtype, mode='r', offset=start + column['offset'],
+                              shape=(header['rows'],))
+        columns.append((column['name'], array))
+    return columns, header['metadata']
+
+
+def export_csv(filename, csv_filename, verbose=True):
+    """
+    saves a file of save_columns as a csv file, with the names of the columns as the first row
+    :param filename: str columns file
+    :param csv_filename: str
+    :param verbose: boolean print the time it took
+    :return:
+    """
+    columns, _ = load_columns(filename)
+    rows = [[name for name, _ in columns]]
+    for row in zip(*[array.tolist() for _, array in columns]):
+        rows.append([v.encode('utf-8') if isinstance(v, unicode) else v for v in row])
+    save_csv(csv_filename, rows, verbose=verbose)
+
+
+def load_txt(filename, delimiter=',', verbose=True):
     t = time.time()
     d = np.loadtxt(filename, delimiter=delimiter)
-    print time.time() - t
+    _timed('load', 'np.loadtxt', filename, t, verbose)
     return d
@@ -0,0 +1,147 @@
+# __author__ = 'dimitrios'
+from __future__ import division
+import numpy as np
+
+
+class GradingEngine(object):
+    """
+    Computes the gradebook of a course with numpy arrays instead of loops over students and groups.
+    The grades are kept in a Students x Assignments score matrix. Each assignment has the index of its group and its
+    max points, so that the scores of all students are aggregated by group at once (a product with a one hot
+    Assignments x Groups matrix).
+    Only graded submissions count. The drop rules of each group (drop_lowest, drop_highest, never_drop) are applied,
+    dropping the assignments with the lowest (highest) percentage. The total is the weighted average of the group
+    percentages when the course applies assignment group weights (groups without graded work are left out, and the
+    weights of the rest are scaled up, as canvas does), and the percentage of all the points otherwise.
+    """
+
+    def __init__(self, assignments, groups, apply_weights=False):
+        """
+        :param assignments: list of assignment dictionaries (as returned by get_assignments)
+        :param groups: list of assignment group dictionaries (as returned by get_assignment_groups)
+        :param apply_weights: boolean the apply_assignment_group_weights setting of the course
+        """
+        self.assignment_ids = [a['id'] for a in assignments]
+        self.columns = dict((a_id, i) for i, a_id in enumerate(self.assignment_ids))
+        self.points = np.array([a['points_possible'] or 0 for a in assignments], dtype=np.float64)
+
+        group_position = dict((g['id'], i) for i, g in enumerate(groups))
+        self.group_index = np.array([group_position.get(a['assignment_group_id'], -1) for a in assignments],
+                                    dtype=np.int64)
+        self.group_matrix = np.zeros((len(assignments), len(groups)))
+        known = self.group_index >= 0
+        self.group_matrix[np.flatnonzero(known), self.group_index[known]] = 1
+
+        self.weights = np.array([g.get('group_weight') or 0 for g in groups], dtype=np.float64)
+        self.rules = [g.get('rules') or {} for g in groups]
+        self.apply_weights = apply_weights
+
+    def score_matrix(self, grades, user_ids):
+        """
+        :param grades: dictionary from anonymized id to a dictionary from assignment id to grade (None if submitted but
+        not graded yet), for the assignments that each student submitted
+        :param user_ids: list of anonymized ids, one for each row
+        :return: Students x Assignments matrix of scores (0 where there is no submission, nan where it is not graded),
+        and Students x Assignments boolean matrix of the graded submissions
+        """
+        rows, columns, values = [], [], []
+        for row, user_id in enumerate(user_ids):
+            for assignment_id, grade in grades.get(user_id, {}).iteritems():
+                if assignment_id not in self.columns:
+                    continue
+                rows.append(row)
+                columns.append(self.columns[assignment_id])
+                values.append(np.nan if grade is None else float(grade))
+
+        scores = np.zeros((len(user_ids), len(self.assignment_ids)))
+        graded = np.zeros(scores.shape, dtype=bool)
+        scores[rows, columns] = values
+        graded[rows, columns] = True
+        return scores, graded & ~np.isnan(scores)
+
+    def _drop(self, scores, counted):
+        """
+        Applies the drop rules of each group, by removing the dropped assignments from counted
+        :param scores: Students x Assignments matrix
+        :param counted: Students x Assignments boolean matrix of the grades that count
+        :return: counted, without the dropped grades
+        """
+        counted = counted.copy()
+        for g, rules in enumerate(self.rules):
+            drop_lowest = rules.get('drop_lowest', 0) or 0
+            drop_highest = rules.get('drop_highest', 0) or 0
+            if drop_lowest == 0 and drop_highest == 0:
+                continue
+            never_drop = set(rules.get('never_drop', []) or [])
+            columns = np.flatnonzero((self.group_index == g) &
+                                     np.array([a_id not in never_drop for a_id in self.assignment_ids]))
+            if len(columns) == 0:
+                continue
+
+            mask = counted[:, columns]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                percentage = np.where(self.points[columns] > 0, scores[:, columns] / self.points[columns], 0)
+            # keep at least one grade of the group
+            kept = np.maximum(counted[:, self.group_index == g].sum(axis=1) - 1, 0)
+            lowest = np.minimum(drop_lowest, np.minimum(kept, mask.sum(axis=1)))
+            highest = np.minimum(drop_highest, np.minimum(kept, mask.sum(axis=1)) - lowest)
+
+            # rank of each grade from the lowest (and the highest) up, the grades that do not count go last
+            ascending = np.argsort(np.argsort(np.where(mask, percentage, np.inf), axis=1, kind='mergesort'), axis=1)
+            descending = np.argsort(np.argsort(np.where(mask, -percentage, np.inf), axis=1, kind='mergesort'), axis=1)
+            dropped = mask & ((ascending < lowest[:, None]) | (descending < highest[:, None]))
+            counted[:, columns] = mask & ~dropped
+        return counted
+
+    def group_points(self, scores, graded):
+        """
+        :param scores: Students x Assignments matrix from score_matrix
+        :param graded: Students x Assignments boolean matrix from score_matrix
+        :return: two Students x Groups matrices, the points received and the points possible of the grades that count
+        """
+        counted = self._drop(scores, graded)
+        received = np.where(counted, scores, 0).dot(self.group_matrix)
+        possible = (counted * self.points).dot(self.group_matrix)
+        return received, possible
+
+    def group_percentages(self, scores, graded):
+        """
+        :param scores: Students x Assignments matrix from score_matrix
+        :param graded: Students x Assignments boolean matrix from score_matrix
+        :return: Students x Groups matrix with the percentage of each group, -1 for groups without graded work
+        """
+        return self.percentages_and_totals(scores, graded)[0]
+
+    def totals(self, scores, graded):
+        """
+        :param scores: Students x Assignments matrix from score_matrix
+        :param graded: Students x Assignments boolean matrix from score_matrix
+        :return: vector with the final percentage of each student, -1 for students without graded work
+        """
+        return self.percentages_and_totals(scores, graded)[1]
+
+    def percentages_and_totals(self, scores, graded):
+        """
+        Same as group_percentages and totals, with the drop rules applied once for both
+        :param scores: Students x Assignments matrix from score_matrix
+        :param graded: Students x Assignments boolean matrix from score_matrix
+        :return: the Students x Groups matrix of group_percentages and the vector of totals
+        """
+        received, possible = self.group_points(scores, graded)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percentages = np.where(possible != 0, received / possible * 100, -1.0)
+            if self.apply_weights:
+                has_work = possible != 0
+                weights = np.where(has_work, self.weights, 0)
+                weighted = np.where(has_work, received / possible * 100, 0) * weights
+                total_weight = weights.sum(axis=1)
+                return percentages, np.where(total_weight != 0, weighted.sum(axis=1) / total_weight, -1.0)
+
+            all_possible = possible.sum(axis=1)
+            return percentages, np.where(all_possible != 0, received.sum(axis=1) / all_possible * 100, -1.0)
+
+    def group_max_points(self):
+        """
+        :return: vector with the points possible of all the assignments in each group
+        """
+        return self.points.dot(self.group_matrix)
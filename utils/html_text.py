@@ -0,0 +1,172 @@
+# __author__ = 'dimitrios'
+from HTMLParser import HTMLParser
+from multiprocessing import Pool
+from bs4.dammit import EntitySubstitution
+
+
+class _TextParser(HTMLParser):
+    """
+    Collects the text of an html document, the way BeautifulSoup(text, 'html.parser').get_text() does, without
+    building the tree: entities are converted the same way, comments, declarations and processing instructions are
+    dropped, and so is the content of script, style and template tags. A string between two tags that is only
+    whitespace becomes a single newline (or space), unless it is inside pre or textarea.
+    """
+    HIDDEN_TAGS = {'script', 'style', 'template'}
+    PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+    ASCII_SPACES = u'\x20\x0a\x09\x0c\x0d'
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.pieces = []
+        self.data = []  # the pieces of the string that is being read (up to the next tag)
+        self.tags = []  # stack of the open tags
+
+    def _end_data(self):
+        """
+        The current string ended (a tag, comment etc follows)
+        """
+        if not self.data:
+            return
+        data = u''.join(self.data)
+        self.data = []
+        if self.HIDDEN_TAGS.intersection(self.tags):
+            return
+        if not data.strip(self.ASCII_SPACES) and not self.PRESERVE_WHITESPACE_TAGS.intersection(self.tags):
+            data = u'\n' if u'\n' in data else u' '
+        self.pieces.append(data)
+
+    def handle_starttag(self, tag, attrs):
+        self._end_data()
+        self.tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._end_data()
+
+    def handle_endtag(self, tag):
+        self._end_data()
+        if tag in self.tags:  # close it, and everything that was left open inside it
+            while self.tags.pop() != tag:
+                pass
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def handle_comment(self, data):
+        self._end_data()
+
+    def handle_decl(self, data):
+        self._end_data()
+
+    def handle_pi(self, data):
+        self._end_data()
+
+    def handle_charref(self, name):
+        # same as bs4.builder._htmlparser.BeautifulSoupHTMLParser.handle_charref
+        if name.startswith('x') or name.startswith('X'):
+            number = int(name.lstrip('xX'), 16)
+        else:
+            number = int(name)
+
+        data = None
+        if number < 256:
+            try:  # numbers that are meant as windows-1252 characters (eg &#147;)
+                data = bytearray([number]).decode('windows-1252')
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = unichr(number)
+            except (ValueError, OverflowError):
+                pass
+        self.handle_data(data or u'\N{REPLACEMENT CHARACTER}')
+
+    def handle_entityref(self, name):
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        if character is None:
+            character = '&%s' % name  # not an entity, the literal string
+        self.handle_data(character)
+
+    def unknown_decl(self, data):
+        self._end_data()
+        if data.upper().startswith('CDATA['):  # get_text keeps CDATA sections, as a string of their own
+            self.handle_data(data[len('CDATA['):])
+            self._end_data()
+
+    def error(self, message):
+        # same as bs4's BeautifulSoupHTMLParser: the python 2 HTMLParser raises on strings that end in the middle of an
+        # entity (eg u'Q&A'), bs4 ignores it. close() then keeps the unfinished entity as literal text
+        pass
+
+    def text(self):
+        self._end_data()
+        return u''.join(self.pieces)
+
+
+def html_to_text(text):
+    """
+    Removes the html tags and converts the entities of a string. Same result as
+    BeautifulSoup(text, 'html.parser').get_text(), several times faster
+    :param text: unicode
+    :return: unicode
+    """
+    if isinstance(text, unicode) and u'<' not in text and u'&' not in text and text.strip(_TextParser.ASCII_SPACES):
+        return text  # nothing to parse (only whitespace is collapsed, as in get_text)
+    parser = _TextParser()
+    parser.feed(text)
+    parser.close()
+    return parser.text()
+
+
+class HTMLTextCleaner(object):
+    """
+    Turns the html of titles, messages and replies into plain text.
+    Results are memoized, since the same bodies come up again and again (quoted replies, repeated announcements).
+    clean_many cleans a batch at once, and spreads large batches over a process pool.
+    """
+    def __init__(self, max_memo=100000, processes=None, min_parallel=5000):
+        """
+        :param max_memo: int max number of memoized bodies (the memo is cleared when it gets full)
+        :param processes: int size of the process pool of clean_many. None means the number of cpus
+        :param min_parallel: int batches with fewer new bodies than this are cleaned in this process
+        """
+        self.max_memo = max_memo
+        self.processes = processes
+        self.min_parallel = min_parallel
+        self.memo = {}
+
+    def _remember(self, text, clean):
+        if len(self.memo) >= self.max_memo:
+            self.memo.clear()
+        self.memo[text] = clean
+
+    def clean(self, text):
+        """
+        :param text: string with html
+        :return: unicode, the text only
+        """
+        clean = self.memo.get(text)
+        if clean is None:
+            clean = html_to_text(text)
+            self._remember(text, clean)
+        return clean
+
+    def clean_many(self, texts):
+        """
+        :param texts: list of strings with html
+        :return: list of unicode, in the same order
+        """
+        new = list(set(t for t in texts if t not in self.memo))
+        if len(new) >= self.min_parallel:
+            pool = Pool(self.processes)
+            try:
+                cleaned = pool.map(html_to_text, new, chunksize=256)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            cleaned = map(html_to_text, new)
+
+        results = dict(zip(new, cleaned))
+        for text, clean in results.items():
+            self._remember(text, clean)
+        return [results[t] if t in results else self.clean(t) for t in texts]
@@ -2,6 +2,9 @@
 import matplotlib
 matplotlib.use('Agg')   # for server use
 import matplotlib.pyplot as plt
+import threading
+
+_plot_lock = threading.Lock()  # pyplot keeps one current figure per process, crawlers in threads take turns
 
 def plot_bars(data, legend, color='blue'):
     plt.bar(range(len(data)), data, color=color, label=legend, alpha=0.75)
@@ -17,13 +20,16 @@ def save_bars(filename, data, names, xlabel=None):
     :return:
     """
     colors = ['blue', 'red', 'green', 'cyan', 'yellow']
-    i = 0
-    for d in data:
-        plot_bars(d, names[i], color=colors[i])
-        i += 1
+    with _plot_lock:
+        plt.figure()  # a new figure, so that the plots of different courses are not drawn on top of each other
+        i = 0
+        for d in data:
+            plot_bars(d, names[i], color=colors[i])
+            i += 1
 
-    plt.legend(loc='upper right')
-    if xlabel is not None:
-        plt.xlabel(xlabel)
-    plt.grid(True)
-    plt.savefig(filename)
+        plt.legend(loc='upper right')
+        if xlabel is not None:
+            plt.xlabel(xlabel)
+        plt.grid(True)
+        plt.savefig(filename)
+        plt.close()